@@ -0,0 +1,74 @@
+""" Memory benchmark of AEPObject versus CompactAEPObject for large listings.
+
+Builds 100k flowrun objects from synthetic list responses and reports the memory
+held by the objects (tracemalloc) and, in a separate run without tracing, the
+construction time.
+
+Run it from the root of the repository, with the package on the path:
+
+    PYTHONPATH=. python benchmarks/bench_compact_objects.py [number of objects]
+"""
+import gc
+import sys
+import time
+import tracemalloc
+from paaw.models.abstractmodel import CompactAEPObject
+from paaw.models.flowservice import FlowRun
+
+
+def flowrun_definition(i: int) -> dict:
+    return {
+        'id': 'run-{:08d}-0000-0000-0000-000000000000'.format(i),
+        'flowId': 'flow-{:04d}-0000-0000-0000-000000000000'.format(i % 500),
+        'createdAt': 1600000000000 + i,
+        'updatedAt': 1600000360000 + i,
+        'createdBy': 'technical-account@techacct.adobe.com',
+        'etag': '"0a00{:04x}-0000-0200-0000-5f5a7b2b0000"'.format(i % 65536),
+        'metrics': {
+            'durationSummary': {'startedAtUTC': 1600000000000 + i, 'completedAtUTC': 1600000360000 + i},
+            'sizeSummary': {'inputBytes': 1024 * i, 'outputBytes': 900 * i},
+            'recordSummary': {'inputRecordCount': i, 'outputRecordCount': i, 'failedRecordCount': 0},
+            'fileSummary': {'inputFileCount': 1, 'outputFileCount': 1},
+            'statusSummary': {'status': 'success', 'errors': []},
+        },
+        'activities': [{'id': 'copy', 'status': 'success'}, {'id': 'promotion', 'status': 'success'}],
+    }
+
+
+def measure(label: str, build, n: int, page_size: int):
+    def pages():
+        # the list responses are built per page and dropped after construction, like a paginated listing
+        for offset in range(0, n, page_size):
+            yield [flowrun_definition(i) for i in range(offset, min(offset + page_size, n))]
+
+    prebuilt = list(pages())
+    start = time.perf_counter()
+    for page in prebuilt:
+        build(page)
+    seconds = time.perf_counter() - start
+    del prebuilt
+
+    gc.collect()
+    tracemalloc.start()
+    objects = []
+    for page in pages():
+        objects.extend(build(page))
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('{:<18} {:>8.1f} MB held {:>8.1f} MB peak {:>7.2f}s to build  ({} objects)'.format(
+        label, current / 2**20, peak / 2**20, seconds, len(objects)))
+    return objects
+
+
+def main(n: int = 100000, page_size: int = 1000):
+    full = measure('AEPObject', lambda page: [FlowRun(item, None, item['id']) for item in page], n, page_size)
+    del full
+    compact = measure('CompactAEPObject', lambda page: CompactAEPObject.from_definitions(FlowRun, page, None),
+                      n, page_size)
+    start = time.perf_counter()
+    statuses = sum(obj.definition['metrics']['statusSummary']['status'] == 'success' for obj in compact[:10000])
+    print('lazy parse of 10k definitions: {:.2f}s ({} succeeded)'.format(time.perf_counter() - start, statuses))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
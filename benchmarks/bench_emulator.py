@@ -0,0 +1,144 @@
+""" End-to-end benchmarks of the current code paths against the local AEP emulator.
+
+Measures listing (paginated flowruns, full and compact), downloading (all files of a
+dataset, sequential and streamed), polling (many jobs in one JobWaiter loop) and deploy
+throughput (reconciling a directory of scheduled queries, creating engines with artifacts)
+and lookups of many datasets (one by one and batched).
+Every request gets the configured emulator latency, so the numbers show how much the
+code paths overlap and batch their requests rather than raw local speed.
+
+Run it from the root of the repository, with the package on the path:
+
+    PYTHONPATH=. python benchmarks/bench_emulator.py [--latency 0.02] [--only listing,download]
+"""
+import argparse
+import os
+import tempfile
+import time
+import warnings
+import yaml
+from paaw import AEP
+from paaw.testing import AEPEmulator
+from paaw.utils.instrumentation import MetricsCollector
+from paaw.utils.waiter import JobWaiter, wait_for_jobs
+
+RESULTS = []
+
+
+def timed(name: str, func, aep: AEP, units: int = None, unit: str = 'items'):
+    metrics = MetricsCollector()
+    aep.hooks.append(metrics)
+    start = time.perf_counter()
+    try:
+        func()
+    finally:
+        seconds = time.perf_counter() - start
+        aep.hooks.remove(metrics)
+    requests = sum(row['count'] for row in metrics.summary())
+    rate = '{:.0f} {}/s'.format(units / seconds, unit) if units else ''
+    RESULTS.append((name, seconds, requests, rate))
+    print('{:<40} {:>8.2f}s {:>6} requests  {}'.format(name, seconds, requests, rate))
+
+
+def write_yaml(directory: str, name: str, data: dict) -> str:
+    path = os.path.join(directory, name)
+    with open(path, 'w') as f:
+        yaml.safe_dump(data, f)
+    return path
+
+
+def bench_listing(emulator: AEPEmulator, aep: AEP, tmp: str):
+    flow_id = emulator.add_flow(runs=5000)
+    flow = aep.flow_service.get_flow(flow_id)
+    timed('list 5000 flowruns (100 per page)', flow.get_flowruns, aep, 5000, 'runs')
+    timed('list 5000 flowruns compact', lambda: flow.get_flowruns(compact=True), aep, 5000, 'runs')
+    for i in range(300):
+        emulator.add_schedule('bench_query_{}'.format(i))
+    timed('list 300 scheduled queries', aep.query_service.get_all_scheduledqueries, aep, 300, 'queries')
+
+
+def bench_download(emulator: AEPEmulator, aep: AEP, tmp: str):
+    dataset_id = emulator.add_dataset(batches=4, files_per_batch=4, rows_per_file=20000)
+    dataset = aep.catalog_service.get_dataset(dataset_id)
+
+    def sequential():
+        for batch in dataset.get_batches():
+            for datasetfile in batch.get_datasetfiles():
+                datasetfile.get_all_files_as_arrowtable()
+
+    def streamed():
+        for batch in dataset.get_batches():
+            for datasetfile in batch.get_datasetfiles():
+                for pathname in datasetfile.get_pathnames():
+                    datasetfile.download_file_at_pathname(pathname, os.path.join(tmp, datasetfile.id + '.parquet'))
+
+    timed('download 16 files into arrow', sequential, aep, 16, 'files')
+    timed('stream 16 files to disk', streamed, aep, 16, 'files')
+    config = write_yaml(tmp, 'export.yaml', {'destination': {'datasetId': dataset_id}})
+    export_dir = os.path.join(tmp, 'export')
+    os.makedirs(export_dir, exist_ok=True)
+    timed('export_to with arrow decoding', lambda: aep.segmentation_service.export_to(
+        config, {}, export_dir, as_arrow=True, waiter=JobWaiter(initial_interval=0.1, max_interval=0.5)), aep)
+
+
+def bench_polling(emulator: AEPEmulator, aep: AEP, tmp: str):
+    config = write_yaml(tmp, 'segmentjob.yaml', {'segments': [{'segmentId': 'bench'}]})
+    jobs = [aep.segmentation_service.create_segmentjob(config, {}) for _ in range(50)]
+    timed('wait for 50 segment jobs', lambda: wait_for_jobs(jobs, initial_interval=0.1, max_interval=0.5),
+          aep, 50, 'jobs')
+    flow_ids = [emulator.add_flow() for _ in range(20)]
+    timed('start and watch 20 flowruns', lambda: wait_for_jobs(
+        list(aep.flow_service.start_flowruns(flow_ids)[0].values()), initial_interval=0.1, max_interval=0.5),
+        aep, 20, 'runs')
+
+
+def bench_deploy(emulator: AEPEmulator, aep: AEP, tmp: str):
+    config_dir = os.path.join(tmp, 'queries')
+    os.makedirs(config_dir, exist_ok=True)
+    for i in range(50):
+        write_yaml(config_dir, 'query_{}.yaml'.format(i), {
+            'query': {'name': 'deploy_query_{}'.format(i), 'sql': 'SELECT {}'.format(i), 'dbName': 'prod:all'},
+            'schedule': {'schedule': '0 {} * * *'.format(i % 24)}})
+    timed('reconcile 50 scheduled queries', lambda: aep.query_service.reconcile_scheduledqueries(
+        config_dir, requests_per_second=None), aep, 50, 'queries')
+    artifact = os.path.join(tmp, 'model.bin')
+    with open(artifact, 'wb') as f:
+        f.write(os.urandom(5 * 1024 * 1024))
+    config = write_yaml(tmp, 'engine.yaml', {'name': 'bench', 'type': 'Python'})
+    timed('create 5 engines with a 5 MiB artifact', lambda: [
+        aep.sensei.create_engine(config, {}, artifacts={'defaultArtifact': artifact}) for _ in range(5)],
+        aep, 5, 'engines')
+
+
+def bench_lookup(emulator: AEPEmulator, aep: AEP, tmp: str):
+    dataset_ids = [emulator.add_dataset('lookup_{}'.format(i), batches=0) for i in range(500)]
+    timed('get 500 datasets one by one', lambda: [aep.catalog_service.get_dataset(dataset_id)
+                                                  for dataset_id in dataset_ids], aep, 500, 'datasets')
+    timed('get 500 datasets batched', lambda: aep.catalog_service.get_datasets(dataset_ids), aep, 500, 'datasets')
+
+
+BENCHMARKS = {
+    'listing': bench_listing,
+    'download': bench_download,
+    'polling': bench_polling,
+    'deploy': bench_deploy,
+    'lookup': bench_lookup,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds of latency per request')
+    parser.add_argument('--job-duration', type=float, default=1.0, help='seconds until emulated jobs finish')
+    parser.add_argument('--only', default=','.join(BENCHMARKS), help='comma separated benchmarks to run')
+    args = parser.parse_args()
+    warnings.simplefilter('ignore')
+    with AEPEmulator(latency=args.latency, job_duration=args.job_duration) as emulator:
+        aep = AEP(config_data=emulator.config_data())
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in args.only.split(','):
+                BENCHMARKS[name](emulator, aep, tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+""" Stress test of one AEP instance shared by many threads, against the local AEP emulator.
+
+Runs thousands of mixed calls concurrently (catalog reads, flowrun listings, scheduled
+query listings, file downloads and multipart engine uploads) and checks that:
+
+- every call succeeds,
+- no request carries headers of another endpoint, e.g. a multipart Content-Type,
+- every request carries the sandbox header,
+- the connection pool never discards connections because it is too small,
+- concurrent retrievals of the same artifact return the same object.
+
+Run it from the root of the repository, with the package on the path:
+
+    PYTHONPATH=. python benchmarks/stress_threads.py [--calls 4000] [--threads 32] [--http2]
+
+With --http2 the requests, including the streamed multipart uploads, go through the
+HTTP/2 adapter (needs the httpx[http2] package).
+"""
+import argparse
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+import warnings
+from collections import Counter
+import yaml
+from paaw import AEP
+from paaw.testing import AEPEmulator
+from paaw.utils.concurrency import run_concurrently
+
+
+class CheckingEmulator(AEPEmulator):
+    """ Emulator that checks the headers of every request it handles.
+    """
+
+    def __init__(self, sandbox_name: str, **kwargs):
+        super().__init__(**kwargs)
+        self.sandbox_name = sandbox_name
+        self.violations = []
+        self._violations_lock = threading.Lock()
+
+    def handle(self, method, raw_path, headers, body):
+        headers = {name.lower(): value for name, value in headers.items()}
+        content_type = headers.get('content-type', '')
+        problems = []
+        if 'multipart' in content_type and '/sensei/engines' not in raw_path:
+            problems.append('multipart Content-Type on ' + raw_path)
+        if '/ims/' not in raw_path and headers.get('x-sandbox-name') != self.sandbox_name:
+            problems.append('sandbox {} on {}'.format(headers.get('x-sandbox-name'), raw_path))
+        if problems:
+            with self._violations_lock:
+                self.violations.extend(problems)
+        return super().handle(method, raw_path, headers, body)
+
+
+class PoolWarnings(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=4000, help='number of calls')
+    parser.add_argument('--threads', type=int, default=32, help='number of threads')
+    parser.add_argument('--latency', type=float, default=0.005, help='seconds of latency per request')
+    parser.add_argument('--http2', action='store_true', help='send the requests through the HTTP/2 adapter')
+    args = parser.parse_args()
+    warnings.simplefilter('ignore')
+    pool_warnings = PoolWarnings()
+    logging.getLogger('urllib3.connectionpool').addHandler(pool_warnings)
+
+    with CheckingEmulator('stress', latency=args.latency, job_duration=0.1) as emulator, \
+            tempfile.TemporaryDirectory() as tmp:
+        config_data = emulator.config_data(sandbox_name='stress')
+        if args.http2:
+            config_data += 'Transport:\n  http2: true\n'
+        aep = AEP(config_data=config_data, pool_maxsize=args.threads)
+        dataset_ids = [emulator.add_dataset(batches=2, files_per_batch=1, rows_per_file=100) for _ in range(8)]
+        flow_ids = [emulator.add_flow(runs=150) for _ in range(4)]
+        for i in range(50):
+            emulator.add_schedule('stress_query_{}'.format(i))
+        engine_config = os.path.join(tmp, 'engine.yaml')
+        with open(engine_config, 'w') as f:
+            yaml.safe_dump({'name': 'stress', 'type': 'Python'}, f)
+        artifact = os.path.join(tmp, 'model.bin')
+        with open(artifact, 'wb') as f:
+            f.write(os.urandom(64 * 1024))
+
+        identities = {}
+        identities_lock = threading.Lock()
+
+        def get_dataset():
+            dataset = aep.catalog_service.get_dataset(random.choice(dataset_ids))
+            with identities_lock:
+                # while both are alive, the identity map must hand out one object per id
+                if identities.setdefault(dataset.id, dataset) is not dataset:
+                    raise AssertionError('two objects for dataset ' + dataset.id)
+
+        def list_batches():
+            aep.catalog_service.get_dataset(random.choice(dataset_ids)).get_batches()
+
+        def list_flowruns():
+            aep.flow_service.get_flow(random.choice(flow_ids)).get_flowruns()
+
+        def list_schedules():
+            aep.query_service.get_all_scheduledqueries()
+
+        def download():
+            batch = random.choice(aep.catalog_service.get_dataset(random.choice(dataset_ids)).get_batches())
+            for datasetfile in batch.get_datasetfiles():
+                datasetfile.get_all_files_as_arrowtable()
+
+        def create_engine():
+            aep.sensei.create_engine(engine_config, {}, artifacts={'defaultArtifact': artifact})
+
+        operations = [get_dataset] * 8 + [list_batches] * 4 + [list_flowruns, list_schedules, download] + \
+                     [create_engine] * 2
+        calls = [random.choice(operations) for _ in range(args.calls)]
+        start = time.perf_counter()
+        outcomes = run_concurrently(lambda operation: operation(), calls, max_workers=args.threads)
+        seconds = time.perf_counter() - start
+
+        errors = Counter('{}: {!r}'.format(operation.__name__, error)
+                         for operation, _, error in outcomes if error is not None)
+        counts = Counter(operation.__name__ for operation in calls)
+        print('{} calls in {:.2f}s on {} threads ({:.0f} calls/s)'.format(
+            len(calls), seconds, args.threads, len(calls) / seconds))
+        print('calls:', dict(counts))
+        print('requests:', dict(emulator.request_counts))
+        failed = False
+        for message, count in errors.most_common(10):
+            print('ERROR x{}: {}'.format(count, message))
+            failed = True
+        for violation in emulator.violations[:10]:
+            print('HEADER:', violation)
+            failed = True
+        for message in pool_warnings.messages[:10]:
+            print('POOL:', message)
+            failed = True
+        print('FAILED' if failed else 'OK')
+        raise SystemExit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1 +1,5 @@
-from .aep import AEP
\ No newline at end of file
+from .aep import AEP
+from .pool import AEPPool
+from .deploy import Deployment
+from .cleanup import Cleanup
+from .catalogindex import CatalogIndex
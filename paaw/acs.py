@@ -2,6 +2,7 @@ import requests
 from typing import List, Dict, Tuple, Union
 from .utils.yamlconfig_parser import parse_config
 from .utils.authentication import get_headers
+from .utils.transport import TransportConfig, create_session
 
 
 class ACS:
@@ -13,6 +14,6 @@ class ACS:
         """
         cfg = parse_config(path=config_path, data=config_data)
 
-        self.session = requests.Session()
-        headers = get_headers(cfg)
+        self.session = create_session(TransportConfig.from_config(cfg))
+        headers = get_headers(cfg, self.session)
         self.session.headers.update(headers)
\ No newline at end of file
@@ -1,7 +1,12 @@
 import requests
-from typing import List, Dict, Tuple, Union
+from dictor import dictor
+from types import MappingProxyType
+from typing import List, Dict, Mapping, Tuple, Union
 from .utils.yamlconfig_parser import parse_config
 from .utils.authentication import get_headers
+from .utils.instrumentation import Hook, body_size, call_with_hooks
+from .utils.resilience import EndpointPolicy
+from .utils.transport import TransportConfig, create_session
 from .models.sensei import Sensei
 from .models.catalogservice import CatalogService
 from .models.queryservice import QueryService
@@ -11,11 +16,15 @@ from .models.dataaccess import DataAccess
 from .models.flowservice import FlowService
 import json
 import os
+import threading
 import warnings
+import weakref
 
 
 class AEP:
-    def __init__(self, config_path: str = None, config_data: str = None):
+    def __init__(self, config_path: str = None, config_data: str = None,
+                 sandbox_name: str = None, session: requests.Session = None, platform_gateway: str = None,
+                 pool_maxsize: int = None):
         """ Top class in which API object live. All requests are made through
         this class. Using the config a JWT token is obtained. Through this JWT
         token neccesary authentication headers are retrieved and saved in a
@@ -23,13 +32,52 @@ class AEP:
 
         :param config_path: Path to the config. Config contains information to establish authentication. 
         :type config_path: str
-        """
-        cfg = parse_config(path=config_path, data=config_data)
+        :param sandbox_name: The sandbox to make requests in, sent with every request.
+        Defaults to the sandbox in the config.
+        :type sandbox_name: str, optional
+        :param session: An authenticated session to share with other AEP instances (see AEPPool),
+        instead of authenticating with the config, defaults to None
+        :type session: requests.Session, optional
+        :param platform_gateway: Gateway the endpoints are under, e.g. the url of a local emulator.
+        Defaults to Platform.emulator_gateway in the config, or else the AEP gateway.
+        Platform.platform_gateway only selects the headers and must be a known gateway.
+        :type platform_gateway: str, optional
+        :param pool_maxsize: Connections kept open per host when the session is created here,
+        set it to at least the number of threads that use this instance. Defaults to
+        Transport.pool_maxsize in the config, see TransportConfig for the other transport settings.
+        :type pool_maxsize: int, optional
 
-        self.session = requests.Session()
-        headers = get_headers(cfg)
-        self.session.headers.update(headers)
-        self.known_endpoints = self._get_endpoints()
+        An instance can be used from several threads at once: the endpoint registry is
+        read-only, per-request headers are built fresh for every request, the sandbox is
+        sent per request, the session is only read after construction and its connection
+        pool hands every thread its own connection, and the identity map is guarded by a lock.
+        Adding hooks or swapping the session is not synchronized; do that before starting
+        threads. Retrieved objects themselves are not locked, so do not change the same
+        object from several threads.
+        """
+        if session is None:
+            cfg = parse_config(path=config_path, data=config_data)
+            session = create_session(TransportConfig.from_config(cfg, pool_maxsize=pool_maxsize))
+            headers = get_headers(cfg, session)
+            session.headers.update(headers)
+            platform_gateway = platform_gateway or dictor(cfg, "Platform" + ".emulator_gateway")
+        self.session = session
+        self.sandbox_name = sandbox_name or self.session.headers.get('x-sandbox-name')
+        self.platform_gateway = platform_gateway
+        self.known_endpoints = self._get_endpoints(platform_gateway)
+        self.hooks = []
+        self._policies = {}
+        self._policies_lock = threading.Lock()
+        # longest url first, so _dot_path_for finds the most specific endpoint
+        self._url_prefixes = sorted(
+            ((node['endpoint_url'], collection + '.' + endpoint)
+             for collection, endpoints in self.known_endpoints.items() for endpoint, node in endpoints.items()),
+            key=lambda prefix: len(prefix[0]), reverse=True)
+        # every artifact that is alive is represented by one object, keyed on (class, id)
+        self._identity_map = weakref.WeakValueDictionary()
+        self._identity_lock = threading.Lock()
+        # local index the catalog read paths consult, see use_catalog_index
+        self.catalog_index = None
         # set up collections
         self.sensei = Sensei(self)
         self.catalog_service = CatalogService(self)
@@ -39,28 +87,113 @@ class AEP:
         self.data_access = DataAccess(self)
         self.flow_service = FlowService(self)
 
+    def add_hook(self, hook: Hook):
+        """ Adds a hook that is called around every request of this instance,
+        e.g. a MetricsCollector. See utils.instrumentation.add_hook for hooks on all instances.
+
+        :param hook: The hook
+        :type hook: Hook
+        """
+        self.hooks.append(hook)
+
+    def configure_endpoint(self, path: str, hedge: Dict = None, circuit_breaker: Dict = None):
+        """ Sets the hedging and circuit breaker of an endpoint, instead of the hedge and
+        circuit_breaker settings of its entry in known_endpoints.yaml. See EndpointPolicy.
+
+        :param path: Dot path of the endpoint, e.g. catalogservice.dataset
+        :type path: str
+        :param hedge: Arguments of HedgePolicy, {} for the defaults, defaults to None (no hedging)
+        :type hedge: Dict, optional
+        :param circuit_breaker: Arguments of CircuitBreaker, {} for the defaults, defaults to None
+        (no circuit breaker)
+        :type circuit_breaker: Dict, optional
+        """
+        with self._policies_lock:
+            self._policies[path] = EndpointPolicy(hedge, circuit_breaker)
+
+    def use_catalog_index(self, index):
+        """ Lets Dataset.get_batches and Batch.get_datasetfiles read from a local CatalogIndex
+        while it is fresh, instead of listing through the catalog.
+
+        :param index: The index, None to stop using it.
+        :type index: CatalogIndex
+        """
+        self.catalog_index = index
+
+    def _fresh_catalog_index(self):
+        """ The catalog index when one is used and fresh, otherwise None.
+        """
+        index = self.catalog_index
+        return index if index is not None and index.fresh else None
+
+    def _policy_for(self, path: str) -> EndpointPolicy:
+        """ The hedging and circuit breaker of an endpoint, None when it has neither.
+        """
+        with self._policies_lock:
+            if path not in self._policies:
+                collection, _, endpoint = (path or '').partition('.')
+                node = self.known_endpoints.get(collection, {}).get(endpoint, {})
+                hedge, circuit_breaker = node.get('hedge'), node.get('circuit_breaker')
+                self._policies[path] = EndpointPolicy(hedge, circuit_breaker) \
+                    if hedge is not None or circuit_breaker is not None else None
+            return self._policies[path]
+
+    def _dot_path_for(self, url: str) -> str:
+        """ Finds the dot path of the known endpoint with the longest url that is a prefix of url.
+        """
+        return next((path for prefix, path in self._url_prefixes if url.startswith(prefix)), None)
+
+    def invalidate(self, cls: type = None, id: str = None):
+        """ Marks the definitions of retrieved objects as outdated, so they are retrieved
+        again on their next access. Every holder of such an object sees the new definition.
+
+        :param cls: Only invalidate objects of this class, e.g. Flow, defaults to None
+        :type cls: type, optional
+        :param id: Only invalidate the object with this id, defaults to None
+        :type id: str, optional
+        """
+        with self._identity_lock:
+            objects = [obj for (obj_cls, obj_id), obj in list(self._identity_map.items())
+                       if (cls is None or issubclass(obj_cls, cls)) and (id is None or obj_id == str(id))]
+        for obj in objects:
+            obj.invalidate()
+
     @staticmethod
-    def _get_endpoints() -> Dict:
+    def _get_endpoints(platform_gateway: str = None) -> Dict:
         """Loads all the known endpoints.
 
+        :param platform_gateway: Replaces the gateway in endpoint_parameters.yaml, defaults to None
+        :type platform_gateway: str, optional
         :return: Contains per endpoint the url and which extra headers are needed.
         Endpoints are grouped per collection. Available endpoints and their collections
         are 1-to-1 with the AEP api reference: www.adobe.io/apis/experienceplatform/home/api-reference.html
-        :rtype: Dict
+        The registry is read-only, so it can be shared between threads; copy the extra headers
+        before adding to them.
+        :rtype: Mapping
         """
         resource_path = os.path.join(os.path.split(__file__)[0], "resources")
         endpoint_path=os.path.join(resource_path,'known_endpoints.yaml')
         endpoint_param_path=os.path.join(resource_path,'endpoint_parameters.yaml')
         endpoint_params = parse_config(endpoint_param_path)
-        return parse_config(endpoint_path, arg_replacements=endpoint_params)
+        if platform_gateway:
+            endpoint_params['platform_gateway'] = platform_gateway.rstrip('/')
+        endpoints = parse_config(endpoint_path, arg_replacements=endpoint_params)
 
-    def _path_to_endpoint_and_headers(self, path: str) -> Tuple[str, Dict]:
+        def freeze(node):
+            node = {**node, 'extra_headers': node['extra_headers'] or {}}
+            return MappingProxyType({key: MappingProxyType(dict(value)) if isinstance(value, dict) else value
+                                     for key, value in node.items()})
+        return MappingProxyType({
+            collection: MappingProxyType({endpoint: freeze(node) for endpoint, node in collection_endpoints.items()})
+            for collection, collection_endpoints in endpoints.items()})
+
+    def _path_to_endpoint_and_headers(self, path: str) -> Tuple[str, Mapping]:
         """ Helper function to enable dot indexing into the known endpoints.
 
         :param path: The path into known endpoints, where collection and endpoint are seperated by a '.'
         :type path: str
-        :return: The endpoint url and the extra headers needed for that endpoint.
-        :rtype: Tuple[str, Dict]
+        :return: The endpoint url and the read-only extra headers needed for that endpoint.
+        :rtype: Tuple[str, Mapping]
         """
         node = self.known_endpoints
         for step in path.split('.'):
@@ -150,12 +283,72 @@ class AEP:
         base_url, extra_headers = self._path_to_endpoint_and_headers(path)
         url = base_url+url_suffix
         data = json.dumps(body)
-        resp = self.session.request(method=method, url=url, data=data, params=params, headers=extra_headers)
-        if resp.status_code not in [200, 201, 207, 202]:
+        resp = self.send(method, url, data=data, params=params, headers=dict(extra_headers), path=path)
+        if resp.status_code == 204:
+            return {}
+        return json.loads(resp.text)
+
+    def send(self, method: str, url: str, headers: Dict = None, path: str = None, attempt: int = 1,
+             multistatus: bool = False, **kwargs) -> requests.Response:
+        """ Sends a request through the session and checks the response status. Use this
+        instead of session.request for requests that need special handling, like
+        multipart uploads or binary downloads.
+
+        :param method: REST method, either POST, GET, DELETE, PATCH, PUT.
+        :type method: str
+        :param url: The complete url.
+        :type url: str
+        :param headers: Extra headers for this request, defaults to None
+        :type headers: Dict, optional
+        :param path: Dot path of the endpoint for the request hooks, defaults to the known
+        endpoint the url starts with
+        :type path: str, optional
+        :param attempt: 1 for the first try, higher for retries, passed to the request hooks, defaults to 1
+        :type attempt: int, optional
+        :param multistatus: Whether the caller checks the statuses in a 207 multistatus response
+        itself, which suppresses the warning for it, defaults to False
+        :type multistatus: bool, optional
+        :raises requests.exceptions.HTTPError: Raised for an unsuccessful status code.
+        :raises CircuitOpen: Raised without sending when the circuit breaker of the endpoint is open.
+        :return: The response.
+        :rtype: requests.Response
+        """
+        if self.sandbox_name is not None:
+            # set per request, so a session can be shared between sandboxes
+            headers = {'x-sandbox-name': self.sandbox_name, **(headers or {})}
+        path = path or self._dot_path_for(url)
+        data = kwargs.get('data')
+
+        def send_once(hedge: bool = False) -> requests.Response:
+            return call_with_hooks(
+                lambda: self.session.request(method=method, url=url, headers=headers, **kwargs),
+                method, url, self.hooks, path=path, attempt=attempt,
+                request_bytes=body_size(data, headers), stream=kwargs.get('stream', False))
+        policy = self._policy_for(path)
+        if policy is None:
+            resp = send_once()
+        else:
+            resp = policy.call(send_once, method, path, self.hooks,
+                               replayable=data is None or isinstance(data, (str, bytes)))
+        self._check_response(resp, url, multistatus)
+        return resp
+
+    @staticmethod
+    def _check_response(resp: requests.Response, url: str, multistatus: bool = False):
+        """ Raises for unsuccessful status codes and warns for multistatus responses.
+
+        :param resp: The response to check.
+        :type resp: requests.Response
+        :param url: The requested url, used in the error message.
+        :type url: str
+        :param multistatus: Whether the caller handles multistatus responses, defaults to False
+        :type multistatus: bool, optional
+        :raises requests.exceptions.HTTPError: Raised for an unsuccessful status code.
+        """
+        if resp.status_code not in [200, 201, 207, 202, 204]:
             http_error_msg = u'%s HTTP request failed: %s for url: %s' % (resp.status_code, resp.text, url)
-            raise requests.exceptions.HTTPError(http_error_msg)
-        elif resp.status_code == 207:
+            raise requests.exceptions.HTTPError(http_error_msg, response=resp)
+        elif resp.status_code == 207 and not multistatus:
             warnings.warn('Multistatus 207 response, check result text for individual status')
         elif resp.status_code == 202:
             warnings.warn('Multistatus 202 response, your request has been accepted but needs time to activate')
-        return json.loads(resp.text)
\ No newline at end of file
@@ -0,0 +1,404 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Tuple, Union
+from .aep import AEP
+from .models.catalogservice import Batch, Dataset
+from .models.dataaccess import DataSetFile
+from .utils.concurrency import run_concurrently
+from .utils.general_utils import setup_logger
+
+LOGGER = setup_logger(__name__)
+
+PAGE_SIZE = 100
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS datasets (
+    id TEXT PRIMARY KEY, name TEXT, created INTEGER, updated INTEGER, definition TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS batches (
+    id TEXT PRIMARY KEY, dataset_id TEXT, status TEXT, created INTEGER, updated INTEGER,
+    started INTEGER, completed INTEGER, records INTEGER, definition TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS batches_dataset ON batches (dataset_id, created);
+CREATE INDEX IF NOT EXISTS batches_created ON batches (created);
+CREATE TABLE IF NOT EXISTS datasetfiles (
+    id TEXT PRIMARY KEY, batch_id TEXT NOT NULL, is_valid INTEGER, definition TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS datasetfiles_batch ON datasetfiles (batch_id);
+CREATE TABLE IF NOT EXISTS files_synced (batch_id TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS sync_state (scope TEXT PRIMARY KEY, watermark INTEGER, synced_at REAL);
+'''
+
+
+def _dataset_of(batch: Dict) -> str:
+    return next((obj['id'] for obj in batch.get('relatedObjects') or [] if obj.get('type') == 'dataSet'), None)
+
+
+def _to_ms(value: float) -> int:
+    """ Epoch seconds to the epoch milliseconds the catalog uses.
+    """
+    return None if value is None else int(value * 1000)
+
+
+class SyncReport:
+    def __init__(self):
+        """ What a CatalogIndex.sync changed.
+        """
+        self.datasets = 0
+        self.batches = 0
+        self.datasetfiles = 0
+        self.removed = 0
+        self.requests = 0
+        self.seconds = 0.0
+
+    def __str__(self) -> str:
+        """ string representation of the report
+
+        :return: string representation
+        :rtype: str
+        """
+        return '{} datasets, {} batches, {} datasetfiles synced, {} removed, in {} requests and {:.2f}s'.format(
+            self.datasets, self.batches, self.datasetfiles, self.removed, self.requests, self.seconds)
+
+
+class CatalogIndex:
+    def __init__(self, aep: AEP, path: str, dataset_ids: Iterable[str] = None, files: bool = True,
+                 max_age: float = None, max_workers: int = 8):
+        """ Local SQLite index of the dataset, batch and datasetfile metadata of the catalog.
+        sync() brings it up to date with updated-since listings, after which questions like
+        which datasets got batches in the last hour are answered locally:
+
+            index = CatalogIndex(aep, 'catalog.sqlite')
+            index.sync()
+            index.datasets_with_batches_since(time.time() - 3600)
+            index.batch_at(dataset_id, datetime(2021, 6, 1).timestamp())
+
+        Attached to the client with aep.use_catalog_index(index), Dataset.get_batches and
+        Batch.get_datasetfiles read from the index instead of the catalog, as long as the last
+        sync is at most max_age seconds old.
+
+        The index can be shared by threads. Incremental syncs do not see deletions; a sync
+        with full=True removes what no longer exists.
+
+        :param aep: The client to sync with.
+        :type aep: AEP
+        :param path: Path to the SQLite database, created when it does not exist. ':memory:'
+        keeps the index in memory.
+        :type path: str
+        :param dataset_ids: Only index these datasets and their batches, defaults to None (all)
+        :type dataset_ids: Iterable[str], optional
+        :param files: Also index the datasetfiles of successful batches, one request per
+        new batch, defaults to True
+        :type files: bool, optional
+        :param max_age: Seconds after a sync that read paths still use the index, defaults
+        to None (always)
+        :type max_age: float, optional
+        :param max_workers: Maximum number of concurrent requests during a sync, defaults to 8
+        :type max_workers: int, optional
+        """
+        self.aep = aep
+        self.path = path
+        self.dataset_ids = sorted(set(dataset_ids)) if dataset_ids is not None else None
+        self.files = files
+        self.max_age = max_age
+        self.max_workers = max_workers
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        with self._lock, self._connection:
+            if path != ':memory:':
+                self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.executescript(SCHEMA)
+
+    def close(self):
+        """ Closes the database.
+        """
+        with self._lock:
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def query(self, sql: str, parameters: Union[Tuple, Dict] = ()) -> List[sqlite3.Row]:
+        """ Runs a query on the index, for questions the other methods do not cover. The
+        tables are datasets, batches and datasetfiles; timestamps are epoch milliseconds.
+
+        :param sql: The query.
+        :type sql: str
+        :param parameters: Parameters of the query, defaults to ()
+        :type parameters: Union[Tuple, Dict], optional
+        :return: The rows.
+        :rtype: List[sqlite3.Row]
+        """
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def _state(self, scope: str) -> Tuple[int, float]:
+        row = self.query('SELECT watermark, synced_at FROM sync_state WHERE scope = ?', (scope,))
+        return (row[0]['watermark'], row[0]['synced_at']) if row else (None, None)
+
+    @property
+    def synced_at(self) -> float:
+        """ Epoch seconds of the last completed sync, None before the first.
+        """
+        return self._state('sync')[1]
+
+    @property
+    def fresh(self) -> bool:
+        """ Whether read paths may use the index: it was synced, at most max_age seconds ago.
+        """
+        synced_at = self.synced_at
+        return synced_at is not None and (self.max_age is None or time.time() - synced_at <= self.max_age)
+
+    def _list(self, path: str, params: Dict, watermark: int, report: SyncReport) -> List[Tuple[str, Dict]]:
+        params = dict(params, orderBy='asc:updated')
+        if watermark is not None:
+            # items updated in the same millisecond as the watermark may have been missed, so they are listed again
+            params['property'] = 'updated>={}'.format(watermark)
+        items = list(self.aep.catalog_service._iter_catalog(path, params, PAGE_SIZE))
+        report.requests += len(items) // PAGE_SIZE + 1
+        return items
+
+    def _store_datasets(self, datasets: List[Tuple[str, Dict]]):
+        self._connection.executemany(
+            'INSERT OR REPLACE INTO datasets VALUES (?, ?, ?, ?, ?)',
+            [(id, definition.get('name'), definition.get('created'), definition.get('updated'),
+              json.dumps(definition)) for id, definition in datasets])
+
+    def _store_batches(self, batches: List[Tuple[str, Dict]]):
+        previous = {}
+        for id, _ in batches:
+            for row in self._connection.execute('SELECT updated FROM batches WHERE id = ?', (id,)):
+                previous[id] = row['updated']
+        self._connection.executemany(
+            'INSERT OR REPLACE INTO batches VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(id, _dataset_of(definition), definition.get('status'), definition.get('created'),
+              definition.get('updated'), definition.get('started'), definition.get('completed'),
+              (definition.get('metrics') or {}).get('recordCount'), json.dumps(definition))
+             for id, definition in batches])
+        # a changed batch may have other files
+        self._connection.executemany('DELETE FROM files_synced WHERE batch_id = ?',
+                                     [(id,) for id, definition in batches if previous.get(id) != definition.get('updated')])
+
+    def _save_state(self, scope: str, items: List[Tuple[str, Dict]], previous: int):
+        watermark = max([definition.get('updated') or 0 for _, definition in items] + [previous or 0]) or None
+        self._connection.execute('INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?)', (scope, watermark, time.time()))
+
+    def _remove(self, table: str, ids: List[str]) -> int:
+        """ Removes datasets or batches, with their batches and datasetfiles.
+        """
+        if table == 'datasets':
+            self._remove('batches', [row['id'] for id in ids for row in self._connection.execute(
+                'SELECT id FROM batches WHERE dataset_id = ?', (id,))])
+        rows = [(id,) for id in ids]
+        if table == 'batches':
+            self._connection.executemany('DELETE FROM datasetfiles WHERE batch_id = ?', rows)
+            self._connection.executemany('DELETE FROM files_synced WHERE batch_id = ?', rows)
+        self._connection.executemany('DELETE FROM {} WHERE id = ?'.format(table), rows)
+        return len(ids)
+
+    def _sync_files(self, report: SyncReport):
+        batch_ids = [row['id'] for row in self.query(
+            "SELECT id FROM batches WHERE status = 'success' AND id NOT IN (SELECT batch_id FROM files_synced)")]
+
+        def list_files(batch_id):
+            return self.aep.get(path='dataaccess.dataaccess', url_suffix='/' + batch_id + '/files')
+
+        for batch_id, result, error in run_concurrently(list_files, batch_ids, self.max_workers):
+            report.requests += 1
+            if error is not None:
+                LOGGER.warning('Could not list the datasetfiles of batch %s: %s', batch_id, error)
+                continue
+            with self._lock, self._connection:
+                self._connection.execute('DELETE FROM datasetfiles WHERE batch_id = ?', (batch_id,))
+                self._connection.executemany(
+                    'INSERT OR REPLACE INTO datasetfiles VALUES (?, ?, ?, ?)',
+                    [(definition['dataSetFileId'], batch_id, definition.get('isValid'), json.dumps(definition))
+                     for definition in result.get('data') or []])
+                self._connection.execute('INSERT OR REPLACE INTO files_synced VALUES (?)', (batch_id,))
+            report.datasetfiles += len(result.get('data') or [])
+
+    def sync(self, full: bool = False) -> SyncReport:
+        """ Retrieves what changed in the catalog since the previous sync: the datasets and
+        batches updated since then, and the datasetfiles of new successful batches.
+
+        :param full: List everything again and remove what no longer exists, defaults to False
+        :type full: bool, optional
+        :return: What changed.
+        :rtype: SyncReport
+        """
+        start = time.perf_counter()
+        report = SyncReport()
+        if self.dataset_ids is None:
+            watermark = None if full else self._state('datasets')[0]
+            datasets = self._list('catalogservice.dataset', {}, watermark, report)
+            with self._lock, self._connection:
+                self._store_datasets(datasets)
+                if full:
+                    listed = {id for id, _ in datasets}
+                    report.removed += self._remove('datasets', [row['id'] for row in self.query(
+                        'SELECT id FROM datasets') if row['id'] not in listed])
+                self._save_state('datasets', datasets, watermark)
+            report.datasets += len(datasets)
+            batch_scopes = [('batches', {})]
+        else:
+            outcomes = run_concurrently(lambda id: self.aep.get('catalogservice.dataset', url_suffix='/' + id),
+                                        self.dataset_ids, self.max_workers)
+            report.requests += len(outcomes)
+            with self._lock, self._connection:
+                for id, result, error in outcomes:
+                    if error is None:
+                        self._store_datasets(result.items())
+                        report.datasets += 1
+                    elif full and getattr(error, 'response', None) is not None and error.response.status_code == 404:
+                        report.removed += self._remove('datasets', [id])
+                    else:
+                        raise error
+            batch_scopes = [('batches:' + id, {'dataSet': id}) for id in self.dataset_ids]
+
+        def sync_batches(scope):
+            name, params = scope
+            watermark = None if full else self._state(name)[0]
+            return watermark, self._list('catalogservice.batch', params, watermark, report)
+
+        for (name, params), (watermark, batches), error in run_concurrently(sync_batches, batch_scopes,
+                                                                             self.max_workers):
+            if error is not None:
+                raise error
+            with self._lock, self._connection:
+                self._store_batches(batches)
+                if full:
+                    listed = {id for id, _ in batches}
+                    where, arguments = ('WHERE dataset_id = ?', (params['dataSet'],)) if params else ('', ())
+                    report.removed += self._remove('batches', [row['id'] for row in self.query(
+                        'SELECT id FROM batches ' + where, arguments) if row['id'] not in listed])
+                self._save_state(name, batches, watermark)
+            report.batches += len(batches)
+        if self.files:
+            self._sync_files(report)
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?)', ('sync', None, time.time()))
+        report.seconds = time.perf_counter() - start
+        return report
+
+    def _dataset(self, row: sqlite3.Row) -> Dataset:
+        return self.aep.catalog_service._identify(Dataset({row['id']: json.loads(row['definition'])}, self.aep))
+
+    def _batch(self, row: sqlite3.Row) -> Batch:
+        return Batch(json.loads(row['definition']), self.aep, row['id'])
+
+    def covers(self, dataset_id: str) -> bool:
+        """ Whether the index holds the batches of a dataset.
+
+        :param dataset_id: The dataset.
+        :type dataset_id: str
+        :return: True when the dataset is indexed.
+        :rtype: bool
+        """
+        return bool(self.query('SELECT 1 FROM datasets WHERE id = ?', (dataset_id,)))
+
+    def get_dataset(self, dataset_id: str) -> Dataset:
+        """ The indexed dataset.
+
+        :param dataset_id: The dataset.
+        :type dataset_id: str
+        :return: The dataset, None when it is not indexed.
+        :rtype: Dataset
+        """
+        rows = self.query('SELECT id, definition FROM datasets WHERE id = ?', (dataset_id,))
+        return self._dataset(rows[0]) if rows else None
+
+    def find_datasets(self, name_like: str = None) -> List[Dataset]:
+        """ The indexed datasets, optionally only those whose name matches a LIKE pattern.
+
+        :param name_like: SQL LIKE pattern, e.g. 'profile_%', defaults to None
+        :type name_like: str, optional
+        :return: The datasets.
+        :rtype: List[Dataset]
+        """
+        if name_like is None:
+            rows = self.query('SELECT id, definition FROM datasets ORDER BY name')
+        else:
+            rows = self.query('SELECT id, definition FROM datasets WHERE name LIKE ? ORDER BY name', (name_like,))
+        return [self._dataset(row) for row in rows]
+
+    def datasets_with_batches_since(self, since: float, status: str = 'success') -> List[Dataset]:
+        """ The datasets that got a batch created after a moment.
+
+        :param since: Epoch seconds.
+        :type since: float
+        :param status: Only count batches with this status, None for all, defaults to 'success'
+        :type status: str, optional
+        :return: The datasets.
+        :rtype: List[Dataset]
+        """
+        rows = self.query(
+            'SELECT id, definition FROM datasets WHERE id IN (SELECT dataset_id FROM batches '
+            'WHERE created > ? AND (? IS NULL OR status = ?)) ORDER BY name', (_to_ms(since), status, status))
+        return [self._dataset(row) for row in rows]
+
+    def get_batches(self, dataset_id: str = None, status: str = 'success', created_after: float = None,
+                    created_before: float = None) -> List[Batch]:
+        """ The indexed batches, oldest first.
+
+        :param dataset_id: Only batches of this dataset, defaults to None
+        :type dataset_id: str, optional
+        :param status: Only batches with this status, None for all, defaults to 'success'
+        :type status: str, optional
+        :param created_after: Only batches created after these epoch seconds, defaults to None
+        :type created_after: float, optional
+        :param created_before: Only batches created before these epoch seconds, defaults to None
+        :type created_before: float, optional
+        :return: The batches.
+        :rtype: List[Batch]
+        """
+        rows = self.query(
+            'SELECT id, definition FROM batches WHERE (:dataset IS NULL OR dataset_id = :dataset) '
+            'AND (:status IS NULL OR status = :status) AND (:after IS NULL OR created > :after) '
+            'AND (:before IS NULL OR created < :before) ORDER BY created',
+            {'dataset': dataset_id, 'status': status, 'after': _to_ms(created_after),
+             'before': _to_ms(created_before)})
+        return [self._batch(row) for row in rows]
+
+    def batch_at(self, dataset_id: str, at: float, status: str = 'success') -> Batch:
+        """ The batch of a dataset that holds the data of a moment: the batch whose ingestion
+        started before and completed after it, otherwise the last batch created before it.
+
+        :param dataset_id: The dataset.
+        :type dataset_id: str
+        :param at: The moment in epoch seconds.
+        :type at: float
+        :param status: Only batches with this status, None for all, defaults to 'success'
+        :type status: str, optional
+        :return: The batch, None when there is none.
+        :rtype: Batch
+        """
+        rows = self.query(
+            'SELECT id, definition FROM batches WHERE dataset_id = :dataset AND (:status IS NULL OR status = :status) '
+            'AND (started <= :at AND completed >= :at OR created <= :at) '
+            'ORDER BY started <= :at AND completed >= :at DESC, created DESC LIMIT 1',
+            {'dataset': dataset_id, 'status': status, 'at': _to_ms(at)})
+        return self._batch(rows[0]) if rows else None
+
+    def has_datasetfiles(self, batch_id: str) -> bool:
+        """ Whether the datasetfiles of a batch are indexed.
+
+        :param batch_id: The batch.
+        :type batch_id: str
+        :return: True when they are.
+        :rtype: bool
+        """
+        return bool(self.query('SELECT 1 FROM files_synced WHERE batch_id = ?', (batch_id,)))
+
+    def get_datasetfiles(self, batch_id: str) -> List[DataSetFile]:
+        """ The indexed datasetfiles of a batch.
+
+        :param batch_id: The batch.
+        :type batch_id: str
+        :return: The datasetfiles.
+        :rtype: List[DataSetFile]
+        """
+        rows = self.query('SELECT definition FROM datasetfiles WHERE batch_id = ? ORDER BY id', (batch_id,))
+        return [DataSetFile(definition=json.loads(row['definition']), _aep=self.aep) for row in rows]
@@ -0,0 +1,279 @@
+import datetime
+import re
+import time
+from typing import Dict, Iterable, List, Union
+import requests
+from .aep import AEP
+from .models.abstractmodel import AEPObject
+from .utils.concurrency import RateLimiter, run_concurrently
+from .utils.general_utils import setup_logger
+
+LOGGER = setup_logger(__name__)
+
+# in order of deletion: consumers of datasets go first, so nothing writes into a deleted dataset
+KINDS = ('scheduledqueries', 'flows', 'datasets')
+
+TRANSIENT_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+def _to_epoch(value) -> float:
+    """ Converts a creation time of AEP, epoch milliseconds or an ISO 8601 string, to epoch seconds.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return value / 1000
+    try:
+        return datetime.datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
+
+
+def _is_transient(error: Exception) -> bool:
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    response = getattr(error, 'response', None)
+    return isinstance(error, requests.exceptions.HTTPError) and response is not None \
+        and response.status_code in TRANSIENT_STATUS_CODES
+
+
+def _is_not_found(error: Exception) -> bool:
+    response = getattr(error, 'response', None)
+    return isinstance(error, requests.exceptions.HTTPError) and response is not None \
+        and response.status_code == 404
+
+
+class CleanupCandidate:
+    def __init__(self, kind: str, obj: AEPObject, name: str, created: float = None, tags: Dict = None):
+        """ An artifact selected for deletion.
+
+        :param kind: The kind of artifact, see KINDS.
+        :type kind: str
+        :param obj: The artifact.
+        :type obj: AEPObject
+        :param name: Its name.
+        :type name: str
+        :param created: Its creation time in epoch seconds, defaults to None (unknown)
+        :type created: float, optional
+        :param tags: Its tags, defaults to None
+        :type tags: Dict, optional
+        """
+        self.kind = kind
+        self.obj = obj
+        self.id = obj.id
+        self.name = name
+        self.created = created
+        self.tags = tags or {}
+        self.status = 'selected'
+        self.error = None
+
+
+class CleanupReport:
+    def __init__(self, candidates: List[CleanupCandidate], seconds: float, dry_run: bool):
+        """ Outcome of a Cleanup run.
+
+        :param candidates: The selected artifacts, with their status.
+        :type candidates: List[CleanupCandidate]
+        :param seconds: Wall clock duration of the run, including the selection.
+        :type seconds: float
+        :param dry_run: Whether nothing was deleted.
+        :type dry_run: bool
+        """
+        self.candidates = candidates
+        self.seconds = seconds
+        self.dry_run = dry_run
+        self.deleted = [candidate for candidate in candidates if candidate.status == 'deleted']
+        self.failed = [candidate for candidate in candidates if candidate.status == 'failed']
+        self.errors = {(candidate.kind, candidate.id): candidate.error for candidate in self.failed}
+
+    def counts(self) -> Dict[str, Dict[str, int]]:
+        """ Per kind the number of selected, deleted and failed artifacts.
+
+        :return: The counts per kind.
+        :rtype: Dict[str, Dict[str, int]]
+        """
+        counts = {}
+        for candidate in self.candidates:
+            kind = counts.setdefault(candidate.kind, {'selected': 0, 'deleted': 0, 'failed': 0})
+            kind['selected'] += 1
+            if candidate.status in ('deleted', 'failed'):
+                kind[candidate.status] += 1
+        return counts
+
+    def __str__(self) -> str:
+        """ string representation of the report, with a line per kind and per failure
+
+        :return: string representation
+        :rtype: str
+        """
+        lines = ['{} selected, {} deleted, {} failed in {:.1f}s{}'.format(
+            len(self.candidates), len(self.deleted), len(self.failed), self.seconds,
+            ' (dry run)' if self.dry_run else '')]
+        for kind, counts in self.counts().items():
+            lines.append('  {:<17} {selected:>5} selected {deleted:>5} deleted {failed:>5} failed'.format(
+                kind, **counts))
+        for candidate in self.failed:
+            lines.append('  failed {} {} ({}): {}'.format(candidate.kind, candidate.name, candidate.id,
+                                                         candidate.error))
+        return '\n'.join(lines)
+
+
+class Cleanup:
+    def __init__(self, aep: AEP, name_pattern: str = None, tags: Dict[str, Union[str, List[str]]] = None,
+                 older_than: Union[float, datetime.timedelta] = None, kinds: Iterable[str] = KINDS,
+                 exclude_pattern: str = None):
+        """ Selects artifacts across the catalog, flow and query services, and deletes them
+        concurrently under a rate limit, e.g. to remove what the test runs of a feature
+        branch left behind:
+
+            report = Cleanup(aep, name_pattern=r'ci_\\d+_', older_than=timedelta(days=2)).run()
+            print(report)
+
+        An artifact is selected when it matches all given selectors. Scheduled queries are
+        deleted first and datasets last, so nothing writes into a deleted dataset.
+
+        :param aep: The client to clean up with.
+        :type aep: AEP
+        :param name_pattern: Regex the name must match (re.match), defaults to None
+        :type name_pattern: str, optional
+        :param tags: Tags the artifact must have, each a value or list of accepted values. Only
+        datasets carry tags, so this selects datasets only, defaults to None
+        :type tags: Dict[str, Union[str, List[str]]], optional
+        :param older_than: Minimum age, in seconds or as timedelta, defaults to None
+        :type older_than: Union[float, datetime.timedelta], optional
+        :param kinds: Kinds of artifacts to consider, defaults to KINDS (scheduledqueries, flows and datasets)
+        :type kinds: Iterable[str], optional
+        :param exclude_pattern: Regex of names that are never selected, defaults to None
+        :type exclude_pattern: str, optional
+        :raises ValueError: Raised without any selector, or for an unknown kind.
+        """
+        if name_pattern is None and tags is None and older_than is None:
+            raise ValueError('Cleanup needs a name_pattern, tags or older_than to select artifacts')
+        unknown = set(kinds) - set(KINDS)
+        if unknown:
+            raise ValueError('Unknown kinds {}, expected some of {}'.format(sorted(unknown), KINDS))
+        self.aep = aep
+        self.name_pattern = re.compile(name_pattern) if name_pattern is not None else None
+        self.exclude_pattern = re.compile(exclude_pattern) if exclude_pattern is not None else None
+        self.tags = {key: [value] if isinstance(value, str) else list(value) for key, value in (tags or {}).items()}
+        if isinstance(older_than, datetime.timedelta):
+            older_than = older_than.total_seconds()
+        self.older_than = older_than
+        self.kinds = [kind for kind in KINDS if kind in kinds]
+
+    def _list(self, kind: str) -> List[CleanupCandidate]:
+        if kind == 'scheduledqueries':
+            return [CleanupCandidate(kind, scheduledquery, scheduledquery.definition['query']['name'],
+                                     _to_epoch(scheduledquery.definition.get('created')))
+                    for scheduledquery in self.aep.query_service.get_all_scheduledqueries()]
+        if kind == 'flows':
+            return [CleanupCandidate(kind, flow, flow.definition.get('name'), _to_epoch(flow.definition.get('createdAt')))
+                    for flow in self.aep.flow_service.get_all_flows()]
+        datasets = self.aep.catalog_service.get_all_datasets(properties=['name', 'created', 'tags'])
+        return [CleanupCandidate(kind, dataset, dataset.definition[dataset.id].get('name'),
+                                 _to_epoch(dataset.definition[dataset.id].get('created')),
+                                 dataset.definition[dataset.id].get('tags'))
+                for dataset in datasets]
+
+    def _matches(self, candidate: CleanupCandidate, now: float) -> bool:
+        name = candidate.name or ''
+        if self.exclude_pattern is not None and self.exclude_pattern.match(name):
+            return False
+        if self.name_pattern is not None and not self.name_pattern.match(name):
+            return False
+        if self.older_than is not None and (candidate.created is None or now - candidate.created < self.older_than):
+            return False
+        for key, values in self.tags.items():
+            if not set(values) & set(candidate.tags.get(key) or []):
+                return False
+        return True
+
+    def select(self) -> List[CleanupCandidate]:
+        """ Lists the artifacts of the kinds and selects those matching the selectors.
+        Artifacts without a known creation time are never selected by age.
+
+        :return: The selected artifacts, in order of deletion.
+        :rtype: List[CleanupCandidate]
+        """
+        now = time.time()
+        # only datasets have tags
+        kinds = [kind for kind in self.kinds if not self.tags or kind == 'datasets']
+        return [candidate for kind in kinds for candidate in self._list(kind) if self._matches(candidate, now)]
+
+    @staticmethod
+    def _delete(candidate: CleanupCandidate, retries: int, backoff: float):
+        if candidate.kind == 'scheduledqueries':
+            # retries the disable-then-delete sequence itself
+            candidate.obj.delete(retries=retries, backoff=backoff)
+            return
+        for attempt in range(retries + 1):
+            try:
+                candidate.obj.delete()
+                return
+            except Exception as e:
+                if attempt == retries or not _is_transient(e):
+                    raise
+                time.sleep(backoff * 2 ** attempt)
+
+    def run(self, dry_run: bool = False, max_workers: int = 16, requests_per_second: float = 10,
+            retries: int = 3, backoff: float = 1.0) -> CleanupReport:
+        """ Selects and deletes the artifacts, a kind at a time and the artifacts of a kind
+        concurrently. Errors are collected in the report instead of raised; an artifact that
+        is gone already counts as deleted.
+
+        :param dry_run: Only select, defaults to False
+        :type dry_run: bool, optional
+        :param max_workers: Maximum number of concurrent deletions, defaults to 16
+        :type max_workers: int, optional
+        :param requests_per_second: Rate at which deletions are started, defaults to 10
+        :type requests_per_second: float, optional
+        :param retries: Retries of a deletion after a transient error (429, 5xx, connection errors)
+        or, for scheduled queries, also after a delete refused because the query is not disabled
+        yet, defaults to 3
+        :type retries: int, optional
+        :param backoff: Seconds before the first retry, doubled per retry, defaults to 1.0
+        :type backoff: float, optional
+        :return: The report.
+        :rtype: CleanupReport
+        """
+        start = time.perf_counter()
+        candidates = self.select()
+        if dry_run:
+            return CleanupReport(candidates, time.perf_counter() - start, dry_run)
+        rate_limiter = RateLimiter(requests_per_second, burst=max_workers)
+        for kind in self.kinds:
+            batch = [candidate for candidate in candidates if candidate.kind == kind]
+            outcomes = run_concurrently(lambda candidate: self._delete(candidate, retries, backoff), batch,
+                                        max_workers, rate_limiter)
+            for candidate, _, error in outcomes:
+                if error is None or _is_not_found(error):
+                    candidate.status = 'deleted'
+                    if error is not None:
+                        candidate.obj._mark_deleted()
+                else:
+                    candidate.status = 'failed'
+                    candidate.error = error
+                    LOGGER.warning('Could not delete %s %s (%s): %s', kind, candidate.name, candidate.id, error)
+        return CleanupReport(candidates, time.perf_counter() - start, dry_run)
+
+
+def cleanup(aep: AEP, name_pattern: str = None, tags: Dict[str, Union[str, List[str]]] = None,
+            older_than: Union[float, datetime.timedelta] = None, dry_run: bool = False, **kwargs) -> CleanupReport:
+    """ Selects and deletes artifacts, see Cleanup.
+
+    :param aep: The client to clean up with.
+    :type aep: AEP
+    :param name_pattern: Regex the name must match, defaults to None
+    :type name_pattern: str, optional
+    :param tags: Tags the artifact must have, defaults to None
+    :type tags: Dict[str, Union[str, List[str]]], optional
+    :param older_than: Minimum age, in seconds or as timedelta, defaults to None
+    :type older_than: Union[float, datetime.timedelta], optional
+    :param dry_run: Only select, defaults to False
+    :type dry_run: bool, optional
+    :param kwargs: Other arguments of Cleanup (kinds, exclude_pattern) and Cleanup.run.
+    :return: The report.
+    :rtype: CleanupReport
+    """
+    init_kwargs = {key: kwargs.pop(key) for key in ('kinds', 'exclude_pattern') if key in kwargs}
+    return Cleanup(aep, name_pattern, tags, older_than, **init_kwargs).run(dry_run=dry_run, **kwargs)
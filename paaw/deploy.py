@@ -0,0 +1,335 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List
+from .aep import AEP
+from .models.abstractmodel import AEPObject
+from .utils.general_utils import setup_logger
+
+LOGGER = setup_logger(__name__)
+
+PLACEHOLDER = re.compile(r'\$\{(\w+)\}')
+
+# subdirectory of the config directory -> function that creates an artifact from a config
+KINDS = {
+    'fieldgroups': lambda aep, path, args: aep.schema_registry.create_fieldgroup(path, args),
+    'schemas': lambda aep, path, args: aep.schema_registry.create_schema(path, args),
+    'descriptors': lambda aep, path, args: aep.schema_registry.create_descriptor(path, args),
+    'datasets': lambda aep, path, args: aep.catalog_service.create_dataset(path, args),
+    'flows': lambda aep, path, args: aep.flow_service.create_flow(path, args),
+    'queries': lambda aep, path, args: aep.query_service.create_query(path, args),
+    'scheduledqueries': lambda aep, path, args: aep.query_service.create_scheduledquery(path, args),
+    'engines': lambda aep, path, args: aep.sensei.create_engine(path, args),
+    'mlinstances': lambda aep, path, args: aep.sensei.create_mlinstance(path, args),
+    'experiments': lambda aep, path, args: aep.sensei.create_experiment(path, args),
+}
+
+
+class DeployNode:
+    def __init__(self, name: str, kind: str, path: str):
+        """ One artifact of a Deployment: a config file that creates one AEP artifact.
+
+        :param name: The name of the node, the file name without extension.
+        :type name: str
+        :param kind: The kind of artifact, the subdirectory the config is in, see KINDS.
+        :type kind: str
+        :param path: Path to the config.
+        :type path: str
+        """
+        self.name = name
+        self.kind = kind
+        self.path = path
+        with open(path) as f:
+            self.text = f.read()
+        # the placeholders filled by replacements; those of !ENV values come from the environment
+        self.placeholders = sorted({placeholder for line in self.text.splitlines() if '!ENV' not in line
+                                    for placeholder in PLACEHOLDER.findall(line)})
+        self.depends_on = []
+        self.status = 'pending'
+        self.id = None
+        self.error = None
+        self.started = None
+        self.seconds = None
+
+    def fingerprint(self, replacements: Dict) -> str:
+        """ Hash of the config and the replacements it uses, to see whether a created
+        artifact still matches its config on resume.
+
+        :param replacements: All available replacements.
+        :type replacements: Dict
+        :return: The hash.
+        :rtype: str
+        """
+        used = {name: replacements[name] for name in self.placeholders if name in replacements}
+        return hashlib.sha1((self.text + json.dumps(used, sort_keys=True)).encode('utf-8')).hexdigest()
+
+
+class DeployReport:
+    def __init__(self, nodes: Dict[str, DeployNode], seconds: float):
+        """ Outcome and timing of a Deployment run.
+
+        :param nodes: The nodes keyed on name.
+        :type nodes: Dict[str, DeployNode]
+        :param seconds: Wall clock duration of the run.
+        :type seconds: float
+        """
+        self.nodes = nodes
+        self.seconds = seconds
+        self.created = [name for name, node in nodes.items() if node.status == 'created']
+        self.resumed = [name for name, node in nodes.items() if node.status == 'resumed']
+        self.failed = [name for name, node in nodes.items() if node.status == 'failed']
+        self.skipped = [name for name, node in nodes.items() if node.status == 'skipped']
+        self.ids = {name: node.id for name, node in nodes.items() if node.id is not None}
+        # the time the nodes would have taken one after the other
+        self.sequential_seconds = sum(node.seconds or 0 for node in nodes.values())
+
+    def timings(self) -> List[Dict]:
+        """ Per node when it started (seconds into the run), how long it took and its outcome,
+        in order of starting.
+
+        :return: A row per node that ran.
+        :rtype: List[Dict]
+        """
+        rows = [{'name': node.name, 'kind': node.kind, 'status': node.status, 'started': node.started,
+                 'seconds': node.seconds, 'id': node.id, 'error': node.error}
+                for node in self.nodes.values() if node.started is not None]
+        return sorted(rows, key=lambda row: row['started'])
+
+    def __str__(self) -> str:
+        """ string representation of the report, with a line per node
+
+        :return: string representation
+        :rtype: str
+        """
+        lines = ['{} created, {} resumed, {} failed, {} skipped in {:.1f}s ({:.1f}s one after the other)'.format(
+            len(self.created), len(self.resumed), len(self.failed), len(self.skipped), self.seconds,
+            self.sequential_seconds)]
+        for row in self.timings():
+            lines.append('  {:>7.2f}s +{:<7.2f} {:<9} {:<18} {}{}'.format(
+                row['started'], row['seconds'] or 0, row['status'], row['kind'], row['name'],
+                ': {}'.format(row['error']) if row['error'] else ''))
+        return '\n'.join(lines)
+
+
+class Deployment:
+    def __init__(self, aep: AEP, config_dir: str, arg_replacements: Dict = None, state_path: str = None,
+                 max_workers: int = 4, kinds: Dict[str, Callable] = None):
+        """ Deploys a directory of configs as a dependency graph. The configs are in a
+        subdirectory per kind of artifact (fieldgroups, schemas, descriptors, datasets, flows,
+        queries, scheduledqueries, engines, mlinstances, experiments), and a config refers to
+        the id of another artifact with !ARG ${<name>_id}, where name is the file name of the
+        other config without extension:
+
+            deploy/schemas/profile.yaml:    allOf: [{$ref: !ARG "${profile_fields_id}"}]
+            deploy/datasets/profiles.yaml:  schemaRef: {id: !ARG "${profile_id}"}
+
+        Artifacts are created in topological order, independent ones concurrently, and the
+        ids of created artifacts fill the configs that refer to them.
+
+        With a state_path, the ids of created artifacts are saved after every node. Running
+        again after a failure resumes: nodes whose config and replacements did not change keep
+        their artifact, the others (and what depends on them) are created.
+
+        :param aep: The client to deploy with.
+        :type aep: AEP
+        :param config_dir: The directory with a subdirectory of configs per kind.
+        :type config_dir: str
+        :param arg_replacements: Replacements for the other placeholders, defaults to None
+        :type arg_replacements: Dict, optional
+        :param state_path: Json file with the state to resume from, defaults to None
+        :type state_path: str, optional
+        :param max_workers: Maximum number of artifacts created at once, defaults to 4
+        :type max_workers: int, optional
+        :param kinds: Extra or other kinds, keyed on subdirectory name, each called with
+        (aep, config_path, arg_replacements), defaults to None
+        :type kinds: Dict[str, Callable], optional
+        :raises ValueError: Raised for duplicate names, missing replacements or dependency cycles.
+        """
+        self.aep = aep
+        self.config_dir = config_dir
+        self.arg_replacements = dict(arg_replacements or {})
+        self.state_path = state_path
+        self.max_workers = max_workers
+        self.kinds = {**KINDS, **(kinds or {})}
+        self.nodes = self._read_nodes()
+        self._check_graph()
+        self._lock = threading.Lock()
+
+    def _read_nodes(self) -> Dict[str, DeployNode]:
+        nodes = {}
+        for kind in sorted(os.listdir(self.config_dir)):
+            directory = os.path.join(self.config_dir, kind)
+            if not os.path.isdir(directory):
+                continue
+            if kind not in self.kinds:
+                raise ValueError('Unknown kind of artifact {}, expected one of {}'.format(kind, sorted(self.kinds)))
+            for file_name in sorted(os.listdir(directory)):
+                name, extension = os.path.splitext(file_name)
+                if extension not in ('.yaml', '.yml'):
+                    continue
+                if name in nodes:
+                    raise ValueError('Config name {} is used in {} and {}'.format(name, nodes[name].kind, kind))
+                nodes[name] = DeployNode(name, kind, os.path.join(directory, file_name))
+        for node in nodes.values():
+            for placeholder in node.placeholders:
+                if placeholder.endswith('_id') and placeholder[:-3] in nodes:
+                    node.depends_on.append(placeholder[:-3])
+                elif placeholder not in self.arg_replacements:
+                    raise ValueError('No replacement for ${{{}}} in {}'.format(placeholder, node.path))
+        return nodes
+
+    def _check_graph(self):
+        visiting, done = set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError('Dependency cycle through config {}'.format(name))
+            visiting.add(name)
+            for dependency in self.nodes[name].depends_on:
+                visit(dependency)
+            visiting.discard(name)
+            done.add(name)
+        for name in self.nodes:
+            visit(name)
+
+    def plan(self) -> List[List[str]]:
+        """ The order of deployment: groups of nodes that can be created concurrently,
+        each group after the groups it depends on.
+
+        :return: The names of the nodes per group.
+        :rtype: List[List[str]]
+        """
+        levels = {}
+
+        def level(name):
+            if name not in levels:
+                levels[name] = 1 + max((level(dependency) for dependency in self.nodes[name].depends_on), default=-1)
+            return levels[name]
+        groups = []
+        for name in self.nodes:
+            depth = level(name)
+            groups.extend([] for _ in range(depth + 1 - len(groups)))
+            groups[depth].append(name)
+        return groups
+
+    def _load_state(self) -> Dict:
+        if self.state_path is None or not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path) as f:
+            return json.load(f)
+
+    def _save_state(self, state: Dict):
+        if self.state_path is None:
+            return
+        # write to a temporary file first, so an interrupted write does not lose the state
+        temporary = self.state_path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(state, f, indent=2, sort_keys=True)
+        os.replace(temporary, self.state_path)
+
+    def _deploy(self, node: DeployNode, replacements: Dict, state: Dict, start: float) -> DeployNode:
+        node.started = time.monotonic() - start
+        fingerprint = node.fingerprint(replacements)
+        previous = state.get(node.name)
+        if previous is not None and previous.get('fingerprint') == fingerprint:
+            node.id = previous['id']
+            node.status = 'resumed'
+            node.seconds = 0.0
+            return node
+        created = self.kinds[node.kind](self.aep, node.path, replacements)
+        node.id = created.id if isinstance(created, AEPObject) else created
+        node.seconds = time.monotonic() - start - node.started
+        node.status = 'created'
+        with self._lock:
+            state[node.name] = {'kind': node.kind, 'id': node.id, 'fingerprint': fingerprint,
+                                'seconds': round(node.seconds, 3)}
+            self._save_state(state)
+        return node
+
+    def run(self, fail_fast: bool = False) -> DeployReport:
+        """ Creates all artifacts. A failed node does not stop independent branches;
+        the nodes that depend on it are skipped.
+
+        :param fail_fast: Stop starting nodes after the first failure, defaults to False
+        :type fail_fast: bool, optional
+        :return: The report with the ids and the timing per node.
+        :rtype: DeployReport
+        """
+        state = self._load_state()
+        replacements = dict(self.arg_replacements)
+        remaining = {name: set(node.depends_on) for name, node in self.nodes.items()}
+        dependents = {name: [] for name in self.nodes}
+        for name, node in self.nodes.items():
+            node.status, node.id, node.error, node.started, node.seconds = 'pending', None, None, None, None
+            for dependency in node.depends_on:
+                dependents[dependency].append(name)
+        start = time.monotonic()
+        stopped = False
+
+        def skip(name):
+            for dependent in dependents[name]:
+                if self.nodes[dependent].status == 'pending':
+                    self.nodes[dependent].status = 'skipped'
+                    skip(dependent)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='paaw-deploy') as executor:
+            running = {}
+
+            def submit_ready():
+                for name in [name for name, deps in remaining.items() if not deps]:
+                    del remaining[name]
+                    if self.nodes[name].status == 'pending' and not stopped:
+                        self.nodes[name].status = 'running'
+                        future = executor.submit(self._deploy, self.nodes[name], dict(replacements), state, start)
+                        running[future] = name
+            submit_ready()
+            while running:
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    node = self.nodes[name]
+                    if future.exception() is not None:
+                        node.status = 'failed'
+                        node.error = future.exception()
+                        node.seconds = time.monotonic() - start - node.started
+                        LOGGER.error('Deploying %s %s failed: %s', node.kind, name, node.error)
+                        skip(name)
+                        stopped = stopped or fail_fast
+                    else:
+                        LOGGER.info('Deployed %s %s (%s) in %.1fs', node.kind, name, node.status, node.seconds)
+                        replacements[name + '_id'] = node.id
+                    for dependent in dependents[name]:
+                        remaining.get(dependent, set()).discard(name)
+                submit_ready()
+        for node in self.nodes.values():
+            if node.status == 'pending':
+                node.status = 'skipped'
+        return DeployReport(self.nodes, time.monotonic() - start)
+
+
+def deploy(aep: AEP, config_dir: str, arg_replacements: Dict = None, state_path: str = None,
+           max_workers: int = 4, fail_fast: bool = False) -> DeployReport:
+    """ Deploys a directory of configs as a dependency graph, see Deployment.
+
+    :param aep: The client to deploy with.
+    :type aep: AEP
+    :param config_dir: The directory with a subdirectory of configs per kind.
+    :type config_dir: str
+    :param arg_replacements: Replacements for the placeholders that are not ids of other configs, defaults to None
+    :type arg_replacements: Dict, optional
+    :param state_path: Json file with the state to resume from, defaults to None
+    :type state_path: str, optional
+    :param max_workers: Maximum number of artifacts created at once, defaults to 4
+    :type max_workers: int, optional
+    :param fail_fast: Stop starting nodes after the first failure, defaults to False
+    :type fail_fast: bool, optional
+    :return: The report with the ids and the timing per node.
+    :rtype: DeployReport
+    """
+    return Deployment(aep, config_dir, arg_replacements, state_path, max_workers).run(fail_fast)
@@ -1,3 +1,36 @@
 class NotPossibleToUpdateQuery(Exception):
     """ Raised when we try to update the query portion of a scheduled query"""
-    pass
\ No newline at end of file
+    pass
+
+
+class JobFailed(Exception):
+    """ Raised when a polled job on AEP ends in a failed state"""
+    pass
+
+
+class JobTimeout(Exception):
+    """ Raised when a polled job on AEP did not finish before its timeout"""
+    pass
+
+
+class InvalidPatchOperation(Exception):
+    """ Raised when a JSON-Patch operation does not fit the definition it patches"""
+    pass
+
+
+class CassetteMiss(Exception):
+    """ Raised when a replayed request was not recorded in the cassette"""
+    pass
+
+
+class CircuitOpen(Exception):
+    """ Raised without sending a request when the circuit breaker of its endpoint is open"""
+    pass
+
+
+class SubRequestFailed(Exception):
+    """ Raised for a sub-request of a batched catalog request that did not succeed"""
+    def __init__(self, message: str, status_code: int = None, body=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.body = body
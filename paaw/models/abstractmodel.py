@@ -1,6 +1,8 @@
 from __future__ import annotations
 from ..utils.yamlconfig_parser import parse_config
-from typing import List, Dict, Tuple, TYPE_CHECKING
+from typing import Callable, Iterable, Iterator, List, Dict, Tuple, Union, TYPE_CHECKING
+import json
+import urllib.parse
 if TYPE_CHECKING:
     from ..aep import AEP
 
@@ -24,8 +26,91 @@ class AEPObject():
             self.id = str(id)
         else:
             self.id = str(self.id_find_func(definition))
+        self._fetch = None
+        self._stale = False
         self.definition = definition
         self._aep = _aep
+
+    @classmethod
+    def lazy(cls: AEPObject, id: str, _aep: AEP, fetch: Callable[[], Dict]) -> AEPObject:
+        """ Creates a handle for an AEP artifact of which only the id is known. The
+        definition is retrieved with fetch on first access.
+
+        :param id: The unique id of the artifact on AEP.
+        :type id: str
+        :param _aep: The top class through which all requests are made.
+        :type _aep: AEP
+        :param fetch: Retrieves the definition.
+        :type fetch: Callable[[], Dict]
+        :return: The handle.
+        :rtype: AEPObject
+        """
+        obj = cls.__new__(cls)
+        obj.id = str(id)
+        obj._definition = None
+        obj._aep = _aep
+        obj._fetch = fetch
+        obj._stale = True
+        return obj
+
+    @property
+    def definition(self) -> Dict:
+        """ The definition of the artifact. Lazy handles and invalidated objects
+        retrieve it on first access.
+
+        :return: The definition
+        :rtype: Dict
+        """
+        if self._stale and self._fetch is not None:
+            self._definition = self._fetch()
+            self._stale = False
+        return self._definition
+
+    @definition.setter
+    def definition(self, definition: Dict):
+        self._definition = definition
+        self._stale = False
+
+    @property
+    def is_loaded(self) -> bool:
+        """ Whether the definition is available without a request.
+
+        :return: False for lazy handles and invalidated objects that were not accessed since.
+        :rtype: bool
+        """
+        return not (self._stale and self._fetch is not None)
+
+    @property
+    def _url_id(self) -> str:
+        # the id as it appears in urls
+        return self.id
+
+    def invalidate(self):
+        """ Marks the definition as outdated, so it is retrieved again on next access.
+        Since objects are shared through the identity map of AEP, every holder sees the
+        new definition.
+        """
+        if self._fetch is not None:
+            self._stale = True
+
+    def refresh_definition(self):
+        """ Retrieves the definition again through a get request.
+        """
+        if self._fetch is None:
+            raise ValueError('{} {} does not know how to retrieve its definition'.format(
+                type(self).__name__, self.id))
+        self.definition = self._fetch()
+
+    def _mark_deleted(self):
+        """ Removes this object from the identity map and clears its id and definition,
+        to signify the underlying artifact on AEP is deleted.
+        """
+        identity_map = getattr(self._aep, '_identity_map', None)
+        if identity_map is not None and identity_map.get((type(self), self.id)) is self:
+            del identity_map[(type(self), self.id)]
+        self._fetch = None
+        self.definition = None
+        self.id = None
     @classmethod
     def create_from_config(cls: AEPObject, collection: AEPCollection, config: Dict, _aep: AEP) -> AEPObject:
         """ Creates an AEP artifact using a post request. Returns a class representing that
@@ -46,6 +131,125 @@ class AEPObject():
         return cls(result, _aep)
     
 
+_encode_compact = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False).encode
+
+
+class CompactAEPObject:
+    __slots__ = ('cls', '_id', '_raw', '_definition', '_aep', '_full')
+
+    def __init__(self, cls: type, id: str, raw: bytes, _aep: AEP):
+        """ Memory efficient stand-in for an AEPObject, for listings of tens of thousands
+        of items (batches, flowruns). It has no __dict__ and keeps the definition as
+        compact json bytes, which are parsed on first access of definition.
+        Other attributes and methods are those of the full object, see materialize; once
+        it is materialized, id and definition are those of the full object, so changes by
+        its methods (refresh_definition, delete) show on this handle.
+
+        :param cls: The class of the full object, e.g. FlowRun.
+        :type cls: type
+        :param id: The unique id of the artifact on AEP.
+        :type id: str
+        :param raw: The definition as json encoded bytes.
+        :type raw: bytes
+        :param _aep: The top class through which all requests are made.
+        :type _aep: AEP
+        """
+        self.cls = cls
+        self._id = id
+        self._raw = raw
+        self._definition = None
+        self._aep = _aep
+        self._full = None
+
+    @classmethod
+    def from_definitions(cls, model_cls: type, definitions: Iterable[Dict], _aep: AEP,
+                         ids: Iterable[str] = None) -> List[CompactAEPObject]:
+        """ Builds compact objects for all definitions of a listing in one pass.
+
+        :param model_cls: The class of the full objects, e.g. FlowRun.
+        :type model_cls: type
+        :param definitions: The definitions from the list response.
+        :type definitions: Iterable[Dict]
+        :param _aep: The top class through which all requests are made.
+        :type _aep: AEP
+        :param ids: The ids of the definitions, for listings where the id is not part of
+        the definition, defaults to model_cls.id_find_func
+        :type ids: Iterable[str], optional
+        :return: The compact objects.
+        :rtype: List[CompactAEPObject]
+        """
+        new = cls.__new__
+        encode = _encode_compact
+        if ids is None:
+            find_id = model_cls.id_find_func
+            pairs = ((str(find_id(None, definition)), definition) for definition in definitions)
+        else:
+            pairs = zip((str(id) for id in ids), definitions)
+        objects = []
+        append = objects.append
+        for id, definition in pairs:
+            obj = new(cls)
+            obj.cls = model_cls
+            obj._id = id
+            obj._raw = encode(definition).encode('utf-8')
+            obj._definition = None
+            obj._aep = _aep
+            obj._full = None
+            append(obj)
+        return objects
+
+    @property
+    def name(self) -> str:
+        return self.cls.name
+
+    @property
+    def id(self) -> str:
+        return self._full.id if self._full is not None else self._id
+
+    @property
+    def definition(self) -> Dict:
+        """ The definition, parsed from the json bytes on first access.
+
+        :return: The definition
+        :rtype: Dict
+        """
+        if self._full is not None:
+            return self._full.definition
+        if self._definition is None and self._raw is not None:
+            self._definition = json.loads(self._raw)
+            self._raw = None
+        return self._definition
+
+    @definition.setter
+    def definition(self, definition: Dict):
+        if self._full is not None:
+            self._full.definition = definition
+        self._definition = definition
+        self._raw = None
+
+    def materialize(self) -> AEPObject:
+        """ The full object, e.g. a FlowRun, with the same id and definition. It is created
+        on first use and kept, so stateful methods act on one object.
+
+        :return: The full object.
+        :rtype: AEPObject
+        """
+        if self._full is None:
+            self._full = self.cls(self.definition, self._aep, self._id)
+            # the full object holds the definition from now on
+            self._definition = None
+        return self._full
+
+    def __getattr__(self, name: str):
+        # only called for attributes that are not slots, e.g. the methods of the full object
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.materialize(), name)
+
+    def __repr__(self) -> str:
+        return '<compact {} {}>'.format(self.cls.__name__, self.id)
+
+
 class AEPCollection:
     def __init__(self, _aep: AEP, name: str):
         """ A collection of endpoints
@@ -73,32 +277,147 @@ class AEPCollection:
         :rtype: AEPObject
         """
         config = parse_config(config_path, arg_replacements=arg_replacements)
-        return cls.create_from_config(self, config, self._aep)
-    
-    def _get_aepobject(self, cls: AEPObject, id: str) -> AEPObject:
+        return self._identify(cls.create_from_config(self, config, self._aep))
+
+    def _fetcher(self, cls: AEPObject, url_id: str) -> Callable[[], Dict]:
+        """ Creates a function that retrieves the definition of an artifact through a get request.
+        """
+        path = '.'.join((self.name, cls.name))
+        url_suffix = '/'+str(url_id)
+        return lambda: self._aep.get(path=path, url_suffix=url_suffix)
+
+    def _identify(self, obj: AEPObject, url_id: str = None) -> AEPObject:
+        """ Resolves an object through the identity map of AEP, so every id is represented by
+        one object. When the id is already mapped, the mapped object takes over the (fresher)
+        definition of obj and is returned instead.
+
+        :param obj: A newly built object.
+        :type obj: AEPObject
+        :param url_id: The id as used in the url, defaults to obj.id
+        :type url_id: str, optional
+        :return: The object that represents the id.
+        :rtype: AEPObject
+        """
+        identity_map = getattr(self._aep, '_identity_map', None)
+        if identity_map is None or obj.id is None:
+            return obj
+        key = (type(obj), obj.id)
+        with self._aep._identity_lock:
+            existing = identity_map.get(key)
+            if existing is None:
+                if obj._fetch is None:
+                    obj._fetch = self._fetcher(type(obj), obj._url_id if url_id is None else url_id)
+                identity_map[key] = obj
+                return obj
+        if existing is not obj and obj.is_loaded:
+            existing.definition = obj.definition
+        return existing
+
+    def _get_aepobject(self, cls: AEPObject, id: str, lazy: bool = False, url_id: str = None) -> AEPObject:
         """ Retrieves an existing AEP artifact through a get request.
-        Which artifact to retrieve is specified by the id.
+        Which artifact to retrieve is specified by the id. Artifacts that were
+        retrieved before are returned from the identity map of AEP without a request.
 
         :param cls: The class representing the AEP artifact/endpoint.
         :type cls: AEPObject
         :param id: the unique id for an exiting AEP artifact.
         :type id: str
+        :param lazy: Return a handle that makes the get request on first access of
+        its definition, defaults to False
+        :type lazy: bool, optional
+        :param url_id: The id as used in the url, when it differs from the id (e.g. url encoded),
+        defaults to id
+        :type url_id: str, optional
         :return: An instance of the class, which corresponds to some artifact on AEP.
         :rtype: AEPObject
         """
-        url_suffix = '/'+str(id)
-        result = self._aep.get(path='.'.join((self.name,cls.name)), url_suffix=url_suffix)
-        return cls(result, self._aep)
+        id = str(id)
+        url_id = id if url_id is None else url_id
+        identity_map = getattr(self._aep, '_identity_map', None)
+        existing = identity_map.get((cls, id)) if identity_map is not None else None
+        if existing is not None:
+            if not lazy:
+                existing.definition
+            return existing
+        fetch = self._fetcher(cls, url_id)
+        if lazy:
+            return self._identify(cls.lazy(id, self._aep, fetch))
+        obj = cls(fetch(), self._aep)
+        obj._fetch = fetch
+        return self._identify(obj)
 
     @staticmethod
     def default_definition_extract_func(response):
         return response['items']
     
-    def _get_aepobject_list(self, cls: AEPObject, definition_extract_func=None, get_params=None) -> List[AEPObject]:
+    def _get_aepobject_list(self, cls: AEPObject, definition_extract_func=None, get_params=None,
+                            compact: bool = False) -> List[AEPObject]:
         if definition_extract_func is None:
             definition_extract_func = self.default_definition_extract_func
         if get_params is None:
             get_params = {}
         result = self._aep.get(path='.'.join((self.name,cls.name)), params=get_params)
         definition_list = definition_extract_func(result)
-        return [cls(item, self._aep) for item in definition_list]
\ No newline at end of file
+        if compact:
+            return CompactAEPObject.from_definitions(cls, definition_list, self._aep)
+        return [self._identify(cls(item, self._aep)) for item in definition_list]
+
+    def _get_compact_pages(self, cls: AEPObject, path: str, definition_extract_func: Callable = None,
+                           params: Union[Dict, List[Tuple[str, str]]] = None) -> List[CompactAEPObject]:
+        """ Retrieves all pages of a listing as compact objects. Every page is compacted
+        before the next one is requested, so at most one page of parsed definitions is in memory.
+
+        :param cls: The class of the listed objects.
+        :type cls: AEPObject
+        :param path: Path in known_endpoints, using dot notation.
+        :type path: str
+        :param definition_extract_func: Extracts the list of definitions from one page, defaults to None
+        :type definition_extract_func: Callable, optional
+        :param params: Parameters of the first request, defaults to None
+        :type params: Union[Dict, List[Tuple[str, str]]], optional
+        :return: The compact objects of all pages.
+        :rtype: List[CompactAEPObject]
+        """
+        objects = []
+        page = []
+        for definition in self._iter_pages(path, definition_extract_func, params):
+            page.append(definition)
+            if len(page) >= 1000:
+                objects.extend(CompactAEPObject.from_definitions(cls, page, self._aep))
+                page = []
+        objects.extend(CompactAEPObject.from_definitions(cls, page, self._aep))
+        return objects
+
+    def _iter_pages(self, path: str, definition_extract_func: Callable = None,
+                    params: Union[Dict, List[Tuple[str, str]]] = None) -> Iterator[Dict]:
+        """ Yields the definitions of a listing endpoint, page by page. The next page is
+        requested with the query parameters of the `_links.next.href` in the response,
+        until the response no longer has a next link.
+
+        :param path: Path in known_endpoints, using dot notation.
+        :type path: str
+        :param definition_extract_func: Extracts the list of definitions from one page, defaults to
+        default_definition_extract_func
+        :type definition_extract_func: Callable, optional
+        :param params: Parameters of the first request. Pass a list of tuples to repeat
+        a parameter (e.g. several property filters), defaults to None
+        :type params: Union[Dict, List[Tuple[str, str]]], optional
+        :yield: The definition of every item on every page.
+        :rtype: Iterator[Dict]
+        """
+        if definition_extract_func is None:
+            definition_extract_func = self.default_definition_extract_func
+        params = list(params.items()) if isinstance(params, dict) else list(params or [])
+        while True:
+            result = self._aep.get(path=path, params=params)
+            yield from definition_extract_func(result)
+            next_href = ((result.get('_links') or {}).get('next') or {}).get('href')
+            if not next_href:
+                return
+            # parameters in the next link replace those with the same name, others are kept
+            next_link_params = urllib.parse.parse_qsl(urllib.parse.urlparse(next_href).query)
+            next_keys = {key for key, _ in next_link_params}
+            next_params = [(key, value) for key, value in params if key not in next_keys] + next_link_params
+            if sorted(next_params) == sorted(params):
+                return
+            params = next_params
@@ -1,10 +1,13 @@
 from __future__ import annotations
-from .abstractmodel import AEPCollection, AEPObject
+from .abstractmodel import AEPCollection, AEPObject, CompactAEPObject
 from .dataaccess import DataSetFile
-from typing import List, Dict, Tuple, TYPE_CHECKING
+from ..exc import SubRequestFailed
+from ..utils.concurrency import run_concurrently
+from typing import Iterable, Iterator, List, Dict, Tuple, TYPE_CHECKING
 if TYPE_CHECKING:
     from ..aep import AEP
 import io
+import json
 import pandas as pd
 import warnings
 
@@ -20,30 +23,51 @@ class Dataset(AEPObject):
                                   body={}, 
                                   params={}, 
                                   url_suffix='/'+self.id)
-        self.definition=None
-        self.id=None
+        self._mark_deleted()
 
-    def get_batches(self, status:str = 'success'):
+    def get_batches(self, status:str = 'success', compact: bool = False):
+        """ Retrieves the batches of this dataset, from the catalog index of AEP when it
+        is used, fresh and covers this dataset.
+
+        :param status: Only retrieve batches with this status, None for all, defaults to 'success'
+        :type status: str, optional
+        :param compact: Return CompactAEPObjects, for datasets with very many batches, defaults to False
+        :type compact: bool, optional
+        :return: List of batches
+        :rtype: List[Batch]
+        """
+        index = self._aep._fresh_catalog_index()
+        if index is not None and index.covers(self.id):
+            batches = index.get_batches(self.id, status=status)
+            if compact:
+                return CompactAEPObject.from_definitions(Batch, [batch.definition for batch in batches], self._aep,
+                                                         ids=[batch.id for batch in batches])
+            return batches
         if status is None:
             params = {'dataSet': self.id}
         else:
             params= {'dataSet': self.id, 'status': status}
-        result = self._aep.get(
-            path='catalogservice.batch',
-            body={},
-            params=params)
-        batches = [Batch(definition=batch_def, _aep=self._aep, id=batch_id) for batch_id, batch_def in result.items()]
+        result = self._aep.catalog_service._iter_catalog('catalogservice.batch', params)
+        if compact:
+            result = list(result)
+            return CompactAEPObject.from_definitions(Batch, [batch_def for _, batch_def in result], self._aep,
+                                                     ids=[batch_id for batch_id, _ in result])
+        batches = [Batch(definition=batch_def, _aep=self._aep, id=batch_id) for batch_id, batch_def in result]
         return batches
 
 class Batch(AEPObject):
     name = 'batch'
 
     def get_datasetfiles(self):
-        """ Returns a list of the underlying datasetfiles
+        """ Returns a list of the underlying datasetfiles, from the catalog index of AEP
+        when it is used, fresh and holds those of this batch.
 
         :return: List of the datasetfiles in this batch.
         :rtype: List[DataSetFile]
         """
+        index = self._aep._fresh_catalog_index()
+        if index is not None and index.has_datasetfiles(self.id):
+            return index.get_datasetfiles(self.id)
         result = self._aep.get(
             path='dataaccess.dataaccess',
             body={},
@@ -82,13 +106,135 @@ class CatalogService(AEPCollection):
         """
         return self._create_aepobject(Dataset, config_path, arg_replacements)
 
-    def get_dataset(self, id: str) -> Dataset:
+    def get_dataset(self, id: str, lazy: bool = False) -> Dataset:
         """ Retrieves an existing dataset. Overwrites inherited method 
         because id for dataset is nested in an url.
 
         :param id: Unique id of the dataset to be retrieved.
         :type id: str
+        :param lazy: Return a handle that only retrieves the dataset when its definition
+        is accessed, defaults to False
+        :type lazy: bool, optional
         :return: A dataset instance corresponding to a dataset on AEP.
         :rtype: Dataset
         """
-        return self._get_aepobject(Dataset, id)
\ No newline at end of file
+        return self._get_aepobject(Dataset, id, lazy=lazy)
+
+    def _iter_catalog(self, path: str, params: Dict = None, page_size: int = 100) -> Iterator[Tuple[str, Dict]]:
+        """ Yields the objects of a catalog listing as (id, definition), following the pages
+        with the start and limit parameters, until a page is not full.
+
+        :param path: Path in known_endpoints, using dot notation.
+        :type path: str
+        :param params: Parameters of the listing, defaults to None
+        :type params: Dict, optional
+        :param page_size: Objects per request, at most 100, defaults to 100
+        :type page_size: int, optional
+        """
+        start = 0
+        while True:
+            page = self._aep.get(path, params={**(params or {}), 'start': start, 'limit': page_size})
+            yield from page.items()
+            if len(page) < page_size:
+                return
+            start += len(page)
+
+    def _get_many(self, resource: str, ids: Iterable[str], chunk_size: int = 100,
+                  max_workers: int = 4) -> Tuple[Dict[str, Dict], Dict[str, Exception]]:
+        """ Retrieves catalog objects by id with batched requests: every chunk of ids is one
+        POST with a get sub-request per id, and chunks are sent concurrently. The sub-requests
+        of the 207 multistatus response succeed or fail on their own.
+
+        :param resource: The catalog resource, e.g. dataSets or batches.
+        :type resource: str
+        :param ids: The ids, duplicates are retrieved once.
+        :type ids: Iterable[str]
+        :param chunk_size: Sub-requests per request, defaults to 100
+        :type chunk_size: int, optional
+        :param max_workers: Maximum number of concurrent requests, defaults to 4
+        :type max_workers: int, optional
+        :return: The definitions ({id: definition}) and the errors, keyed on id.
+        :rtype: Tuple[Dict[str, Dict], Dict[str, Exception]]
+        """
+        ids = list(dict.fromkeys(ids))
+        chunks = [ids[start:start + chunk_size] for start in range(0, len(ids), chunk_size)]
+        base_url, extra_headers = self._aep._path_to_endpoint_and_headers('catalogservice.multi')
+
+        def post(chunk):
+            body = [{'id': id, 'resource': '/{}/{}'.format(resource, id), 'method': 'get'} for id in chunk]
+            resp = self._aep.send('POST', base_url, data=json.dumps(body), headers=dict(extra_headers),
+                                  path='catalogservice.multi', multistatus=True)
+            return resp.json()
+
+        definitions, errors = {}, {}
+        for chunk, result, error in run_concurrently(post, chunks, max_workers):
+            if error is not None:
+                errors.update((id, error) for id in chunk)
+                continue
+            answered = set()
+            for sub_response in result:
+                id, code, body = sub_response.get('id'), sub_response.get('code'), sub_response.get('body')
+                answered.add(id)
+                if code == 200 and isinstance(body, dict) and id in body:
+                    definitions[id] = body[id]
+                else:
+                    errors[id] = SubRequestFailed('{} sub-request for {} /{}/{} failed: {}'.format(
+                        code, 'get', resource, id, body), status_code=code, body=body)
+            for id in chunk:
+                if id not in answered:
+                    errors[id] = SubRequestFailed('No sub-response for /{}/{}'.format(resource, id))
+        # in the order of the ids
+        return {id: definitions[id] for id in ids if id in definitions}, errors
+
+    def get_datasets(self, ids: Iterable[str], chunk_size: int = 100,
+                     max_workers: int = 4) -> Tuple[Dict[str, Dataset], Dict[str, Exception]]:
+        """ Retrieves many datasets with a few batched requests instead of one request each.
+        Ids that do not exist or fail end up in the errors instead of raising, so one bad
+        id does not lose the others.
+
+        :param ids: The dataset ids.
+        :type ids: Iterable[str]
+        :param chunk_size: Datasets per request, defaults to 100
+        :type chunk_size: int, optional
+        :param max_workers: Maximum number of concurrent requests, defaults to 4
+        :type max_workers: int, optional
+        :return: The datasets and the errors (SubRequestFailed with the status code of the
+        sub-request, or the error of the whole request), both keyed on id.
+        :rtype: Tuple[Dict[str, Dataset], Dict[str, Exception]]
+        """
+        definitions, errors = self._get_many('dataSets', ids, chunk_size, max_workers)
+        datasets = {id: self._identify(Dataset({id: definition}, self._aep)) for id, definition in definitions.items()}
+        return datasets, errors
+
+    def get_batches_by_ids(self, ids: Iterable[str], chunk_size: int = 100,
+                           max_workers: int = 4) -> Tuple[Dict[str, Batch], Dict[str, Exception]]:
+        """ Retrieves many batches with a few batched requests instead of one request each.
+        See get_datasets.
+
+        :param ids: The batch ids.
+        :type ids: Iterable[str]
+        :param chunk_size: Batches per request, defaults to 100
+        :type chunk_size: int, optional
+        :param max_workers: Maximum number of concurrent requests, defaults to 4
+        :type max_workers: int, optional
+        :return: The batches and the errors, both keyed on id.
+        :rtype: Tuple[Dict[str, Batch], Dict[str, Exception]]
+        """
+        definitions, errors = self._get_many('batches', ids, chunk_size, max_workers)
+        batches = {id: self._identify(Batch(definition, self._aep, id)) for id, definition in definitions.items()}
+        return batches, errors
+
+    def get_all_datasets(self, properties: List[str] = None, page_size: int = 100) -> List[Dataset]:
+        """ Retrieves all datasets in the sandbox, page by page.
+
+        :param properties: Only retrieve these fields of the datasets, e.g. ['name', 'created', 'tags'],
+        which makes large listings much smaller, defaults to None (all fields)
+        :type properties: List[str], optional
+        :param page_size: Datasets per request, at most 100, defaults to 100
+        :type page_size: int, optional
+        :return: The datasets.
+        :rtype: List[Dataset]
+        """
+        params = {'properties': ','.join(properties)} if properties else {}
+        return [self._identify(Dataset({id: definition}, self._aep))
+                for id, definition in self._iter_catalog('catalogservice.dataset', params, page_size)]
\ No newline at end of file
@@ -5,7 +5,9 @@ if TYPE_CHECKING:
     from ..aep import AEP
 import io
 import pandas as pd
+import pyarrow as pa
 import pyarrow.parquet as pq
+from ..utils.xdm_arrow import flatten_table
 
 class DataSetFile(AEPObject):
     name = 'datasetfile'
@@ -40,16 +42,41 @@ class DataSetFile(AEPObject):
             base_url, extra_headers = self._aep._path_to_endpoint_and_headers('dataaccess.files')
             url = base_url+url_suffix
                 
-            resp = self._aep.session.request(
-                method='GET', 
-                url=url, data={}, 
+            resp = self._aep.send(
+                'GET', 
+                url, data={}, 
                 params={'path': pathname}, 
-                headers=extra_headers)
+                headers=dict(extra_headers))
             file = io.BytesIO(resp.content)
         else:
             raise Exception(f'The filetype {filetype} is not implemented')
         return file
 
+    def download_file_at_pathname(self, pathname: str, dest_path: str, chunk_size: int = 1024 * 1024) -> str:
+        """ Streams the file at pathname to a local file, without holding the whole
+        file in memory.
+
+        :param pathname: The pathname to the file
+        :type pathname: str
+        :param dest_path: Local path to write the file to.
+        :type dest_path: str
+        :param chunk_size: Bytes per chunk, defaults to 1 MiB
+        :type chunk_size: int, optional
+        :return: The local path.
+        :rtype: str
+        """
+        base_url, extra_headers = self._aep._path_to_endpoint_and_headers('dataaccess.files')
+        resp = self._aep.send(
+            'GET',
+            base_url+'/'+self.id,
+            params={'path': pathname},
+            headers=dict(extra_headers),
+            stream=True)
+        with resp, open(dest_path, 'wb') as dest:
+            for chunk in resp.iter_content(chunk_size=chunk_size):
+                dest.write(chunk)
+        return dest_path
+
     def get_all_files(self):
         """Loops over all the pathnames under this DataSetFile, and retrieves
         the underlying file as a byte-array in memory.
@@ -77,18 +104,24 @@ class DataSetFile(AEPObject):
             frames[pathname] = pd.read_parquet(file)
         return frames
 
-    def get_all_files_as_arrowtable(self):
+    def get_all_files_as_arrowtable(self, arrow_schema: pa.Schema = None, flatten: bool = False):
         """ Gets all files and converts them to arrow tables. 
         For writing to a database, avoiding parsing to pandas is most likely
         less memory intensive.
 
+        :param arrow_schema: Schema to decode the files with, for example from
+        SchemaRegistry.get_arrow_schema. Defaults to None (the schema in the file)
+        :type arrow_schema: pyarrow.Schema, optional
+        :param flatten: Whether to flatten nested structs to dotted column names, defaults to False
+        :type flatten: bool, optional
         :return: A dictionary keyed on pathname containing the arrow tables
         :rtype: Dict[str, pyarrow.Table]
         """
         files = self.get_all_files()
         arrow_tables = {}
         for pathname, file in files.items():
-            arrow_tables[pathname] = pq.read_table(source=file)
+            table = pq.read_table(source=file, schema=arrow_schema)
+            arrow_tables[pathname] = flatten_table(table) if flatten else table
         return arrow_tables
 
 #TODO: change this to iterators to prevent memory issues?    
@@ -1,24 +1,52 @@
 from __future__ import annotations
-from .abstractmodel import AEPCollection, AEPObject
-from typing import List, Dict, Tuple, TYPE_CHECKING
+from .abstractmodel import AEPCollection, AEPObject, CompactAEPObject
+from ..utils.concurrency import RateLimiter, run_concurrently
+from typing import Iterable, List, Dict, Tuple, TYPE_CHECKING
 if TYPE_CHECKING:
     from ..aep import AEP
 
+
+def _find_flowservice_id(definition: Dict) -> str:
+    """ Finds the id in a flowservice definition. A get request on a single flow
+    or flowrun returns a list with 1 item, listings return the items themselves.
+    """
+    if 'items' in definition:
+        return definition['items'][0]['id']
+    return definition['id']
+
+
 class Flow(AEPObject):
-    name = 'flows'
+    name = 'flow'
     # for some reason, request to flows always returns a list with 1 item. 
-    id_find_func = lambda self, definition: definition['items'][0]['id']
-    def get_flowruns(self) -> List[FlowRun]:
-        """ Retrieves all the flowruns for this flow
+    id_find_func = lambda self, definition: _find_flowservice_id(definition)
+    def get_flowruns(self, since: int = None, compact: bool = False) -> List[FlowRun]:
+        """ Retrieves all the flowruns for this flow, following the pages of the listing.
 
+        :param since: Only retrieve runs updated after this epoch timestamp in milliseconds,
+        defaults to None
+        :type since: int, optional
+        :param compact: Return CompactAEPObjects, for flows with very many runs, defaults to False
+        :type compact: bool, optional
         :return: List of flowruns
         :rtype: List[FlowRun]
         """
-        params = {'property': 'flowId=='+self.id}
-        result = self._aep.get(
-            'flowservice.runs',
-            params=params)
-        return [FlowRun(item, self._aep, item['id']) for item in result['items']]
+        params = [('property', 'flowId=='+self.id)]
+        if since is not None:
+            params.append(('property', 'updatedAt>{}'.format(since)))
+        if compact:
+            return self._aep.flow_service._get_compact_pages(FlowRun, 'flowservice.runs', params=params)
+        items = self._aep.flow_service._iter_pages('flowservice.runs', params=params)
+        return [FlowRun(item, self._aep, item['id']) for item in items]
+
+    def delete(self):
+        """ Deletes the flow. Clears this class of its id and definition
+        to signify underlying artifact on AEP is deleted.
+        """
+        self._aep.delete(path='flowservice.flow',
+                         body={},
+                         params={},
+                         url_suffix='/'+self.id)
+        self._mark_deleted()
 
     def start_flowrun(self) -> FlowRun:
         """Starts a new flowrun for this flow, using a post request.
@@ -35,19 +63,126 @@ class Flow(AEPObject):
             body=body,
             params={}
         )
-        return self._aep.flow_service.get_flowrun(result["id"])
+        # the response only holds the id and etag, the status follows on the first refresh
+        return self._aep.flow_service._identify(FlowRun({'items': [{**body, **result}]}, self._aep))
 
 
 class FlowRun(AEPObject):
     name = 'runs'
     # for some reason, request to flowruns always returns a list with 1 item. 
-    id_find_func= lambda self, definition: definition['items'][0]['id']
+    id_find_func= lambda self, definition: _find_flowservice_id(definition)
+    succeeded_states = ('success', 'partialSuccess')
+    failed_states = ('failed', 'cancelled')
+
     def refresh_definition(self):
         """ Refreshed the definition of this flow. Usefull when polling the
         status of a flowrun
         """
-        this_flowrun = self._aep.flow_service.get_flowrun(self.id)
-        self.definition = this_flowrun.definition
+        self.definition = self._aep.get(path='flowservice.runs', url_suffix='/'+self.id)
+
+    def poll_status(self) -> Dict:
+        """ Refreshes the definition of this flowrun and returns it.
+
+        :return: The refreshed definition, which contains the status.
+        :rtype: Dict
+        """
+        self.refresh_definition()
+        return self.definition
+
+    @staticmethod
+    def status_from(result: Dict) -> str:
+        """ Extracts the status from the result of poll_status.
+
+        :param result: The result of poll_status.
+        :type result: Dict
+        :return: The status of the flowrun.
+        :rtype: str
+        """
+        run = result['items'][0] if 'items' in result else result
+        status_summary = run.get('metrics', {}).get('statusSummary', {})
+        return status_summary.get('status', run.get('status'))
+
+
+class FlowRunWatcher:
+    def __init__(self, flow_service: FlowService, flow_ids: Iterable[str], since: int = None,
+                 chunk_size: int = 20, max_workers: int = 4):
+        """ Monitors the runs of many flows. Every poll only asks for the runs that were
+        updated since the last seen update, for a chunk of flows per request. Every chunk
+        keeps its own watermark, as the chunks are listed concurrently and a run of one chunk
+        can be updated after the poll listed it but before the newest update of another.
+
+        :param flow_service: The collection through which requests are made.
+        :type flow_service: FlowService
+        :param flow_ids: The flows to monitor.
+        :type flow_ids: Iterable[str]
+        :param since: Only runs updated at or after this epoch timestamp in milliseconds are retrieved,
+        defaults to None (all runs)
+        :type since: int, optional
+        :param chunk_size: Number of flow ids combined in one property filter. Use 1 for a
+        filter per flow, defaults to 20
+        :type chunk_size: int, optional
+        :param max_workers: Maximum number of concurrent requests, defaults to 4
+        :type max_workers: int, optional
+        """
+        self.flow_service = flow_service
+        self.flow_ids = list(flow_ids)
+        self.since = since
+        self.chunk_size = max(1, chunk_size)
+        self.max_workers = max_workers
+        self.runs = {}
+        self.watermarks = {}
+
+    def _get_chunk(self, flow_ids: Tuple[str]) -> List[Dict]:
+        params = [('property', 'flowId=={}'.format(','.join(flow_ids)))]
+        since = self.watermarks.get(flow_ids, self.since)
+        if since is not None:
+            # runs updated in the same millisecond as the watermark may have been missed, so they are listed again
+            params.append(('property', 'updatedAt>={}'.format(since)))
+        return list(self.flow_service._iter_pages('flowservice.runs', params=params))
+
+    def poll(self) -> List[FlowRun]:
+        """ Retrieves the runs that were created or updated since the previous poll. When a
+        request fails, nothing is recorded and the watermarks stay where they were, so the next
+        poll retrieves the runs of the failed chunk (and the others) again. Afterwards since
+        holds the oldest watermark of the chunks, from which a new watcher can resume.
+
+        :raises Exception: The first error of a request, after all chunks have been tried.
+        :return: The new or changed flowruns.
+        :rtype: List[FlowRun]
+        """
+        chunks = [tuple(self.flow_ids[i:i + self.chunk_size]) for i in range(0, len(self.flow_ids), self.chunk_size)]
+        results = run_concurrently(self._get_chunk, chunks, self.max_workers)
+        errors = [error for _, _, error in results if error is not None]
+        changed = []
+        watermarks = {}
+        for chunk, definitions, _ in results:
+            newest = self.watermarks.get(chunk, self.since)
+            for definition in definitions or []:
+                updated = definition.get('updatedAt', definition.get('createdAt'))
+                seen = self.runs.get(definition['id'])
+                if seen is not None and seen.definition.get('updatedAt', seen.definition.get('createdAt')) == updated:
+                    # listed again because of the inclusive watermark, unchanged
+                    continue
+                changed.append(FlowRun(definition, self.flow_service._aep, definition['id']))
+                if isinstance(updated, int) and (newest is None or updated > newest):
+                    newest = updated
+            watermarks[chunk] = newest
+        if errors:
+            raise errors[0]
+        self.runs.update((flowrun.id, flowrun) for flowrun in changed)
+        self.watermarks.update(watermarks)
+        if chunks and all(self.watermarks.get(chunk) is not None for chunk in chunks):
+            self.since = min(self.watermarks[chunk] for chunk in chunks)
+        return changed
+
+    def unfinished(self) -> List[FlowRun]:
+        """ The seen flowruns that did not succeed or fail yet.
+
+        :return: The unfinished flowruns.
+        :rtype: List[FlowRun]
+        """
+        done = FlowRun.succeeded_states + FlowRun.failed_states
+        return [run for run in self.runs.values() if FlowRun.status_from(run.definition) not in done]
 
 
 class FlowService(AEPCollection):
@@ -60,15 +195,18 @@ class FlowService(AEPCollection):
         """
         super().__init__(_aep, 'flowservice')
     
-    def get_flow(self, flow_id: str) -> Flow:
+    def get_flow(self, flow_id: str, lazy: bool = False) -> Flow:
         """ Retrieves a flow for a given flow_id.
 
         :param flow_id: the flow_id to retrieve.
         :type flow_id: str
+        :param lazy: Return a handle that only retrieves the flow when its definition
+        is accessed, defaults to False
+        :type lazy: bool, optional
         :return: The flow under flow_id.
         :rtype: Flow
         """
-        return self._get_aepobject(Flow, flow_id)
+        return self._get_aepobject(Flow, flow_id, lazy=lazy)
 
     def create_flow(self, config_path: str, arg_replacements: Dict) -> Flow:
         """ Creates a new flow for a given config at config_path.
@@ -83,12 +221,14 @@ class FlowService(AEPCollection):
         """
         return self._create_aepobject(Flow, config_path, arg_replacements)
 
-    def get_all_flows(self, property_filter:str =None) -> List[Flow]:
+    def get_all_flows(self, property_filter:str =None, compact: bool = False) -> List[Flow]:
         """ Retrieves all flows.
 
         :param property_filter: A string used to filter the flows to retrieve. For example: 
         flowId==some_flow_id, defaults to None
         :type property_filter: str, optional
+        :param compact: Return CompactAEPObjects, for large listings, defaults to False
+        :type compact: bool, optional
         :return: A list of flows, satisfying the filter.
         :rtype: List[Flow]
         """
@@ -96,24 +236,29 @@ class FlowService(AEPCollection):
             params = {'property': property_filter}
         else:
             params = {}
-        return self._get_aepobject_list(Flow, get_params=params)
+        return self._get_aepobject_list(Flow, get_params=params, compact=compact)
     
-    def get_flowrun(self, flowrun_id: str) -> FlowRun:
+    def get_flowrun(self, flowrun_id: str, lazy: bool = False) -> FlowRun:
         """ Retrieves a flowrun for given flowrun_id.
 
         :param flowrun_id: The flowrun_id to retrieve.
         :type flowrun_id: str
+        :param lazy: Return a handle that only retrieves the flowrun when its definition
+        is accessed, defaults to False
+        :type lazy: bool, optional
         :return: The flowrun.
         :rtype: FlowRun
         """
-        return self._get_aepobject(FlowRun, flowrun_id)
+        return self._get_aepobject(FlowRun, flowrun_id, lazy=lazy)
     
-    def get_all_flowruns(self, property_filter:str =None) -> List[FlowRun]:
+    def get_all_flowruns(self, property_filter:str =None, compact: bool = False) -> List[FlowRun]:
         """ Retrieves all flowruns
 
         :param property_filter: A string used to filter the flowruns. For example:
         flowId==some_flow_id, defaults to None
         :type property_filter: str, optional
+        :param compact: Return CompactAEPObjects, for large listings, defaults to False
+        :type compact: bool, optional
         :return: A list of flowruns satisfying the filter.
         :rtype: List[FlowRun]
         """
@@ -122,4 +267,48 @@ class FlowService(AEPCollection):
         else:
             params = {}
     
-        return self._get_aepobject_list(FlowRun, get_params=params)
\ No newline at end of file
+        return self._get_aepobject_list(FlowRun, get_params=params, compact=compact)
+
+    def start_flowruns(self, flow_ids: Iterable[str], max_workers: int = 8,
+                       requests_per_second: float = None) -> Tuple[Dict[str, FlowRun], Dict[str, Exception]]:
+        """ Starts a flowrun for each flow concurrently. The flowruns are built
+        from the post responses, without an extra get per flowrun.
+
+        :param flow_ids: The flows to start a run for.
+        :type flow_ids: Iterable[str]
+        :param max_workers: Maximum number of concurrent requests, defaults to 8
+        :type max_workers: int, optional
+        :param requests_per_second: Rate at which runs are started, defaults to None (no limit)
+        :type requests_per_second: float, optional
+        :return: The started flowruns and the errors, both keyed on flow id.
+        :rtype: Tuple[Dict[str, FlowRun], Dict[str, Exception]]
+        """
+        def start(flow_id):
+            return Flow({'id': flow_id}, self._aep).start_flowrun()
+
+        rate_limiter = RateLimiter(requests_per_second, burst=max_workers)
+        flowruns, errors = {}, {}
+        for flow_id, flowrun, error in run_concurrently(start, flow_ids, max_workers, rate_limiter):
+            if error is not None:
+                errors[flow_id] = error
+            else:
+                flowruns[flow_id] = flowrun
+        return flowruns, errors
+
+    def watch_runs(self, flow_ids: Iterable[str], since: int = None, chunk_size: int = 20,
+                   max_workers: int = 4) -> FlowRunWatcher:
+        """ Creates a watcher that monitors the runs of many flows incrementally.
+        Call poll on the watcher to get the runs that changed since the last poll.
+
+        :param flow_ids: The flows to monitor.
+        :type flow_ids: Iterable[str]
+        :param since: Epoch timestamp in milliseconds of the last seen update, defaults to None
+        :type since: int, optional
+        :param chunk_size: Number of flow ids combined in one property filter, defaults to 20
+        :type chunk_size: int, optional
+        :param max_workers: Maximum number of concurrent requests, defaults to 4
+        :type max_workers: int, optional
+        :return: The watcher.
+        :rtype: FlowRunWatcher
+        """
+        return FlowRunWatcher(self, flow_ids, since, chunk_size, max_workers)
@@ -3,12 +3,32 @@ import requests
 from ..exc import NotPossibleToUpdateQuery
 from requests.api import request
 from .abstractmodel import AEPCollection, AEPObject
+from ..utils.concurrency import RateLimiter, run_concurrently
+from ..utils.yamlconfig_parser import parse_config
 from typing import List, Dict, Tuple, TYPE_CHECKING
+import glob
+import os
 import re
+import time
 if TYPE_CHECKING:
     from ..aep import AEP
 
 
+RETRYABLE_DELETE_STATUS_CODES = (409, 423, 429, 500, 502, 503, 504)
+
+
+def _is_retryable_delete_error(error: requests.exceptions.HTTPError) -> bool:
+    """ Whether a failed disable or delete of a scheduled query may succeed later: a transient
+    error, or a refusal because the query is not disabled yet (AEP answers that with a 400).
+    """
+    response = error.response
+    if response is None:
+        return False
+    if response.status_code == 400:
+        return 'disabled' in response.text
+    return response.status_code in RETRYABLE_DELETE_STATUS_CODES
+
+
 class Query(AEPObject):
     name = 'query'
 
@@ -37,18 +57,30 @@ class ScheduledQuery(AEPObject):
         :param value: The replacement value.
         :type value: str
         """
-        body = {
-            "body": [{
-                "op": "replace",
-                "path": path,
-                "value": value
-            }]
-        }
+        self.patch_ops([{
+            "op": "replace",
+            "path": path,
+            "value": value
+        }])
+
+    def patch_ops(self, operations: List[Dict], refresh: bool = True):
+        """ Sends several JSON-Patch operations in a single patch request, and
+        refreshes the definition once afterwards.
+
+        :param operations: The JSON-Patch operations, each with an op, path and value.
+        :type operations: List[Dict]
+        :param refresh: Whether to refresh the definition after patching, defaults to True
+        :type refresh: bool, optional
+        """
+        if not operations:
+            return
+        body = {"body": list(operations)}
         self._aep.update(path='queryservice.scheduledquery', 
                          body=body, 
                          params={}, 
                          url_suffix='/'+self.id)
-        self.refresh_definition()
+        if refresh:
+            self.refresh_definition()
     
     def change_state(self, new_state: str):
         """ Changes the state of the query.
@@ -82,19 +114,70 @@ class ScheduledQuery(AEPObject):
         else:
             print("no changes detected")
 
-    def delete(self):
+    def delete(self, retries: int = 3, backoff: float = 2.0):
         """ Deletes this scheduledquery by first disabling it. Sets id and definition
-        to none to signify it's been deleted.
+        to none to signify it's been deleted. AEP only deletes disabled scheduled queries,
+        and a disable can take a moment to apply, so a delete that is refused because the
+        query is not disabled yet, or that fails on a transient error (429, 5xx), is retried
+        with exponential backoff; a query that is disabled already is not disabled again.
+        A query that is gone already (404) counts as deleted.
+
+        :param retries: Number of retries of the sequence, defaults to 3
+        :type retries: int, optional
+        :param backoff: Seconds before the first retry, doubled per retry, defaults to 2.0
+        :type backoff: float, optional
+        :raises requests.exceptions.HTTPError: Raised on other errors, or when the last attempt fails.
+        """
+        for attempt in range(retries + 1):
+            try:
+                if attempt > 0:
+                    self.refresh_definition()
+                if self.definition.get('state') != 'DISABLED':
+                    self.change_state('disable')
+                self._aep.delete(path='queryservice.scheduledquery',
+                                 body={},
+                                 params={}, url_suffix='/'+self.id)
+                break
+            except requests.exceptions.HTTPError as e:
+                status = e.response.status_code if e.response is not None else None
+                if status == 404:
+                    break
+                if attempt == retries or not _is_retryable_delete_error(e):
+                    raise
+                time.sleep(backoff * 2 ** attempt)
+        self._mark_deleted()
+
+
+class ReconcilePlan:
+    def __init__(self):
+        """ The changes needed to make the scheduled queries on AEP match a directory
+        of configs. Every entry is keyed on the query name. After applying, results
+        and errors hold the outcome per query name.
+        """
+        self.create = {}
+        self.update = {}
+        self.replace = {}
+        self.delete = {}
+        self.unchanged = []
+        self.results = {}
+        self.errors = {}
+
+    def is_empty(self) -> bool:
+        """ Whether the plan has no changes to apply.
+
+        :return: True if nothing needs to be created, updated, replaced or deleted.
+        :rtype: bool
         """
-        try:
-            self.change_state('disable')
-        except requests.exceptions.HTTPError as e:
-            print('Encountered error {}. Trying again later often works'.format(e))
-        self._aep.delete(path='queryservice.scheduledquery', 
-                         body={}, 
-                         params={}, url_suffix='/'+self.id)
-        self.id = None
-        self.definition = None
+        return not (self.create or self.update or self.replace or self.delete)
+
+    def __str__(self) -> str:
+        """ string representation of the plan
+
+        :return: string representation
+        :rtype: str
+        """
+        return 'plan with {} create, {} update, {} replace, {} delete, {} unchanged'.format(
+            len(self.create), len(self.update), len(self.replace), len(self.delete), len(self.unchanged))
 
 
 class QueryService(AEPCollection):
@@ -131,26 +214,193 @@ class QueryService(AEPCollection):
         """
         return self._create_aepobject(ScheduledQuery, config_path, arg_replacements)    
 
-    def get_query(self, id: str) -> Query:
+    def get_query(self, id: str, lazy: bool = False) -> Query:
         """ Creates a query object from an existing query on AEP.
 
         :param id: The id of the query on AEP.
         :type id: str
+        :param lazy: Return a handle that only retrieves the query when its definition
+        is accessed, defaults to False
+        :type lazy: bool, optional
         :return: And instance of Query, which represents a query on AEP.
         :rtype: Query
         """
-        return self._get_aepobject(Query, id)
+        return self._get_aepobject(Query, id, lazy=lazy)
     
-    def get_scheduledquery(self, id: str) -> ScheduledQuery:
+    def get_scheduledquery(self, id: str, lazy: bool = False) -> ScheduledQuery:
         """ Creates a Scheduled query object from an existing schedules 
         query on AEP.
 
         :param id: The id of the query on AEP.
         :type id: str
+        :param lazy: Return a handle that only retrieves the scheduledquery when its definition
+        is accessed, defaults to False
+        :type lazy: bool, optional
         :return: And instance of ScheduledQuery, which represents a query on AEP.
         :rtype: ScheduledQuery
         """
-        return self._get_aepobject(ScheduledQuery, id)
+        return self._get_aepobject(ScheduledQuery, id, lazy=lazy)
+
+    def get_all_scheduledqueries(self) -> List[ScheduledQuery]:
+        """ Retrieves all scheduled queries in one paginated sweep. The objects are built
+        from the listing itself, so no get request is made per scheduled query.
+
+        :return: A list of all ScheduledQuery objects.
+        :rtype: List[ScheduledQuery]
+        """
+        definitions = self._iter_pages('queryservice.scheduledquery',
+                                       definition_extract_func=lambda result: result['schedules'])
+        return [ScheduledQuery(definition, self._aep) for definition in definitions]
+
+    @staticmethod
+    def _diff_scheduledquery(current: Dict, new_def: Dict) -> List[Dict]:
+        """ Computes the JSON-Patch operations that update the current definition
+        of a scheduled query to the new definition.
+
+        :param current: The definition on AEP.
+        :type current: Dict
+        :param new_def: The wanted definition.
+        :type new_def: Dict
+        :return: The patch operations, empty if nothing changed.
+        :rtype: List[Dict]
+        """
+        operations = []
+        new_schedule = new_def.get('schedule', {})
+        if not new_schedule.items() <= current.get('schedule', {}).items():
+            operations.append({"op": "replace", "path": "schedule/schedule", "value": new_schedule['schedule']})
+        new_state = new_def.get('state')
+        if new_state and not str(current.get('state', '')).upper().startswith(new_state.upper()):
+            operations.append({"op": "replace", "path": "/state", "value": new_state})
+        return operations
+
+    def plan_scheduledqueries(self, config_dir: str, arg_replacements: Dict = None,
+                              prune_pattern: str = None) -> ReconcilePlan:
+        """ Compares a directory of scheduled query configs with the scheduled queries
+        on AEP and computes what has to change. Configs and scheduled queries are matched
+        on the query name. The remote state is retrieved in a single paginated sweep and
+        the comparison happens locally.
+
+        :param config_dir: Directory with a .yaml config per scheduled query.
+        :type config_dir: str
+        :param arg_replacements: Replacements in the config yamls, defaults to None
+        :type arg_replacements: Dict, optional
+        :param prune_pattern: Scheduled queries on AEP without config, whose name matches this
+        regex are planned for deletion. Nothing is deleted when None, defaults to None
+        :type prune_pattern: str, optional
+        :raises ValueError: Raised when two configs have the same query name.
+        :return: The plan to reconcile AEP with the configs.
+        :rtype: ReconcilePlan
+        """
+        arg_replacements = arg_replacements or {}
+        config_paths = sorted(glob.glob(os.path.join(config_dir, '*.yaml')) +
+                              glob.glob(os.path.join(config_dir, '*.yml')))
+        configs = {}
+        for config_path in config_paths:
+            config = parse_config(config_path, arg_replacements=arg_replacements)
+            name = config['query']['name']
+            if name in configs:
+                raise ValueError('Query name {} is defined in more than one config'.format(name))
+            configs[name] = config
+
+        remote = {}
+        for scheduledquery in self.get_all_scheduledqueries():
+            remote.setdefault(scheduledquery.definition['query']['name'], scheduledquery)
+
+        plan = ReconcilePlan()
+        for name, config in configs.items():
+            current = remote.get(name)
+            if current is None:
+                plan.create[name] = config
+            elif current.definition['query']['sql'] != config['query']['sql']:
+                plan.replace[name] = (current, config)
+            else:
+                operations = self._diff_scheduledquery(current.definition, config)
+                if operations:
+                    plan.update[name] = (current, operations)
+                else:
+                    plan.unchanged.append(name)
+        if prune_pattern is not None:
+            for name, scheduledquery in remote.items():
+                if name not in configs and re.match(prune_pattern, name):
+                    plan.delete[name] = scheduledquery
+        return plan
+
+    def apply_plan(self, plan: ReconcilePlan, replace_changed: bool = False, max_workers: int = 8,
+                   requests_per_second: float = 5) -> ReconcilePlan:
+        """ Applies a plan concurrently. Every scheduled query gets at most one batched patch
+        request followed by one refresh. Errors are collected per query name in plan.errors
+        instead of being raised.
+
+        :param plan: The plan computed by plan_scheduledqueries.
+        :type plan: ReconcilePlan
+        :param replace_changed: Whether to delete and redeploy scheduled queries whose sql changed.
+        Otherwise these end up in plan.errors as NotPossibleToUpdateQuery, defaults to False
+        :type replace_changed: bool, optional
+        :param max_workers: Maximum number of concurrent requests, defaults to 8
+        :type max_workers: int, optional
+        :param requests_per_second: Rate at which changes are started, defaults to 5
+        :type requests_per_second: float, optional
+        :return: The same plan, with results and errors filled.
+        :rtype: ReconcilePlan
+        """
+        def apply(action):
+            kind, name = action
+            if kind == 'create':
+                return ScheduledQuery.create_from_config(self, plan.create[name], self._aep)
+            if kind == 'update':
+                scheduledquery, operations = plan.update[name]
+                scheduledquery.patch_ops(operations)
+                return scheduledquery
+            if kind == 'replace':
+                scheduledquery, config = plan.replace[name]
+                if not replace_changed:
+                    raise NotPossibleToUpdateQuery("Query changed. Please delete this scheduledquery and deploy the new definition")
+                scheduledquery.delete()
+                return ScheduledQuery.create_from_config(self, config, self._aep)
+            plan.delete[name].delete()
+            return None
+
+        actions = ([('create', name) for name in plan.create] +
+                   [('update', name) for name in plan.update] +
+                   [('replace', name) for name in plan.replace] +
+                   [('delete', name) for name in plan.delete])
+        rate_limiter = RateLimiter(requests_per_second, burst=max_workers)
+        for (_, name), result, error in run_concurrently(apply, actions, max_workers, rate_limiter):
+            if error is not None:
+                plan.errors[name] = error
+            else:
+                plan.results[name] = result
+        return plan
+
+    def reconcile_scheduledqueries(self, config_dir: str, arg_replacements: Dict = None,
+                                   prune_pattern: str = None, replace_changed: bool = False,
+                                   max_workers: int = 8, requests_per_second: float = 5,
+                                   dry_run: bool = False) -> ReconcilePlan:
+        """ Makes the scheduled queries on AEP match a directory of configs. See
+        plan_scheduledqueries and apply_plan.
+
+        :param config_dir: Directory with a .yaml config per scheduled query.
+        :type config_dir: str
+        :param arg_replacements: Replacements in the config yamls, defaults to None
+        :type arg_replacements: Dict, optional
+        :param prune_pattern: Regex for names of scheduled queries without config that
+        should be deleted, defaults to None
+        :type prune_pattern: str, optional
+        :param replace_changed: Whether to redeploy scheduled queries whose sql changed, defaults to False
+        :type replace_changed: bool, optional
+        :param max_workers: Maximum number of concurrent requests, defaults to 8
+        :type max_workers: int, optional
+        :param requests_per_second: Rate at which changes are started, defaults to 5
+        :type requests_per_second: float, optional
+        :param dry_run: Only compute the plan, defaults to False
+        :type dry_run: bool, optional
+        :return: The (applied) plan.
+        :rtype: ReconcilePlan
+        """
+        plan = self.plan_scheduledqueries(config_dir, arg_replacements, prune_pattern)
+        if dry_run:
+            return plan
+        return self.apply_plan(plan, replace_changed, max_workers, requests_per_second)
 
     def get_list_scheduledqueries_by_name(self, name: str) -> List:
         """Creates a list of Scheduled query objects that contain a certain string in the name.
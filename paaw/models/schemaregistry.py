@@ -1,28 +1,199 @@
 from __future__ import annotations
 import urllib.parse
 from paaw.utils.yamlconfig_parser import parse_config
+from ..utils.xdm_arrow import xdm_to_arrow_schema
+from ..utils.xdm_validation import XDMValidator
+from ..utils.jsonpatch import apply_operation
 from .abstractmodel import AEPCollection, AEPObject
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List, Dict, Tuple, TYPE_CHECKING
+import copy
+import json
+import os
+import requests
 import warnings
 if TYPE_CHECKING:
+    import pyarrow
     from ..aep import AEP
 
+# maps the resource segment in an XDM $id to the schema registry resource type
+XDM_RESOURCE_TYPES = {
+    'schemas': 'schemas',
+    'classes': 'classes',
+    'mixins': 'fieldgroups',
+    'fieldgroups': 'fieldgroups',
+    'datatypes': 'datatypes',
+    'behaviors': 'behaviors',
+}
 
-class Schema(AEPObject):
-    name = 'schema'
+
+def _split_ref(ref: str) -> Tuple[str, str]:
+    """ Splits an XDM reference into the $id of the resource and the json pointer
+    fragment within it.
+    """
+    base, _, fragment = ref.partition('#')
+    return base, fragment
+
+
+def _is_xdm_ref(ref: str) -> bool:
+    return isinstance(ref, str) and urllib.parse.urlparse(ref).netloc == 'ns.adobe.com'
+
+
+def _find_refs(node: object, hint: str = 'property') -> List[Tuple[str, str]]:
+    """ Finds all XDM references in a definition. The hint tells whether the reference
+    is used in an allOf (a class, fieldgroup or behavior) or as a property (a datatype).
+
+    :return: Tuples of the referenced $id and the hint.
+    :rtype: List[Tuple[str, str]]
+    """
+    refs = []
+    if isinstance(node, dict):
+        if _is_xdm_ref(node.get('$ref')):
+            refs.append((_split_ref(node['$ref'])[0], hint))
+        for key, value in node.items():
+            refs.extend(_find_refs(value, 'allOf' if key == 'allOf' else 'property'))
+    elif isinstance(node, list):
+        for value in node:
+            refs.extend(_find_refs(value, hint))
+    return refs
+
+
+def _resolve_pointer(definition: Dict, fragment: str) -> object:
+    node = definition
+    for step in fragment.strip('/').split('/'):
+        if step:
+            node = node[step.replace('~1', '/').replace('~0', '~')]
+    return node
+
+
+class PatchEditor:
+    def __init__(self, resource: XDMResource):
+        """ Collects JSON-Patch operations for a schema or fieldgroup. Every operation
+        is checked against a working copy of the cached definition when it is added.
+        Use through XDMResource.edit().
+
+        :param resource: The schema or fieldgroup to edit.
+        :type resource: XDMResource
+        """
+        self.resource = resource
+        self.operations = []
+        self._working_copy = copy.deepcopy(resource.definition)
+
+    def operation(self, op: str, path: str, value: object = None, from_path: str = None) -> PatchEditor:
+        """ Adds an operation.
+
+        :param op: add, remove, replace, move, copy or test.
+        :type op: str
+        :param path: Json pointer to the value to patch.
+        :type path: str
+        :param value: The value for add, replace and test, defaults to None
+        :type value: object, optional
+        :param from_path: The source pointer for move and copy, defaults to None
+        :type from_path: str, optional
+        :raises InvalidPatchOperation: Raised when the operation does not fit the definition.
+        :return: This editor, so calls can be chained.
+        :rtype: PatchEditor
+        """
+        operation = {'op': op, 'path': path}
+        if op in ('add', 'replace', 'test'):
+            operation['value'] = value
+        if op in ('move', 'copy'):
+            operation['from'] = from_path
+        apply_operation(self._working_copy, operation)
+        self.operations.append(operation)
+        return self
+
+    def add(self, path: str, value: object) -> PatchEditor:
+        """ Adds an add operation.
+
+        :param path: Json pointer to the value.
+        :type path: str
+        :param value: The new value.
+        :type value: object
+        :return: This editor.
+        :rtype: PatchEditor
+        """
+        return self.operation('add', path, value)
+
+    def replace(self, path: str, value: object) -> PatchEditor:
+        """ Adds a replace operation.
+
+        :param path: Json pointer to the value.
+        :type path: str
+        :param value: The new value.
+        :type value: object
+        :return: This editor.
+        :rtype: PatchEditor
+        """
+        return self.operation('replace', path, value)
+
+    def remove(self, path: str) -> PatchEditor:
+        """ Adds a remove operation.
+
+        :param path: Json pointer to the value.
+        :type path: str
+        :return: This editor.
+        :rtype: PatchEditor
+        """
+        return self.operation('remove', path)
+
+    def __enter__(self) -> PatchEditor:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.resource.patch_ops(self.operations)
+
+
+class XDMResource(AEPObject):
     id_find_func = lambda self, definition: definition['$id']
 
+    @property
+    def alt_id(self) -> str:
+        """ The id used in the url of patch requests, like _tenant.schemas.<hash>.
+        Taken from meta:altId, or derived from the tenant namespace in the $id.
+
+        :return: The alt id
+        :rtype: str
+        """
+        if self.definition and 'meta:altId' in self.definition:
+            return self.definition['meta:altId']
+        segments = [segment for segment in urllib.parse.urlparse(self.id).path.split('/') if segment]
+        return '_' + '.'.join(segments)
+
+    @property
+    def _url_id(self) -> str:
+        return urllib.parse.quote_plus(self.id)
+
     def refresh_definition(self):
         """ Get the new definition of the schema through a get request.
         Note that we need to url encode the id before the get request.
         """
-        encoded_id = urllib.parse.quote_plus(self.id)
-        result = self._aep.get(path='schemaregistry.schema',
+        encoded_id = self._url_id
+        result = self._aep.get(path='schemaregistry.'+self.name,
                               body={},
                               params={},
                               url_suffix='/'+encoded_id)
         self.definition = result
 
+    def patch_ops(self, operations: List[Dict], refresh: bool = True):
+        """ Sends JSON-Patch operations as one patch request, and refreshes the
+        definition once afterwards.
+
+        :param operations: The JSON-Patch operations.
+        :type operations: List[Dict]
+        :param refresh: Whether to refresh the definition afterwards, defaults to True
+        :type refresh: bool, optional
+        """
+        if not operations:
+            return
+        self._aep.update(path='schemaregistry.'+self.name, 
+                         body=list(operations), 
+                         params={}, 
+                         url_suffix='/'+self.alt_id)
+        if refresh:
+            self.refresh_definition()
+
     def patch_obj(self, op: str, path: str, value: object):
         """ Updates the schema via a patch request.
 
@@ -33,26 +204,39 @@ class Schema(AEPObject):
         :param value: Then new value.
         :type value: object
         """
-        body = [{
+        self.patch_ops([{
                 "op": op,
                 "path": path,
                 "value": value
-            }]
-        stripped_id = self.id.split('/')[-1]
-        self._aep.update(path='schemaregistry.schema', 
-                         body=body, 
-                         params={}, 
-                         url_suffix='/_kpnbv.schemas.'+stripped_id)
-        self.refresh_definition()
+            }])
+
+    def edit(self) -> PatchEditor:
+        """ Starts a batch of changes. Operations are validated against the cached
+        definition when they are added, and on leaving the with block they are sent
+        as one JSON-Patch array followed by a single refresh. Nothing is sent when the
+        block raises.
+
+        Example:
+            with schema.edit() as editor:
+                editor.add('/meta:immutableTags', ['union'])
+                editor.replace('/title', 'New title')
+
+        :return: The editor that collects the operations.
+        :rtype: PatchEditor
+        """
+        return PatchEditor(self)
+
+
+class Schema(XDMResource):
+    name = 'schema'
 
     def enable_for_profile(self):
         warnings.warn("Enabling for profile is irreversable")
         self.patch_obj(op='add', path='/meta:immutableTags', value=["union"])
 
 
-class FieldGroup(AEPObject):
+class FieldGroup(XDMResource):
     name = 'fieldgroup'
-    id_find_func = lambda self, definition: definition['$id']
 
 
 class Descriptor(AEPObject):
@@ -69,6 +253,8 @@ class SchemaRegistry(AEPCollection):
         :type _aep: AEP
         """
         super().__init__(_aep, 'schemaregistry')
+        self._xdm_cache = {}
+        self._arrow_cache = {}
     
     def create_fieldgroup(self, config_path: str, arg_replacements: Dict) -> FieldGroup:
         """ Creates a new fieldgroup object that corresponds to a fieldgroup on AEP.
@@ -83,17 +269,20 @@ class SchemaRegistry(AEPCollection):
         """
         return self._create_aepobject(FieldGroup, config_path, arg_replacements)
 
-    def get_fieldgroup(self, id: str) -> FieldGroup:
+    def get_fieldgroup(self, id: str, lazy: bool = False) -> FieldGroup:
         """ Gets an existing fieldgroup by returning a fieldgroup object that 
         corresponds to a fieldgroup on AEP. 
 
         :param id: The id of the fieldgroup. Note that this looks like an url.
         :type id: str
+        :param lazy: Return a handle that only retrieves the fieldgroup when its definition
+        is accessed, defaults to False
+        :type lazy: bool, optional
         :return: fieldgroup object representing a fieldgroup on AEP.
         :rtype: FieldGroup
         """
         encoded_id = urllib.parse.quote_plus(id)
-        return self._get_aepobject(FieldGroup, encoded_id)
+        return self._get_aepobject(FieldGroup, id, lazy=lazy, url_id=encoded_id)
     
     def create_schema(self, config_path: str, arg_replacements: Dict) -> Schema:
         """ Creates a new schema object that corresponds to a schema on AEP.
@@ -108,18 +297,21 @@ class SchemaRegistry(AEPCollection):
         """
         return self._create_aepobject(Schema, config_path, arg_replacements)
     
-    def get_schema(self, id: str) -> Schema:
+    def get_schema(self, id: str, lazy: bool = False) -> Schema:
         """ Gets an existing schema by returning a schema object that corresponds
         to a schema on AEP.
 
         :param id: The id of the schema. Note that this looks like an url.
         :type id: str
+        :param lazy: Return a handle that only retrieves the schema when its definition
+        is accessed, defaults to False
+        :type lazy: bool, optional
         :return: Schema object representing a schema on AEP.
         :rtype: Schema
         """
         encoded_id = urllib.parse.quote_plus(id)
         print(encoded_id)
-        return self._get_aepobject(Schema, encoded_id)
+        return self._get_aepobject(Schema, id, lazy=lazy, url_id=encoded_id)
     
     def create_descriptor(self, config_path: str, arg_replacements: Dict) -> Descriptor:
         """ Creates a new descriptor object that corresponds to a descriptor on AEP.
@@ -134,13 +326,159 @@ class SchemaRegistry(AEPCollection):
         """
         return self._create_aepobject(Descriptor, config_path, arg_replacements)
     
-    def get_descriptor(self, id: str) -> Descriptor:
+    def get_descriptor(self, id: str, lazy: bool = False) -> Descriptor:
         """ Gets an existing descriptor by returning a descriptor object that
         corresponds to a schema on AEP.
 
         :param id: The id of the descriptor.
         :type id: str
+        :param lazy: Return a handle that only retrieves the descriptor when its definition
+        is accessed, defaults to False
+        :type lazy: bool, optional
         :return: Descriptor object representing a descriptor on AEP.
         :rtype: Descriptor
         """
-        return self._get_aepobject(Descriptor, id)
+        return self._get_aepobject(Descriptor, id, lazy=lazy)
+
+    def _fetch_xdm_resource(self, ref_id: str, hint: str) -> Dict:
+        """ Retrieves the unresolved definition of any XDM resource by its $id. Global
+        resources live under ns.adobe.com/xdm, everything else is in the tenant container.
+        When the resource type is not part of the $id, the types that fit the hint are tried.
+
+        :param ref_id: The $id of the resource.
+        :type ref_id: str
+        :param hint: 'allOf' or 'property', where the resource was referenced.
+        :type hint: str
+        :return: The definition of the resource.
+        :rtype: Dict
+        """
+        segments = urllib.parse.urlparse(ref_id).path.split('/')
+        container = 'global_resource' if segments[1:2] == ['xdm'] else 'tenant_resource'
+        resource_types = [XDM_RESOURCE_TYPES[segment] for segment in segments if segment in XDM_RESOURCE_TYPES][:1]
+        if not resource_types:
+            if hint == 'allOf':
+                resource_types = ['classes', 'fieldgroups', 'behaviors']
+            else:
+                resource_types = ['datatypes', 'classes', 'fieldgroups']
+        encoded_id = urllib.parse.quote_plus(ref_id)
+        for i, resource_type in enumerate(resource_types):
+            try:
+                return self._aep.get(path='schemaregistry.'+container,
+                                     url_suffix=resource_type+'/'+encoded_id)
+            except requests.exceptions.HTTPError:
+                if i == len(resource_types) - 1:
+                    raise
+
+    def _fetch_graph(self, roots: List[Tuple[str, str]], max_workers: int):
+        """ Fetches the reference graph breadth-first. All resources of one level are
+        fetched concurrently, resources that are already memoized are skipped.
+        """
+        frontier = {ref_id: hint for ref_id, hint in roots if ref_id not in self._xdm_cache}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while frontier:
+                futures = {executor.submit(self._fetch_xdm_resource, ref_id, hint): ref_id
+                           for ref_id, hint in frontier.items()}
+                next_frontier = {}
+                for future in as_completed(futures):
+                    definition = future.result()
+                    self._xdm_cache[futures[future]] = definition
+                    for ref_id, hint in _find_refs(definition):
+                        if ref_id not in self._xdm_cache and ref_id not in frontier:
+                            next_frontier.setdefault(ref_id, hint)
+                frontier = next_frontier
+
+    def _inline(self, node: object, base: str, stack: Tuple[str] = ()) -> object:
+        """ Returns a copy of node in which every XDM reference, and every local
+        reference within the resource base, is replaced by the resolved definition
+        it refers to. Cyclic references are left as $ref.
+        """
+        if isinstance(node, list):
+            return [self._inline(value, base, stack) for value in node]
+        if not isinstance(node, dict):
+            return node
+        ref = node.get('$ref')
+        if isinstance(ref, str) and (ref.startswith('#') or _is_xdm_ref(ref)):
+            ref_base, fragment = _split_ref(ref)
+            ref_base = ref_base or base
+            full_ref = ref_base + '#' + fragment
+            if ref_base in self._xdm_cache and full_ref not in stack:
+                target = _resolve_pointer(self._xdm_cache[ref_base], fragment)
+                resolved = self._inline(target, ref_base, stack + (full_ref,))
+                rest = {key: self._inline(value, base, stack) for key, value in node.items() if key != '$ref'}
+                return {**resolved, **rest} if isinstance(resolved, dict) else resolved
+        return {key: self._inline(value, base, stack) for key, value in node.items()}
+
+    def resolve(self, schema_id: str, max_workers: int = 8, snapshot_path: str = None,
+                refresh: bool = False) -> Dict:
+        """ Resolves a schema with all the classes, fieldgroups and datatypes it refers to.
+        The reference graph is walked breadth-first with concurrent requests. Every $id
+        is fetched once and memoized across schemas, so shared fieldgroups and datatypes
+        are only retrieved the first time.
+
+        :param schema_id: The $id of the schema.
+        :type schema_id: str
+        :param max_workers: Maximum number of concurrent requests, defaults to 8
+        :type max_workers: int, optional
+        :param snapshot_path: Json file the memoized definitions are loaded from and saved to,
+        so later resolutions don't need any request, defaults to None
+        :type snapshot_path: str, optional
+        :param refresh: Whether to forget the memoized definitions first, defaults to False
+        :type refresh: bool, optional
+        :return: The schema definition in which every $ref is replaced by the referred definition.
+        :rtype: Dict
+        """
+        if refresh:
+            self._xdm_cache.clear()
+        elif snapshot_path and os.path.exists(snapshot_path):
+            self.load_snapshot(snapshot_path)
+        self._fetch_graph([(schema_id, 'allOf')], max_workers)
+        if snapshot_path:
+            self.save_snapshot(snapshot_path)
+        return self._inline(self._xdm_cache[schema_id], schema_id, (schema_id + '#',))
+
+    def save_snapshot(self, path: str):
+        """ Saves the memoized XDM definitions to a json file.
+
+        :param path: Path to the snapshot.
+        :type path: str
+        """
+        with open(path, 'w') as snapshot:
+            json.dump(self._xdm_cache, snapshot)
+
+    def load_snapshot(self, path: str):
+        """ Adds the XDM definitions in a snapshot to the memoized definitions.
+
+        :param path: Path to the snapshot.
+        :type path: str
+        """
+        with open(path) as snapshot:
+            self._xdm_cache.update(json.load(snapshot))
+
+    def get_arrow_schema(self, schema_id: str, **resolve_kwargs) -> pyarrow.Schema:
+        """ Compiles a schema, with all its fieldgroups, to a pyarrow schema. The result
+        is cached per schema $id and version.
+
+        :param schema_id: The $id of the schema.
+        :type schema_id: str
+        :param resolve_kwargs: Passed on to resolve.
+        :return: The arrow schema for data of this schema.
+        :rtype: pyarrow.Schema
+        """
+        resolved = self.resolve(schema_id, **resolve_kwargs)
+        key = (schema_id, resolved.get('version'))
+        if key not in self._arrow_cache:
+            self._arrow_cache[key] = xdm_to_arrow_schema(resolved)
+        return self._arrow_cache[key]
+
+    def get_validator(self, schema_id: str, descriptors: List[Descriptor] = None, **resolve_kwargs) -> XDMValidator:
+        """ Creates a validator that checks outgoing tables against a schema before upload.
+
+        :param schema_id: The $id of the schema.
+        :type schema_id: str
+        :param descriptors: The identity descriptors of the schema, defaults to None
+        :type descriptors: List[Descriptor], optional
+        :param resolve_kwargs: Passed on to resolve.
+        :return: The validator.
+        :rtype: XDMValidator
+        """
+        return XDMValidator(self.resolve(schema_id, **resolve_kwargs), descriptors)
@@ -1,16 +1,27 @@
 from __future__ import annotations
 from .abstractmodel import AEPCollection, AEPObject
-from typing import List, Dict, Tuple, TYPE_CHECKING
+from .catalogservice import Batch
+from ..utils.waiter import JobWaiter
+from ..utils.yamlconfig_parser import parse_config
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Dict, Tuple, TYPE_CHECKING
+import os
+import queue
+import time
+import pyarrow.parquet as pq
 if TYPE_CHECKING:
     from ..aep import AEP
     
 
 class SegmentJob(AEPObject):
     name='segmentjob'
+    succeeded_states = ('SUCCEEDED',)
+    failed_states = ('FAILED', 'CANCELLED')
+
     def poll_status(self) -> Dict:
         """ Retrieves the status of the segmentjob with a get request.
 
-        :return: [description]
+        :return: The definition of the segmentjob, which contains the status.
         :rtype: Dict
         """
         return self._aep.get(path='segmentationservice.segmentjob',
@@ -18,6 +29,238 @@ class SegmentJob(AEPObject):
                              params={},
                              url_suffix='/'+self.id)
 
+    @staticmethod
+    def status_from(result: Dict) -> str:
+        """ Extracts the status from the result of poll_status.
+
+        :param result: The result of poll_status.
+        :type result: Dict
+        :return: The status of the segmentjob.
+        :rtype: str
+        """
+        return result['status']
+
+
+class ExportResult:
+    def __init__(self, job: SegmentJob):
+        """ The outcome of SegmentationService.export_to.
+
+        :param job: The export segmentjob.
+        :type job: SegmentJob
+        """
+        self.job = job
+        self.dataset_id = None
+        self.batch_id = None
+        self.paths = []
+        self.record_batches = []
+        self.num_rows = 0
+        self.timings = {}
+
+    def __str__(self) -> str:
+        """ string representation of the export result
+
+        :return: string representation
+        :rtype: str
+        """
+        stages = ', '.join('{} {:.1f}s'.format(stage, seconds) for stage, seconds in self.timings.items())
+        return 'export of batch {} to {} files ({})'.format(self.batch_id, len(self.paths), stages)
+
+
+class ScheduledSegmentJob:
+    def __init__(self, spec: Dict):
+        """ Bookkeeping of one job in a SegmentJobScheduler.
+
+        :param spec: The job spec, with a name, config_path or config, optional
+        arg_replacements and optional depends_on (names of jobs that must succeed first).
+        :type spec: Dict
+        """
+        self.name = spec['name']
+        self.spec = spec
+        self.depends_on = list(spec.get('depends_on', []))
+        self.state = 'waiting'
+        self.job = None
+        self.error = None
+        self.attempts = 0
+        self.ready_at = None
+        self.not_before = None
+        self.submitted_at = []
+        self.finished_at = None
+
+    @property
+    def queue_delay(self) -> float:
+        """ Seconds between the job becoming ready (dependencies done) and its first submission.
+
+        :return: The delay, None when the job was never submitted.
+        :rtype: float
+        """
+        if self.ready_at is None or not self.submitted_at:
+            return None
+        return self.submitted_at[0] - self.ready_at
+
+
+class ScheduleReport:
+    def __init__(self, jobs: Dict[str, ScheduledSegmentJob], seconds: float):
+        """ Outcome and throughput of a SegmentJobScheduler run.
+
+        :param jobs: The scheduled jobs keyed on name.
+        :type jobs: Dict[str, ScheduledSegmentJob]
+        :param seconds: Wall clock duration of the run.
+        :type seconds: float
+        """
+        self.jobs = jobs
+        self.seconds = seconds
+        self.succeeded = [name for name, job in jobs.items() if job.state == 'succeeded']
+        self.failed = [name for name, job in jobs.items() if job.state == 'failed']
+        self.skipped = [name for name, job in jobs.items() if job.state == 'skipped']
+        delays = [job.queue_delay for job in jobs.values() if job.queue_delay is not None]
+        self.throughput_per_minute = 60 * len(self.succeeded) / seconds if seconds else 0.0
+        self.mean_queue_delay = sum(delays) / len(delays) if delays else 0.0
+        self.max_queue_delay = max(delays) if delays else 0.0
+        self.resubmissions = sum(max(0, job.attempts - 1) for job in jobs.values())
+
+    def __str__(self) -> str:
+        """ string representation of the report
+
+        :return: string representation
+        :rtype: str
+        """
+        return ('{} succeeded, {} failed, {} skipped in {:.0f}s ({:.1f} jobs/min, '
+                'queue delay mean {:.0f}s max {:.0f}s, {} resubmissions)').format(
+            len(self.succeeded), len(self.failed), len(self.skipped), self.seconds,
+            self.throughput_per_minute, self.mean_queue_delay, self.max_queue_delay, self.resubmissions)
+
+
+class SegmentJobScheduler:
+    def __init__(self, service: SegmentationService, max_concurrent: int = 4, max_retries: int = 2,
+                 retry_backoff: float = 60, job_timeout: float = None, **waiter_kwargs):
+        """ Submits many segmentjobs while respecting a cap on concurrently running jobs
+        and the order given by depends_on. All running jobs are monitored in one JobWaiter
+        loop. Failed jobs are resubmitted with exponential backoff; jobs that depend on a
+        job that failed for good are skipped.
+
+        :param service: The collection through which jobs are created.
+        :type service: SegmentationService
+        :param max_concurrent: Maximum number of jobs running at once, defaults to 4
+        :type max_concurrent: int, optional
+        :param max_retries: Resubmissions of a failed job, defaults to 2
+        :type max_retries: int, optional
+        :param retry_backoff: Seconds before the first resubmission, doubled per retry, defaults to 60
+        :type retry_backoff: float, optional
+        :param job_timeout: Seconds after which a running job counts as failed, defaults to None
+        :type job_timeout: float, optional
+        :param waiter_kwargs: Polling settings passed to JobWaiter.
+        """
+        self.service = service
+        self.max_concurrent = max_concurrent
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.job_timeout = job_timeout
+        self.waiter_kwargs = waiter_kwargs
+
+    @staticmethod
+    def _check_graph(jobs: Dict[str, ScheduledSegmentJob]):
+        for job in jobs.values():
+            unknown = [name for name in job.depends_on if name not in jobs]
+            if unknown:
+                raise ValueError('Job {} depends on unknown jobs {}'.format(job.name, unknown))
+        visiting, done = set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError('Dependency cycle through job {}'.format(name))
+            visiting.add(name)
+            for dependency in jobs[name].depends_on:
+                visit(dependency)
+            visiting.discard(name)
+            done.add(name)
+        for name in jobs:
+            visit(name)
+
+    def _submit(self, scheduled: ScheduledSegmentJob) -> SegmentJob:
+        spec = scheduled.spec
+        if 'config' in spec:
+            config = spec['config']
+        else:
+            config = parse_config(spec['config_path'], arg_replacements=spec.get('arg_replacements', {}))
+        return SegmentJob.create_from_config(self.service, config, self.service._aep)
+
+    def run(self, specs: List[Dict]) -> ScheduleReport:
+        """ Runs all jobs and blocks until each succeeded, failed or was skipped.
+
+        :param specs: The job specs, see ScheduledSegmentJob.
+        :type specs: List[Dict]
+        :raises ValueError: Raised for duplicate names, unknown dependencies or cycles.
+        :return: The report with per job bookkeeping and throughput statistics.
+        :rtype: ScheduleReport
+        """
+        jobs = {}
+        for spec in specs:
+            if spec['name'] in jobs:
+                raise ValueError('Job name {} is used more than once'.format(spec['name']))
+            jobs[spec['name']] = ScheduledSegmentJob(spec)
+        self._check_graph(jobs)
+
+        started = time.monotonic()
+        finished = queue.Queue()
+        waiter = JobWaiter(**self.waiter_kwargs).start()
+        running = 0
+        try:
+            while any(job.state in ('waiting', 'ready', 'running') for job in jobs.values()):
+                now = time.monotonic()
+                for job in jobs.values():
+                    if job.state != 'waiting':
+                        continue
+                    states = [jobs[name].state for name in job.depends_on]
+                    if any(state in ('failed', 'skipped') for state in states):
+                        job.state = 'skipped'
+                    elif all(state == 'succeeded' for state in states):
+                        job.state = 'ready'
+                        job.ready_at = now
+                ready = [job for job in jobs.values()
+                         if job.state == 'ready' and (job.not_before is None or job.not_before <= now)]
+                for job in ready[:max(0, self.max_concurrent - running)]:
+                    job.attempts += 1
+                    job.submitted_at.append(time.monotonic())
+                    try:
+                        job.job = self._submit(job)
+                    except Exception as e:
+                        finished.put((job, e))
+                    else:
+                        waiter.add(job.job, timeout=self.job_timeout,
+                                   callback=lambda _, future, job=job: finished.put((job, future.exception())))
+                    job.state = 'running'
+                    running += 1
+                if running == 0:
+                    retry_at = [job.not_before for job in jobs.values() if job.state == 'ready' and job.not_before]
+                    if not retry_at:
+                        continue
+                    wait = max(0, min(retry_at) - time.monotonic())
+                else:
+                    pending_retries = [job.not_before for job in jobs.values()
+                                       if job.state == 'ready' and job.not_before and running < self.max_concurrent]
+                    wait = max(0, min(pending_retries) - time.monotonic()) if pending_retries else None
+                try:
+                    job, error = finished.get(timeout=wait)
+                except queue.Empty:
+                    continue
+                running -= 1
+                if error is None:
+                    job.state = 'succeeded'
+                    job.finished_at = time.monotonic()
+                elif job.attempts <= self.max_retries:
+                    job.state = 'ready'
+                    job.error = error
+                    job.not_before = time.monotonic() + self.retry_backoff * 2 ** (job.attempts - 1)
+                else:
+                    job.state = 'failed'
+                    job.error = error
+                    job.finished_at = time.monotonic()
+        finally:
+            waiter.stop()
+        return ScheduleReport(jobs, time.monotonic() - started)
+
 
 class SegmentationService(AEPCollection):
     def __init__(self, _aep: AEP):
@@ -41,12 +284,143 @@ class SegmentationService(AEPCollection):
         """
         return self._create_aepobject(SegmentJob, config_path, arg_replacements)
 
-    def get_segmentjob(self, id: str) -> SegmentJob:
+    def get_segmentjob(self, id: str, lazy: bool = False) -> SegmentJob:
         """ Retrieves an existing segmentjob from AEP.
 
         :param id: The id of the segmentjob
         :type id: str
+        :param lazy: Return a handle that only retrieves the segmentjob when its definition
+        is accessed, defaults to False
+        :type lazy: bool, optional
         :return: Instance that represents the segmentjob on AEP. 
         :rtype: SegmentJob
         """
-        return self._get_aepobject(SegmentJob, id)
\ No newline at end of file
+        return self._get_aepobject(SegmentJob, id, lazy=lazy)
+
+    def schedule_segmentjobs(self, specs: List[Dict], max_concurrent: int = 4, max_retries: int = 2,
+                             retry_backoff: float = 60, job_timeout: float = None, **waiter_kwargs) -> ScheduleReport:
+        """ Submits and monitors many segmentjobs, see SegmentJobScheduler.
+
+        :param specs: Per job a dict with a name, config_path (or config), optional arg_replacements
+        and optional depends_on with the names of jobs that must succeed first.
+        :type specs: List[Dict]
+        :param max_concurrent: Maximum number of jobs running at once, defaults to 4
+        :type max_concurrent: int, optional
+        :param max_retries: Resubmissions of a failed job, defaults to 2
+        :type max_retries: int, optional
+        :param retry_backoff: Seconds before the first resubmission, doubled per retry, defaults to 60
+        :type retry_backoff: float, optional
+        :param job_timeout: Seconds after which a running job counts as failed, defaults to None
+        :type job_timeout: float, optional
+        :return: Per job outcome, throughput and queueing delays.
+        :rtype: ScheduleReport
+        """
+        scheduler = SegmentJobScheduler(self, max_concurrent, max_retries, retry_backoff, job_timeout, **waiter_kwargs)
+        return scheduler.run(specs)
+
+    def _locate_export_batch(self, status: Dict, submitted: int) -> Tuple[str, str]:
+        """ Finds the dataset and batch an export job wrote to. The job status normally
+        holds the batch id; otherwise the newest successful batch of the destination
+        dataset created after the job was submitted is used.
+        """
+        destination = status.get('destination', {})
+        dataset_id = destination['datasetId']
+        if destination.get('batchId'):
+            return dataset_id, destination['batchId']
+        result = self._aep.get(
+            path='catalogservice.batch',
+            params={'dataSet': dataset_id, 'status': 'success', 'createdAfter': submitted,
+                    'orderBy': 'desc:created', 'limit': 1})
+        if not result:
+            raise Exception('No new batch found in dataset {} for export job'.format(dataset_id))
+        return dataset_id, next(iter(result))
+
+    def export_to(self, config_path: str, arg_replacements: Dict, dest_dir: str, as_arrow: bool = False,
+                  on_batch: Callable = None, max_downloads: int = 4, timeout: float = None,
+                  waiter: JobWaiter = None) -> ExportResult:
+        """ Exports an audience to local files in one call: submits the export segmentjob,
+        waits for it with adaptive polling, locates the batch it wrote to the destination
+        dataset and streams the batch files to dest_dir. Downloads run concurrently, and
+        while files are still downloading the finished ones are decoded to arrow record
+        batches (as_arrow). The time per stage is reported in ExportResult.timings.
+
+        :param config_path: path to the export job config yaml.
+        :type config_path: str
+        :param arg_replacements: values to replace in config.
+        :type arg_replacements: Dict
+        :param dest_dir: Directory the parquet files are written to.
+        :type dest_dir: str
+        :param as_arrow: Whether to decode the files to arrow record batches, defaults to False
+        :type as_arrow: bool, optional
+        :param on_batch: Called with every decoded record batch. When None, the record
+        batches are collected in the result, defaults to None
+        :type on_batch: Callable, optional
+        :param max_downloads: Maximum number of concurrent downloads, defaults to 4
+        :type max_downloads: int, optional
+        :param timeout: Seconds to wait for the export job, defaults to None
+        :type timeout: float, optional
+        :param waiter: Waiter to poll the job with. It is started in the background when
+        it is not running yet, defaults to a new JobWaiter polled in this thread
+        :type waiter: JobWaiter, optional
+        :return: The paths, record batches and timings of the export.
+        :rtype: ExportResult
+        """
+        started = time.perf_counter()
+        submitted = int(time.time() * 1000)
+        job = self.create_segmentjob(config_path, arg_replacements)
+        result = ExportResult(job)
+        result.timings['submit'] = time.perf_counter() - started
+
+        stage_start = time.perf_counter()
+        if waiter is None:
+            waiter = JobWaiter()
+            future = waiter.add(job, timeout=timeout)
+            waiter.run()
+        else:
+            future = waiter.add(job, timeout=timeout)
+            waiter.start()
+        status = future.result()
+        result.timings['wait'] = time.perf_counter() - stage_start
+
+        stage_start = time.perf_counter()
+        result.dataset_id, result.batch_id = self._locate_export_batch(status, submitted)
+        batch = Batch({'id': result.batch_id}, self._aep)
+        downloads = [(datasetfile, pathname)
+                     for datasetfile in batch.get_datasetfiles()
+                     for pathname in datasetfile.get_pathnames()]
+        result.timings['locate'] = time.perf_counter() - stage_start
+
+        os.makedirs(dest_dir, exist_ok=True)
+        download_seconds = 0.0
+        decode_seconds = 0.0
+        stage_start = time.perf_counter()
+
+        def download(item):
+            datasetfile, pathname = item
+            download_start = time.perf_counter()
+            dest_path = os.path.join(dest_dir, '{}_{}'.format(datasetfile.id, os.path.basename(pathname)))
+            datasetfile.download_file_at_pathname(pathname, dest_path)
+            return dest_path, time.perf_counter() - download_start
+
+        with ThreadPoolExecutor(max_workers=max(1, max_downloads)) as executor:
+            futures = [executor.submit(download, item) for item in downloads]
+            for download_future in as_completed(futures):
+                dest_path, seconds = download_future.result()
+                download_seconds += seconds
+                result.paths.append(dest_path)
+                if not as_arrow:
+                    continue
+                decode_start = time.perf_counter()
+                for record_batch in pq.ParquetFile(dest_path).iter_batches():
+                    result.num_rows += record_batch.num_rows
+                    if on_batch is not None:
+                        on_batch(record_batch)
+                    else:
+                        result.record_batches.append(record_batch)
+                decode_seconds += time.perf_counter() - decode_start
+        result.timings['transfer'] = time.perf_counter() - stage_start
+        result.timings['download'] = download_seconds
+        if as_arrow:
+            result.timings['decode'] = decode_seconds
+        result.timings['total'] = time.perf_counter() - started
+        return result
@@ -1,9 +1,17 @@
 from __future__ import annotations
-from paaw.utils.yamlconfig_parser import parse_config
+from paaw.utils.yamlconfig_parser import parse_config, render_config
 from .abstractmodel import AEPCollection, AEPObject
+from ..utils.waiter import JobWaiter
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import deque
+import itertools
 import json
-from requests_toolbelt.multipart.encoder import MultipartEncoder
-from typing import List, Dict, Tuple, TYPE_CHECKING
+import os
+import queue
+import requests
+import time
+from requests_toolbelt.multipart.encoder import MultipartEncoder, MultipartEncoderMonitor
+from typing import Callable, Iterator, List, Dict, Tuple, TYPE_CHECKING
 if TYPE_CHECKING:
     from ..aep import AEP
 
@@ -11,8 +19,67 @@ if TYPE_CHECKING:
 class Engine(AEPObject):
     name = 'engine'
 
+    @staticmethod
+    def _send_multipart(_aep: AEP, method: str, url_suffix: str, config: Dict, artifacts: Dict[str, str] = None,
+                        progress_callback: Callable = None, retries: int = 3) -> Dict:
+        """ Sends the engine config and artifact files as multipart form-data. The files are
+        streamed from disk, so memory use does not grow with the artifact size. On connection
+        errors, throttling or server errors the upload is retried with exponential backoff.
+
+        :param _aep: Top class used to send requests
+        :type _aep: AEP
+        :param method: POST to create, PUT to update.
+        :type method: str
+        :param url_suffix: What to append to the engine endpoint url.
+        :type url_suffix: str
+        :param config: The configuration for the engine
+        :type config: Dict
+        :param artifacts: Local files to upload keyed on form field, e.g. {'defaultArtifact': 'model.jar'},
+        defaults to None
+        :type artifacts: Dict[str, str], optional
+        :param progress_callback: Called with the MultipartEncoderMonitor while uploading, defaults to None
+        :type progress_callback: Callable, optional
+        :param retries: Number of retries of the upload, defaults to 3
+        :type retries: int, optional
+        :return: The parsed json response
+        :rtype: Dict
+        """
+        url, extra_headers = _aep._path_to_endpoint_and_headers('sensei.engine')
+        url = url + url_suffix
+        for attempt in range(retries + 1):
+            handles = []
+            try:
+                fields = {'engine': json.dumps(config)}
+                for field, path in (artifacts or {}).items():
+                    handle = open(path, 'rb')
+                    handles.append(handle)
+                    fields[field] = (os.path.basename(path), handle, 'application/octet-stream')
+                multipart_data = MultipartEncoder(fields=fields)
+                if progress_callback is not None:
+                    multipart_data = MultipartEncoderMonitor(multipart_data, progress_callback)
+                # the encoder is read in blocks while sending, and its len sets the Content-Length
+                headers = {**extra_headers, 'Content-Type': multipart_data.content_type}
+                response = _aep.send(method, url, headers=headers, data=multipart_data, path='sensei.engine',
+                                     attempt=attempt + 1)
+                return json.loads(response.text)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = e
+            except requests.exceptions.HTTPError as e:
+                status = e.response.status_code if e.response is not None else None
+                if status is not None and status != 429 and status < 500:
+                    raise
+                error = e
+            finally:
+                for handle in handles:
+                    handle.close()
+            if attempt < retries:
+                time.sleep(2 ** attempt)
+        raise error
+
     @classmethod
-    def create_from_config(cls: Engine, collection: AEPCollection, config: Dict, _aep: AEP) -> Engine:
+    def create_from_config(cls: Engine, collection: AEPCollection, config: Dict, _aep: AEP,
+                           artifacts: Dict[str, str] = None, progress_callback: Callable = None,
+                           retries: int = 3) -> Engine:
         """ Creates an engine from config. Overwrite inherited because post should send form-data
 
         :param cls: The engine class to instantiate
@@ -23,18 +90,34 @@ class Engine(AEPObject):
         :type config: Dict
         :param _aep: Top class used to send requests
         :type _aep: AEP
+        :param artifacts: Local artifact files to stream, keyed on form field, defaults to None
+        :type artifacts: Dict[str, str], optional
+        :param progress_callback: Called with the MultipartEncoderMonitor while uploading, defaults to None
+        :type progress_callback: Callable, optional
+        :param retries: Number of retries of the upload, defaults to 3
+        :type retries: int, optional
         :return: An instance of engine that represents and engine artifact on AEP.
         :rtype: Engine
         """
-        multipart_data = MultipartEncoder(
-            fields={ 
-                'engine': json.dumps(config)})
-        url, extra_headers = _aep._path_to_endpoint_and_headers('sensei.engine')
-        extra_headers['Content-Type'] = multipart_data.content_type
-        response = _aep.session.request('POST', url=url, headers=extra_headers, data=multipart_data)
-        definition = json.loads(response.text)
+        definition = cls._send_multipart(_aep, 'POST', '', config, artifacts, progress_callback, retries)
         return cls(definition, _aep)
 
+    def update_from_config(self, config: Dict, artifacts: Dict[str, str] = None,
+                           progress_callback: Callable = None, retries: int = 3):
+        """ Updates this engine with a new config and artifact files, streamed from disk.
+
+        :param config: The new configuration for the engine
+        :type config: Dict
+        :param artifacts: Local artifact files to stream, keyed on form field, defaults to None
+        :type artifacts: Dict[str, str], optional
+        :param progress_callback: Called with the MultipartEncoderMonitor while uploading, defaults to None
+        :type progress_callback: Callable, optional
+        :param retries: Number of retries of the upload, defaults to 3
+        :type retries: int, optional
+        """
+        self.definition = self._send_multipart(self._aep, 'PUT', '/'+self.id, config, artifacts,
+                                               progress_callback, retries)
+
     def __str__(self) -> str:
         """ string representation of engine
 
@@ -102,6 +185,73 @@ class Experiment(AEPObject):
             model_info = result['children'][0]
             return Model(model_info, self._aep)
 
+    def sweep(self, config_path: str, param_grid: Dict[str, List] = None, param_list: List[Dict] = None,
+              arg_replacements: Dict = None, max_parallel: int = 4, timeout: float = None,
+              **waiter_kwargs) -> Iterator[SweepResult]:
+        """ Runs a hyperparameter sweep: one experimentrun per parameter combination,
+        rendered from a single config template. At most max_parallel runs are active
+        at once (the compute quota); a new run is submitted as soon as one finishes.
+        All active runs are polled in a single JobWaiter loop, and results are yielded
+        in the order the runs finish, with the trained model of every succeeded run.
+
+        Stopping the iteration stops the polling, but not the runs on AEP.
+
+        :param config_path: Path to the experimentrun config template. Placeholders ${name}
+        are filled with the parameters of each run.
+        :type config_path: str
+        :param param_grid: Lists of values per parameter, every combination is run, defaults to None
+        :type param_grid: Dict[str, List], optional
+        :param param_list: Explicit parameter combinations, defaults to None
+        :type param_list: List[Dict], optional
+        :param arg_replacements: Replacements that are the same for every run, defaults to None
+        :type arg_replacements: Dict, optional
+        :param max_parallel: Maximum number of runs active at once, defaults to 4
+        :type max_parallel: int, optional
+        :param timeout: Seconds after which a single run is given up, defaults to None
+        :type timeout: float, optional
+        :param waiter_kwargs: Polling settings passed to JobWaiter.
+        :yield: A SweepResult per finished run.
+        :rtype: Iterator[SweepResult]
+        """
+        template = parse_config(config_path, keep_missing_args=True)
+        base_replacements = arg_replacements or {}
+        combinations = list(param_list or [])
+        if param_grid:
+            names = list(param_grid)
+            combinations.extend(dict(zip(names, values))
+                                for values in itertools.product(*(param_grid[name] for name in names)))
+        pending = deque(combinations)
+        finished = queue.Queue()
+        waiter = JobWaiter(**waiter_kwargs).start()
+        executor = ThreadPoolExecutor(max_workers=max(1, max_parallel))
+
+        def submit(params: Dict):
+            try:
+                config = render_config(template, {**base_replacements, **params})
+                run = ExperimentRun.create_from_config(self, config, self._aep)
+            except Exception as e:
+                finished.put(SweepResult(params, error=e))
+                return
+            waiter.add(run, timeout=timeout,
+                       callback=lambda job, future: finished.put(SweepResult(params, job, future)))
+
+        in_flight = 0
+        try:
+            while pending and in_flight < max_parallel:
+                executor.submit(submit, pending.popleft())
+                in_flight += 1
+            while in_flight:
+                result = finished.get()
+                in_flight -= 1
+                if pending:
+                    executor.submit(submit, pending.popleft())
+                    in_flight += 1
+                result.collect_model()
+                yield result
+        finally:
+            executor.shutdown(wait=False)
+            waiter.stop()
+
     def __str__(self)  -> str:
         """ string representation of experiment.
 
@@ -113,21 +263,24 @@ class Experiment(AEPObject):
 
 class ExperimentRun(AEPObject):
     name = 'experimentrun'
-    def __init__(self, id: str, definition: Dict, _aep: AEP, experiment_id: str):
+    succeeded_states = ('DONE', 'COMPLETE', 'COMPLETED', 'SUCCEEDED')
+    failed_states = ('FAILED', 'CANCELLED', 'ERROR')
+
+    def __init__(self, definition: Dict, _aep: AEP, experiment_id: str, id: str = None):
         """ An experimentrun on AEP. Trains and/or scores a model.
         Overwrites inherited because experimentrun is always under a certain
         experiment.
 
-        :param id: The id of this experimentrun
-        :type id: str
         :param definition: Definition of this experimentrun.
         :type definition: Dict
         :param _aep: top class through which requests are made.
         :type _aep: AEP
         :param experiment_id: id of the experiment.
         :type experiment_id: str
+        :param id: The id of this experimentrun, defaults to the id in the definition.
+        :type id: str, optional
         """
-        super().__init__(id, definition, _aep)
+        super().__init__(definition, _aep, id)
         self.experiment_id = experiment_id
         base_url, _ = _aep._path_to_endpoint_and_headers('sensei.experiment')
         self.poll_url = base_url + '/' + self.experiment_id + '/runs/' + self.id + '/status'
@@ -138,9 +291,32 @@ class ExperimentRun(AEPObject):
         :return: dictionary containing the status.
         :rtype: Dict
         """
-        resp = self._aep.session.request(method='GET', url=self.poll_url)
+        resp = self._aep.send('GET', self.poll_url)
         result = json.loads(resp.text)
         return result
+
+    @staticmethod
+    def status_from(result: Dict) -> str:
+        """ Extracts the status from the result of poll_status. When the response
+        only has a state per task, the run is failed if any task failed, done if
+        all tasks are done and running otherwise.
+
+        :param result: The result of poll_status.
+        :type result: Dict
+        :return: The status of the experimentrun.
+        :rtype: str
+        """
+        if 'status' in result:
+            return str(result['status']).upper()
+        task_states = [str(task.get('state', '')).upper() for task in result.get('tasks', [])]
+        if not task_states:
+            return 'PENDING'
+        failed = [state for state in task_states if state in ExperimentRun.failed_states]
+        if failed:
+            return failed[0]
+        if all(state in ExperimentRun.succeeded_states for state in task_states):
+            return task_states[0]
+        return 'RUNNING'
         
     def get_model(self) -> Model:
         """ Retrieves a trained model for an experimentrun.
@@ -183,7 +359,7 @@ class ExperimentRun(AEPObject):
             'Content-Type': 'application/vnd.adobe.platform.sensei+json;profile=experimentRun.v1.json',
             'Accept': 'application/vnd.adobe.platform.sensei+json;profile=experimentRun.v1.json'}
         data = json.dumps(config)
-        resp = _aep.session.request('POST', url=url, data=data, params={}, headers=extra_headers)
+        resp = _aep.send('POST', url, data=data, params={}, headers=extra_headers)
         result = json.loads(resp.text)
         return cls(result, _aep, experiment_id)
 
@@ -192,6 +368,58 @@ class Model(AEPObject):
     name = 'model'
 
 
+class SweepResult:
+    def __init__(self, params: Dict, run: ExperimentRun = None, future: Future = None, error: Exception = None):
+        """ The outcome of one run in a sweep.
+
+        :param params: The parameters of this run.
+        :type params: Dict
+        :param run: The experimentrun, None when it could not be submitted, defaults to None
+        :type run: ExperimentRun, optional
+        :param future: The resolved future of the waiter for this run, defaults to None
+        :type future: Future, optional
+        :param error: Error raised while submitting, defaults to None
+        :type error: Exception, optional
+        """
+        self.params = params
+        self.run = run
+        self.status = None
+        self.model = None
+        self.error = error
+        if future is not None:
+            self.error = future.exception()
+            if self.error is None:
+                self.status = future.result()
+
+    @property
+    def succeeded(self) -> bool:
+        """ Whether the run finished successfully and its model was found.
+
+        :return: True when no error occurred.
+        :rtype: bool
+        """
+        return self.error is None
+
+    def collect_model(self):
+        """ Retrieves the trained model of a succeeded run.
+        """
+        if self.error is None and self.run is not None and self.model is None:
+            try:
+                self.model = self.run.get_model()
+            except Exception as e:
+                self.error = e
+
+    def __str__(self) -> str:
+        """ string representation of the sweep result
+
+        :return: string representation
+        :rtype: str
+        """
+        if self.error is not None:
+            return 'sweep run {} failed: {}'.format(self.params, self.error)
+        return 'sweep run {} produced model {}'.format(self.params, self.model.id if self.model else None)
+
+
 class Sensei(AEPCollection):
     def __init__(self, _aep):
         """ Collection for ML Sensei endpoints.
@@ -202,7 +430,8 @@ class Sensei(AEPCollection):
         """
         super().__init__(_aep, 'sensei')
 
-    def create_engine(self, config_path: str, arg_replacements: Dict) -> Engine:
+    def create_engine(self, config_path: str, arg_replacements: Dict, artifacts: Dict[str, str] = None,
+                      progress_callback: Callable = None, retries: int = 3) -> Engine:
         """ Creates an engine through a post request with body from config with 
         variable replacements.
 
@@ -210,20 +439,31 @@ class Sensei(AEPCollection):
         :type config_path: str
         :param arg_replacements: variables to replace in config.
         :type arg_replacements: Dict
+        :param artifacts: Local artifact files (model pickles, wheels, jars) to stream, keyed on
+        form field, e.g. {'defaultArtifact': 'model.jar'}, defaults to None
+        :type artifacts: Dict[str, str], optional
+        :param progress_callback: Called with the MultipartEncoderMonitor while uploading, defaults to None
+        :type progress_callback: Callable, optional
+        :param retries: Number of retries of the upload, defaults to 3
+        :type retries: int, optional
         :return: An instance of engine, representing an engine on AEP.
         :rtype: Engine
         """
-        return self._create_aepobject(Engine, config_path, arg_replacements)
+        config = parse_config(config_path, arg_replacements=arg_replacements)
+        return Engine.create_from_config(self, config, self._aep, artifacts, progress_callback, retries)
     
-    def get_engine(self, id: str) -> Engine:
+    def get_engine(self, id: str, lazy: bool = False) -> Engine:
         """ Retrieves an existing engine.
 
         :param id: id of existing engine.
         :type id: str
+        :param lazy: Return a handle that only retrieves the engine when its definition
+        is accessed, defaults to False
+        :type lazy: bool, optional
         :return: Instance of engine.
         :rtype: Engine
         """
-        return self._get_aepobject(Engine, id)
+        return self._get_aepobject(Engine, id, lazy=lazy)
 
     def create_mlinstance(self, config_path: str, arg_replacements: Dict) -> MLInstance:
         """ Creates an mlinstance through a post request with body from config
@@ -238,15 +478,18 @@ class Sensei(AEPCollection):
         """
         return self._create_aepobject(MLInstance, config_path, arg_replacements)
     
-    def get_mlinstance(self, id: str) -> MLInstance:
+    def get_mlinstance(self, id: str, lazy: bool = False) -> MLInstance:
         """ Retrieves an existing ml instance
 
         :param id: id of the existing ml instance.
         :type id: str
+        :param lazy: Return a handle that only retrieves the mlinstance when its definition
+        is accessed, defaults to False
+        :type lazy: bool, optional
         :return: instance of mlinstance.
         :rtype: MLInstance
         """
-        return self._get_aepobject(MLInstance, id)
+        return self._get_aepobject(MLInstance, id, lazy=lazy)
 
     def create_experiment(self, config_path: str, arg_replacements: Dict) -> Experiment:
         """ Creates an experiment through a post request with body from config with
@@ -261,12 +504,15 @@ class Sensei(AEPCollection):
         """
         return self._create_aepobject(Experiment, config_path, arg_replacements)
     
-    def get_experiment(self, id: str) -> Experiment:
+    def get_experiment(self, id: str, lazy: bool = False) -> Experiment:
         """ Retrieves existing experiment.
 
         :param id: id of the existing experiment.
         :type id: str
+        :param lazy: Return a handle that only retrieves the experiment when its definition
+        is accessed, defaults to False
+        :type lazy: bool, optional
         :return: Instance of experiment.
         :rtype: Experiment
         """
-        return self._get_aepobject(Experiment, id)
+        return self._get_aepobject(Experiment, id, lazy=lazy)
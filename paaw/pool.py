@@ -0,0 +1,127 @@
+import threading
+from dictor import dictor
+from typing import Callable, Dict, Iterable, Tuple, Union
+from .aep import AEP
+from .utils.authentication import get_headers
+from .utils.concurrency import RateLimiter, run_concurrently
+from .utils.transport import TransportConfig, create_session
+from .utils.yamlconfig_parser import parse_config
+
+
+class AEPPool:
+    def __init__(self, config_path: str = None, config_data: str = None, pool_maxsize: int = None):
+        """ Clients for several sandboxes and organizations. Every credential set is
+        authenticated once, and its token and connection pool are shared by the AEP
+        instances of all its sandboxes; the sandbox is sent per request.
+
+        :param config_path: Path to a config, added with add_config, defaults to None
+        :type config_path: str, optional
+        :param config_data: Contents of a config, added with add_config, defaults to None
+        :type config_data: str, optional
+        :param pool_maxsize: Connections kept open per host per credential set, defaults to
+        Transport.pool_maxsize in each config
+        :type pool_maxsize: int, optional
+        """
+        self.pool_maxsize = pool_maxsize
+        self._sessions = {}
+        self._default_sandboxes = {}
+        self._gateways = {}
+        self._credentials = {}
+        self._clients = {}
+        self._lock = threading.Lock()
+        self.default_org = None
+        if config_path is not None or config_data is not None:
+            self.add_config(config_path, config_data)
+
+    def add_config(self, config_path: str = None, config_data: str = None) -> str:
+        """ Adds the credentials of a config. A config with credentials that were added
+        before does not authenticate again. Credentials are picked by org id, so there can
+        be one credential set (api key and technical account) per org.
+
+        :param config_path: Path to the config, defaults to None
+        :type config_path: str, optional
+        :param config_data: Contents of the config, defaults to None
+        :type config_data: str, optional
+        :raises ValueError: Raised when the org was added before with other credentials.
+        :return: The org id of the credentials, used to pick them in get and map.
+        :rtype: str
+        """
+        cfg = parse_config(path=config_path, data=config_data)
+        org_id = dictor(cfg, "Enterprise" + ".org_id", checknone=True)
+        credentials = (dictor(cfg, "Enterprise" + ".api_key"), dictor(cfg, "Enterprise" + ".tech_acct"),
+                       dictor(cfg, "Platform" + ".emulator_gateway"))
+        with self._lock:
+            if org_id in self._credentials and self._credentials[org_id] != credentials:
+                raise ValueError('Org {} was added with other credentials (api key, technical account '
+                                 'or gateway); use a separate AEPPool for them'.format(org_id))
+            if org_id not in self._sessions:
+                session = create_session(TransportConfig.from_config(cfg, pool_maxsize=self.pool_maxsize))
+                headers = get_headers(cfg, session)
+                sandbox_name = headers.pop('x-sandbox-name', None)
+                session.headers.update(headers)
+                self._sessions[org_id] = session
+                self._default_sandboxes[org_id] = sandbox_name
+                self._gateways[org_id] = dictor(cfg, "Platform" + ".emulator_gateway")
+                self._credentials[org_id] = credentials
+            if self.default_org is None:
+                self.default_org = org_id
+        return org_id
+
+    def get(self, sandbox_name: str = None, org_id: str = None) -> AEP:
+        """ Returns the client for a sandbox, created on first use.
+
+        :param sandbox_name: The sandbox, defaults to the sandbox in the config
+        :type sandbox_name: str, optional
+        :param org_id: The org of the credentials to use, defaults to the first added config
+        :type org_id: str, optional
+        :raises KeyError: Raised when no config with the org id was added.
+        :return: The client.
+        :rtype: AEP
+        """
+        org_id = org_id or self.default_org
+        if org_id not in self._sessions:
+            raise KeyError('No credentials added for org {}'.format(org_id))
+        sandbox_name = sandbox_name or self._default_sandboxes[org_id]
+        with self._lock:
+            key = (org_id, sandbox_name)
+            if key not in self._clients:
+                self._clients[key] = AEP(sandbox_name=sandbox_name, session=self._sessions[org_id],
+                                          platform_gateway=self._gateways[org_id])
+            return self._clients[key]
+
+    def map(self, func: Callable, targets: Iterable[Union[str, Tuple[str, str]]], max_workers: int = 8,
+            requests_per_second: float = None) -> Tuple[Dict, Dict]:
+        """ Runs the same operation against several sandboxes concurrently, for example
+        to compare the scheduled queries of dev, test and prod:
+
+            results, errors = pool.map(lambda aep: aep.query_service.get_all_scheduledqueries(),
+                                       ['dev', 'test', 'prod'])
+
+        :param func: Called with the client of each target.
+        :type func: Callable
+        :param targets: Sandbox names, or (org id, sandbox name) tuples to span organizations.
+        :type targets: Iterable[Union[str, Tuple[str, str]]]
+        :param max_workers: Number of targets handled at once, defaults to 8
+        :type max_workers: int, optional
+        :param requests_per_second: Limit on the rate at which targets are started, defaults to None
+        :type requests_per_second: float, optional
+        :return: The results and the raised exceptions, both keyed on target.
+        :rtype: Tuple[Dict, Dict]
+        """
+        def call(target):
+            if isinstance(target, tuple):
+                org_id, sandbox_name = target
+                return func(self.get(sandbox_name, org_id))
+            return func(self.get(target))
+        outcomes = run_concurrently(call, targets, max_workers=max_workers,
+                                    rate_limiter=RateLimiter(requests_per_second, burst=max_workers))
+        results = {target: result for target, result, error in outcomes if error is None}
+        errors = {target: error for target, _, error in outcomes if error is not None}
+        return results, errors
+
+    def close(self):
+        """ Closes the connection pools of all credential sets.
+        """
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
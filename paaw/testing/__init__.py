@@ -0,0 +1,2 @@
+from .emulator import AEPEmulator
+from .cassette import Cassette
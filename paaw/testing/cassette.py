@@ -0,0 +1,300 @@
+import contextlib
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import urllib.parse
+from typing import Dict, Iterable
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from ..exc import CassetteMiss
+from ..utils.instrumentation import body_size
+
+CASSETTE_VERSION = 1
+INTERACTIONS_FILE = 'interactions.jsonl.gz'
+BODIES_DIR = 'bodies'
+REDACTED = 'REDACTED'
+
+REDACT_HEADERS = ('authorization', 'x-api-key', 'x-gw-ims-org-id', 'cookie', 'set-cookie')
+REDACT_FIELDS = ('access_token', 'refresh_token', 'jwt_token', 'client_secret', 'client_id',
+                 'password', 'secret', 'token')
+REDACT_PARAMS = ('sig', 'signature', 'token', 'access_token', 'client_secret')
+
+
+def _redact_json(value, fields: Iterable[str]):
+    if isinstance(value, dict):
+        return {key: REDACTED if key.lower() in fields else _redact_json(item, fields)
+                for key, item in value.items()}
+    if isinstance(value, list):
+        return [_redact_json(item, fields) for item in value]
+    return value
+
+
+class Cassette:
+    def __init__(self, path: str, inline_limit: int = 64 * 1024, redact_headers: Iterable[str] = REDACT_HEADERS,
+                 redact_fields: Iterable[str] = REDACT_FIELDS, redact_params: Iterable[str] = REDACT_PARAMS):
+        """ Recorded AEP traffic, to replay the requests of AEP-based code without network,
+        e.g. for reproducible cProfile or tracemalloc runs:
+
+            with Cassette('traffic').recording(aep):
+                pipeline(aep)
+            aep = Cassette('traffic').replay_client(time_scale=1.0)
+            cProfile.run('pipeline(aep)')
+
+        The cassette is a directory with the interactions as gzipped json lines and the
+        large or binary response bodies, like parquet files, as separate files named by
+        their hash. Tokens, secrets and signatures are redacted before they are written;
+        request bodies are not stored, only their size.
+
+        :param path: The directory of the cassette.
+        :type path: str
+        :param inline_limit: Text bodies up to this size in bytes are kept in the interactions
+        file, defaults to 64 KiB
+        :type inline_limit: int, optional
+        :param redact_headers: Names of headers whose values are redacted, defaults to REDACT_HEADERS
+        :type redact_headers: Iterable[str], optional
+        :param redact_fields: Json keys whose values are redacted in response bodies, defaults to REDACT_FIELDS
+        :type redact_fields: Iterable[str], optional
+        :param redact_params: Query parameters whose values are redacted, defaults to REDACT_PARAMS
+        :type redact_params: Iterable[str], optional
+        """
+        self.path = path
+        self.inline_limit = inline_limit
+        self.redact_headers = {name.lower() for name in redact_headers}
+        self.redact_fields = {name.lower() for name in redact_fields}
+        self.redact_params = {name.lower() for name in redact_params}
+        self.meta = {}
+        self.interactions = []
+        self._lock = threading.Lock()
+        self._start = None
+
+    def key(self, method: str, url: str) -> str:
+        """ The key requests are matched on: the method and the url, with redacted and sorted query parameters.
+
+        :param method: The http method.
+        :type method: str
+        :param url: The complete url.
+        :type url: str
+        :return: The key.
+        :rtype: str
+        """
+        parts = urllib.parse.urlsplit(url)
+        query = sorted((name, REDACTED if name.lower() in self.redact_params else value)
+                       for name, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True))
+        url = urllib.parse.urlunsplit((parts.scheme, parts.netloc, parts.path.replace('//', '/'),
+                                       urllib.parse.urlencode(query), ''))
+        return '{} {}'.format(method.upper(), url)
+
+    def _headers(self, headers: Dict) -> Dict:
+        return {name: REDACTED if name.lower() in self.redact_headers else value
+                for name, value in headers.items()}
+
+    def _store_body(self, content: bytes, content_type: str) -> Dict:
+        is_text = any(kind in content_type for kind in ('json', 'text', 'xml'))
+        if is_text and len(content) <= self.inline_limit:
+            text = content.decode('utf-8', errors='replace')
+            if 'json' in content_type and self.redact_fields:
+                try:
+                    text = json.dumps(_redact_json(json.loads(text), self.redact_fields))
+                except ValueError:
+                    pass
+            return {'body': text}
+        digest = hashlib.sha1(content).hexdigest()
+        body_path = os.path.join(self.path, BODIES_DIR, digest)
+        if not os.path.exists(body_path):
+            os.makedirs(os.path.dirname(body_path), exist_ok=True)
+            with open(body_path, 'wb') as f:
+                f.write(content)
+        return {'body_file': digest, 'body_size': len(content)}
+
+    def _load_body(self, interaction: Dict) -> bytes:
+        if 'body_file' in interaction:
+            with open(os.path.join(self.path, BODIES_DIR, interaction['body_file']), 'rb') as f:
+                return f.read()
+        return interaction.get('body', '').encode('utf-8')
+
+    def add(self, request: requests.PreparedRequest, response: requests.Response, seconds: float):
+        """ Records one interaction. Called by the recording adapter.
+
+        :param request: The sent request.
+        :type request: requests.PreparedRequest
+        :param response: The response, with its content read.
+        :type response: requests.Response
+        :param seconds: Time from sending the request until the content was read.
+        :type seconds: float
+        """
+        content_type = response.headers.get('Content-Type', '')
+        interaction = {
+            'key': self.key(request.method, request.url),
+            'offset': round(time.monotonic() - seconds - self._start, 6),
+            'seconds': round(seconds, 6),
+            'request_headers': self._headers(request.headers),
+            'request_size': body_size(request.body, request.headers),
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': self._headers(response.headers),
+        }
+        interaction.update(self._store_body(response.content or b'', content_type))
+        with self._lock:
+            self.interactions.append(interaction)
+
+    def save(self):
+        """ Writes the interactions to the cassette directory.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        with self._lock:
+            interactions = sorted(self.interactions, key=lambda interaction: interaction['offset'])
+        with gzip.open(os.path.join(self.path, INTERACTIONS_FILE), 'wt', encoding='utf-8') as f:
+            f.write(json.dumps({'meta': self.meta}) + '\n')
+            for interaction in interactions:
+                f.write(json.dumps(interaction, separators=(',', ':')) + '\n')
+
+    def load(self) -> 'Cassette':
+        """ Reads the interactions from the cassette directory.
+
+        :return: The cassette itself.
+        :rtype: Cassette
+        """
+        with gzip.open(os.path.join(self.path, INTERACTIONS_FILE), 'rt', encoding='utf-8') as f:
+            self.meta = json.loads(f.readline())['meta']
+            self.interactions = [json.loads(line) for line in f if line.strip()]
+        return self
+
+    @contextlib.contextmanager
+    def recording(self, target):
+        """ Records all requests sent through the session of an AEP instance (or through
+        a requests session) while in the context, and saves the cassette on exit.
+
+        :param target: An AEP instance or a requests.Session.
+        """
+        session = getattr(target, 'session', target)
+        self.meta = {'version': CASSETTE_VERSION, 'recorded_at': datetime.datetime.utcnow().isoformat() + 'Z',
+                     'platform_gateway': getattr(target, 'platform_gateway', None),
+                     'sandbox_name': getattr(target, 'sandbox_name', None)}
+        self.interactions = []
+        self._start = time.monotonic()
+        previous = dict(session.adapters)
+        for prefix in ('https://', 'http://'):
+            session.mount(prefix, RecordingAdapter(self, session.get_adapter(prefix)))
+        try:
+            yield self
+        finally:
+            session.adapters.clear()
+            session.adapters.update(previous)
+            self.save()
+
+    def replay_session(self, time_scale: float = None) -> requests.Session:
+        """ A session that answers requests from the cassette.
+
+        :param time_scale: Factor on the recorded response times, e.g. 1.0 for the original
+        timings or 0.1 for ten times faster. Defaults to None, answering without delay.
+        :type time_scale: float, optional
+        :return: The session.
+        :rtype: requests.Session
+        """
+        if not self.interactions:
+            self.load()
+        session = requests.Session()
+        adapter = ReplayAdapter(self, time_scale)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def replay_client(self, time_scale: float = None, **kwargs):
+        """ An AEP instance that answers its requests from the cassette, without authenticating.
+
+        :param time_scale: Factor on the recorded response times, defaults to None, without delay
+        :type time_scale: float, optional
+        :param kwargs: Passed to AEP, e.g. sandbox_name; the gateway and sandbox default to
+        those of the recording.
+        :return: The client.
+        :rtype: AEP
+        """
+        from ..aep import AEP
+        session = self.replay_session(time_scale)
+        kwargs.setdefault('platform_gateway', self.meta.get('platform_gateway'))
+        kwargs.setdefault('sandbox_name', self.meta.get('sandbox_name'))
+        return AEP(session=session, **kwargs)
+
+
+class RecordingAdapter(BaseAdapter):
+    def __init__(self, cassette: Cassette, inner: HTTPAdapter):
+        """ Sends requests through the inner adapter and records them in the cassette.
+
+        :param cassette: The cassette to record in.
+        :type cassette: Cassette
+        :param inner: The adapter that sends the requests.
+        :type inner: HTTPAdapter
+        """
+        super().__init__()
+        self.cassette = cassette
+        self.inner = inner
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        start = time.monotonic()
+        response = self.inner.send(request, **kwargs)
+        # reads streamed bodies as well; iter_content then iterates over the read content
+        response.content
+        self.cassette.add(request, response, time.monotonic() - start)
+        return response
+
+    def close(self):
+        self.inner.close()
+
+
+class ReplayAdapter(BaseAdapter):
+    def __init__(self, cassette: Cassette, time_scale: float = None):
+        """ Answers requests with the recorded responses. Requests with the same key are
+        answered in recorded order, so polling replays the recorded job states; once they
+        run out, the last response is repeated.
+
+        :param cassette: The loaded cassette.
+        :type cassette: Cassette
+        :param time_scale: Factor on the recorded response times, defaults to None, without delay
+        :type time_scale: float, optional
+        """
+        super().__init__()
+        self.cassette = cassette
+        self.time_scale = time_scale
+        self._lock = threading.Lock()
+        self._queues = {}
+        for interaction in cassette.interactions:
+            self._queues.setdefault(interaction['key'], []).append(interaction)
+        self._positions = {}
+
+    def _next(self, key: str) -> Dict:
+        with self._lock:
+            queue = self._queues.get(key)
+            if not queue:
+                raise CassetteMiss('No recorded response for {}'.format(key))
+            position = self._positions.get(key, 0)
+            self._positions[key] = min(position + 1, len(queue) - 1)
+            return queue[position]
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        interaction = self._next(self.cassette.key(request.method, request.url))
+        if self.time_scale:
+            time.sleep(interaction['seconds'] * self.time_scale)
+        content = self.cassette._load_body(interaction)
+        response = requests.Response()
+        response.status_code = interaction['status']
+        response.reason = interaction.get('reason')
+        response.headers = CaseInsensitiveDict(interaction['headers'])
+        response.headers['Content-Length'] = str(len(content))
+        response.headers.pop('Content-Encoding', None)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = io.BytesIO(content)
+        response._content = content
+        response.url = request.url
+        response.request = request
+        response.elapsed = datetime.timedelta(seconds=interaction['seconds'])
+        return response
+
+    def close(self):
+        pass
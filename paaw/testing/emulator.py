@@ -0,0 +1,906 @@
+import copy
+import email.parser
+import gzip
+import io
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Tuple
+import pyarrow as pa
+import pyarrow.parquet as pq
+from ..utils.general_utils import setup_logger
+from ..utils.jsonpatch import apply_operation
+from ..exc import InvalidPatchOperation
+
+LOGGER = setup_logger(__name__)
+
+IMS_ENDPOINT_JWT = '/ims/exchange/jwt'
+TENANT = 'emulator'
+
+
+class EmulatorError(Exception):
+    def __init__(self, status: int, message: str):
+        """ Ends the handling of a request with an error response.
+
+        :param status: The http status code.
+        :type status: int
+        :param message: The error message.
+        :type message: str
+        """
+        super().__init__(message)
+        self.status = status
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def _new_id() -> str:
+    return uuid.uuid4().hex
+
+
+def _property_filters(query: List[Tuple[str, str]]) -> List[Tuple[str, str, str]]:
+    """ Parses property filters like flowId==a,b and updatedAt>123 into (field, operator, value).
+    """
+    filters = []
+    for key, value in query:
+        if key != 'property':
+            continue
+        match = re.match(r'^([\w.]+)(==|!=|>=|<=|>|<)(.*)$', value)
+        if match:
+            filters.append(match.groups())
+    return filters
+
+
+def _matches(definition: Dict, filters: List[Tuple[str, str, str]]) -> bool:
+    for field, operator, value in filters:
+        actual = definition
+        for step in field.split('.'):
+            actual = actual.get(step) if isinstance(actual, dict) else None
+        if operator == '==' and str(actual) not in value.split(','):
+            return False
+        if operator == '!=' and str(actual) in value.split(','):
+            return False
+        if operator in ('>', '<', '>=', '<='):
+            if actual is None:
+                return False
+            left, right = float(actual), float(value)
+            if not {'>': left > right, '<': left < right, '>=': left >= right, '<=': left <= right}[operator]:
+                return False
+    return True
+
+
+def parquet_bytes(num_rows: int, offset: int = 0) -> bytes:
+    """ Creates a parquet file with profile-like rows.
+
+    :param num_rows: Number of rows.
+    :type num_rows: int
+    :param offset: First row number, defaults to 0
+    :type offset: int, optional
+    :return: The parquet file.
+    :rtype: bytes
+    """
+    ids = range(offset, offset + num_rows)
+    table = pa.table({
+        'personId': pa.array(['person-{}'.format(i) for i in ids]),
+        'email': pa.array(['person{}@example.com'.format(i) for i in ids]),
+        'score': pa.array([float(i % 100) / 100 for i in ids]),
+        'identityMap': pa.array([{'ECID': 'ecid-{}'.format(i)} for i in ids]),
+    })
+    sink = io.BytesIO()
+    pq.write_table(table, sink)
+    return sink.getvalue()
+
+
+class AEPEmulator:
+    def __init__(self, latency: float = 0.0, latency_jitter: float = 0.0, requests_per_second: float = None,
+                 failure_rate: float = 0.0, failure_status: int = 503, job_duration: float = 0.5,
+                 job_failure_rate: float = 0.0, page_size: int = 100, seed: int = None):
+        """ A local stand-in for AEP, for tests and benchmarks. It serves the endpoints
+        in known_endpoints.yaml and the IMS token exchange from memory: catalog datasets
+        and batches, dataaccess files with real parquet, flows and flowruns, sensei engines,
+        instances, experiments, runs and models, queries and schedules, schema registry
+        resources and descriptors, and segment jobs. Jobs and runs finish job_duration
+        seconds after they are created.
+
+        Latency, throttling (429 above requests_per_second) and random failures are configurable.
+        Use config_data to create an AEP that talks to the emulator:
+
+            emulator = AEPEmulator(latency=0.05).start()
+            aep = AEP(config_data=emulator.config_data())
+
+        :param latency: Seconds added to every response, defaults to 0.0
+        :type latency: float, optional
+        :param latency_jitter: Random extra seconds up to this value, defaults to 0.0
+        :type latency_jitter: float, optional
+        :param requests_per_second: Requests above this rate get a 429, defaults to None (no throttling)
+        :type requests_per_second: float, optional
+        :param failure_rate: Fraction of requests that fail with failure_status, defaults to 0.0
+        :type failure_rate: float, optional
+        :param failure_status: Status code of injected failures, defaults to 503
+        :type failure_status: int, optional
+        :param job_duration: Seconds until jobs and runs finish, defaults to 0.5
+        :type job_duration: float, optional
+        :param job_failure_rate: Fraction of jobs and runs that finish as failed, defaults to 0.0
+        :type job_failure_rate: float, optional
+        :param page_size: Items per page of paginated listings, defaults to 100
+        :type page_size: int, optional
+        :param seed: Seed for the random failures, defaults to None
+        :type seed: int, optional
+        """
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.requests_per_second = requests_per_second
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.job_duration = job_duration
+        self.job_failure_rate = job_failure_rate
+        self.page_size = page_size
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self._fail_next = []
+        self._tokens = None
+        self._last_refill = time.monotonic()
+        self._server = None
+        self._thread = None
+        self.request_counts = {}
+        self.reset()
+        self._routes = self._build_routes()
+
+    def reset(self):
+        """ Removes all state and request counts.
+        """
+        with self._lock:
+            self.datasets = {}
+            self.batches = {}
+            self.files = {}
+            self.file_contents = {}
+            self.flows = {}
+            self.runs = {}
+            self.engines = {}
+            self.mlinstances = {}
+            self.experiments = {}
+            self.experiment_runs = {}
+            self.models = {}
+            self.queries = {}
+            self.schedules = {}
+            self.xdm = {}
+            self.descriptors = {}
+            self.segmentjobs = {}
+            self.request_counts = {}
+
+    def start(self, host: str = '127.0.0.1', port: int = 0) -> 'AEPEmulator':
+        """ Serves the emulator from a background thread.
+
+        :param host: Interface to listen on, defaults to '127.0.0.1'
+        :type host: str, optional
+        :param port: Port to listen on, 0 picks a free port, defaults to 0
+        :type port: int, optional
+        :return: This emulator
+        :rtype: AEPEmulator
+        """
+        emulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # headers and body are written separately, which otherwise waits for delayed acks
+            disable_nagle_algorithm = True
+
+            def _read_body(self) -> bytes:
+                if self.headers.get('Content-Length'):
+                    return self.rfile.read(int(self.headers['Content-Length']))
+                if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+                    chunks = []
+                    while True:
+                        size = int(self.rfile.readline().split(b';')[0], 16)
+                        chunk = self.rfile.read(size)
+                        self.rfile.readline()
+                        if size == 0:
+                            return b''.join(chunks)
+                        chunks.append(chunk)
+                return b''
+
+            def _handle(self):
+                body = self._read_body()
+                if self.headers.get('Content-Encoding', '').lower() == 'gzip':
+                    body = gzip.decompress(body)
+                status, payload, headers = emulator.handle(self.command, self.path, dict(self.headers.items()), body)
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _handle
+
+            def log_message(self, format, *args):
+                LOGGER.debug(format, *args)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='paaw-emulator', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ Stops the server.
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> 'AEPEmulator':
+        return self.start() if self._server is None else self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def url(self) -> str:
+        """ The url of the server, which is the gateway of the emulated AEP.
+
+        :return: The url
+        :rtype: str
+        """
+        host, port = self._server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def config_data(self, sandbox_name: str = 'dev', ims_token: str = None) -> str:
+        """ An AEP config that points to this emulator. Without ims_token, the config
+        exchanges a JWT with the emulated IMS, like a real integration does.
+
+        :param sandbox_name: The sandbox, defaults to 'dev'
+        :type sandbox_name: str, optional
+        :param ims_token: A fixed token instead of the token exchange, defaults to None
+        :type ims_token: str, optional
+        :return: The config as yaml.
+        :rtype: str
+        """
+        import base64
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import rsa
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL,
+                                serialization.NoEncryption())
+        return '\n'.join([
+            'Server:',
+            '  ims_host: {}'.format(self.url),
+            '  ims_endpoint_jwt: {}'.format(IMS_ENDPOINT_JWT),
+            'Enterprise:',
+            '  api_key: emulator-api-key',
+            '  org_id: EMULATOR@AdobeOrg',
+            '  tech_acct: emulator@techacct.adobe.com',
+            '  client_secret: emulator-secret',
+            '  priv_key: {}'.format(base64.b64encode(pem).decode('ascii')),
+            'Platform:',
+            '  platform_gateway: https://platform.adobe.io',
+            '  emulator_gateway: {}'.format(self.url),
+            '  ims_token: {}'.format(ims_token or '<ims_token>'),
+            'Titles:',
+            '  sandbox_name: {}'.format(sandbox_name),
+            ''])
+
+    def fail_next(self, count: int = 1, status: int = None):
+        """ Lets the next requests fail, for deterministic failure injection.
+
+        :param count: Number of requests to fail, defaults to 1
+        :type count: int, optional
+        :param status: Status code, defaults to failure_status
+        :type status: int, optional
+        """
+        with self._lock:
+            self._fail_next.extend([status or self.failure_status] * count)
+
+    def _throttled(self) -> bool:
+        if not self.requests_per_second:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            if self._tokens is None:
+                self._tokens = self.requests_per_second
+            self._tokens = min(self.requests_per_second,
+                               self._tokens + (now - self._last_refill) * self.requests_per_second)
+            self._last_refill = now
+            if self._tokens < 1:
+                return True
+            self._tokens -= 1
+            return False
+
+    def handle(self, method: str, raw_path: str, headers: Dict, body: bytes) -> Tuple[int, bytes, Dict]:
+        """ Handles one request, also usable without the http server.
+
+        :param method: The http method.
+        :type method: str
+        :param raw_path: The path with query string.
+        :type raw_path: str
+        :param headers: The request headers.
+        :type headers: Dict
+        :param body: The raw body.
+        :type body: bytes
+        :return: The status code, body and headers of the response.
+        :rtype: Tuple[int, bytes, Dict]
+        """
+        parsed = urllib.parse.urlsplit(raw_path)
+        # known endpoints end in a slash and suffixes start with one
+        path = re.sub('/+', '/', parsed.path)
+        if len(path) > 1:
+            path = path.rstrip('/')
+        query = urllib.parse.parse_qsl(parsed.query, keep_blank_values=True)
+        delay = self.latency + (self._random.uniform(0, self.latency_jitter) if self.latency_jitter else 0)
+        if delay:
+            time.sleep(delay)
+        route_name = None
+        try:
+            with self._lock:
+                injected = self._fail_next.pop(0) if self._fail_next else None
+            if injected is None and self.failure_rate and self._random.random() < self.failure_rate:
+                injected = self.failure_status
+            if injected is not None:
+                raise EmulatorError(injected, 'Injected failure')
+            if self._throttled():
+                return 429, b'{"error": "Too many requests"}', {'Content-Type': 'application/json',
+                                                                  'Retry-After': '1'}
+            for route_method, pattern, handler in self._routes:
+                match = pattern.match(path)
+                if match and route_method == method:
+                    route_name = handler.__name__
+                    result = handler(match, query, body, headers)
+                    break
+            else:
+                raise EmulatorError(404, 'No emulated endpoint for {} {}'.format(method, path))
+        except EmulatorError as e:
+            result = e.status, {'title': str(e), 'status': e.status}
+        except (ValueError, KeyError, InvalidPatchOperation) as e:
+            result = 400, {'title': 'Bad request: {}'.format(e), 'status': 400}
+        finally:
+            with self._lock:
+                key = route_name or '{} {}'.format(method, path)
+                self.request_counts[key] = self.request_counts.get(key, 0) + 1
+        status, payload = result[:2]
+        if isinstance(payload, bytes):
+            return status, payload, {'Content-Type': 'application/octet-stream'}
+        return status, json.dumps(payload).encode('utf-8'), {'Content-Type': 'application/json'}
+
+    def _build_routes(self) -> List[Tuple[str, re.Pattern, Callable]]:
+        routes = [
+            ('POST', IMS_ENDPOINT_JWT, self._ims_exchange),
+            ('POST', '/data/foundation/catalog', self._catalog_multi),
+            ('GET', '/data/foundation/catalog/datasets', self._list_datasets),
+            ('POST', '/data/foundation/catalog/datasets', self._create_dataset),
+            ('GET', '/data/foundation/catalog/datasets/(?P<id>[^/]+)', self._get_dataset),
+            ('DELETE', '/data/foundation/catalog/datasets/(?P<id>[^/]+)', self._delete_dataset),
+            ('GET', '/data/foundation/catalog/batches', self._list_batches),
+            ('GET', '/data/foundation/catalog/batches/(?P<id>[^/]+)', self._get_batch),
+            ('GET', '/data/foundation/export/batches/(?P<id>[^/]+)/files', self._list_batch_files),
+            ('GET', '/data/foundation/export/files/(?P<id>[^/]+)', self._get_file),
+            ('GET', '/data/foundation/flowservice/flows', self._list_flows),
+            ('GET', '/data/foundation/flowservice/flows/(?P<id>[^/]+)', self._get_flow),
+            ('POST', '/data/foundation/flowservice/flows', self._create_flow),
+            ('DELETE', '/data/foundation/flowservice/flows/(?P<id>[^/]+)', self._delete_flow),
+            ('GET', '/data/foundation/flowservice/runs', self._list_runs),
+            ('POST', '/data/foundation/flowservice/runs', self._create_run),
+            ('GET', '/data/foundation/flowservice/runs/(?P<id>[^/]+)', self._get_run),
+            ('POST', '/data/sensei/engines', self._create_engine),
+            ('PUT', '/data/sensei/engines/(?P<id>[^/]+)', self._update_engine),
+            ('GET', '/data/sensei/engines/(?P<id>[^/]+)', self._get_engine),
+            ('POST', '/data/sensei/mlInstances', self._create_mlinstance),
+            ('GET', '/data/sensei/mlInstances/(?P<id>[^/]+)', self._get_mlinstance),
+            ('POST', '/data/sensei/experiments', self._create_experiment),
+            ('GET', '/data/sensei/experiments/(?P<id>[^/]+)', self._get_experiment),
+            ('POST', '/data/sensei/experiments/(?P<id>[^/]+)/runs', self._create_experiment_run),
+            ('GET', '/data/sensei/experiments/(?P<id>[^/]+)/runs/(?P<run_id>[^/]+)/status',
+             self._get_experiment_run_status),
+            ('GET', '/data/sensei/models', self._list_models),
+            ('POST', '/data/foundation/query/queries', self._create_query),
+            ('GET', '/data/foundation/query/queries/(?P<id>[^/]+)', self._get_query),
+            ('GET', '/data/foundation/query/schedules', self._list_schedules),
+            ('POST', '/data/foundation/query/schedules', self._create_schedule),
+            ('GET', '/data/foundation/query/schedules/(?P<id>[^/]+)', self._get_schedule),
+            ('PATCH', '/data/foundation/query/schedules/(?P<id>[^/]+)', self._patch_schedule),
+            ('DELETE', '/data/foundation/query/schedules/(?P<id>[^/]+)', self._delete_schedule),
+            ('POST', '/data/core/ups/export/jobs', self._create_segmentjob),
+            ('GET', '/data/core/ups/export/jobs/(?P<id>[^/]+)', self._get_segmentjob),
+            ('POST', '/data/foundation/schemaregistry/tenant/descriptors', self._create_descriptor),
+            ('GET', '/data/foundation/schemaregistry/tenant/descriptors/(?P<id>[^/]+)', self._get_descriptor),
+            ('POST', '/data/foundation/schemaregistry/tenant/(?P<type>schemas|fieldgroups)', self._create_xdm),
+            ('GET', '/data/foundation/schemaregistry/(?P<container>tenant|global)/(?P<type>\\w+)/(?P<id>[^/]+)',
+             self._get_xdm),
+            ('PATCH', '/data/foundation/schemaregistry/tenant/(?P<type>schemas|fieldgroups)/(?P<id>[^/]+)',
+             self._patch_xdm),
+        ]
+        return [(method, re.compile('^' + pattern + '$'), handler) for method, pattern, handler in routes]
+
+    def add_dataset(self, name: str = 'dataset', batches: int = 1, files_per_batch: int = 1,
+                    rows_per_file: int = 1000, tags: Dict[str, List[str]] = None) -> str:
+        """ Adds a dataset with successful batches of parquet files.
+
+        :param name: Name of the dataset, defaults to 'dataset'
+        :type name: str, optional
+        :param batches: Number of batches, defaults to 1
+        :type batches: int, optional
+        :param files_per_batch: Files per batch, defaults to 1
+        :type files_per_batch: int, optional
+        :param rows_per_file: Rows per parquet file, defaults to 1000
+        :type rows_per_file: int, optional
+        :param tags: Tags of the dataset, defaults to None
+        :type tags: Dict[str, List[str]], optional
+        :return: The dataset id.
+        :rtype: str
+        """
+        dataset_id = _new_id()[:24]
+        with self._lock:
+            self.datasets[dataset_id] = {'name': name, 'created': _now_ms(), 'updated': _now_ms()}
+            if tags is not None:
+                self.datasets[dataset_id]['tags'] = tags
+        for _ in range(batches):
+            self.add_batch(dataset_id, files_per_batch, rows_per_file)
+        return dataset_id
+
+    def add_batch(self, dataset_id: str, files: int = 1, rows_per_file: int = 1000) -> str:
+        """ Adds a successful batch with parquet files to a dataset.
+
+        :param dataset_id: The dataset.
+        :type dataset_id: str
+        :param files: Number of files, defaults to 1
+        :type files: int, optional
+        :param rows_per_file: Rows per parquet file, defaults to 1000
+        :type rows_per_file: int, optional
+        :return: The batch id.
+        :rtype: str
+        """
+        batch_id = _new_id()[:26].upper()
+        content = parquet_bytes(rows_per_file)
+        with self._lock:
+            self.batches[batch_id] = {'status': 'success', 'created': _now_ms(), 'updated': _now_ms(),
+                                      'relatedObjects': [{'type': 'dataSet', 'id': dataset_id}],
+                                      'metrics': {'recordCount': files * rows_per_file}}
+            file_ids = []
+            for i in range(files):
+                file_id = '{}-{}'.format(batch_id, i + 1)
+                file_ids.append(file_id)
+                self.file_contents[file_id] = {'part-{:05d}.parquet'.format(i): content}
+            self.files[batch_id] = file_ids
+        return batch_id
+
+    def add_flow(self, name: str = 'flow', runs: int = 0) -> str:
+        """ Adds a flow with finished runs.
+
+        :param name: Name of the flow, defaults to 'flow'
+        :type name: str, optional
+        :param runs: Number of successful runs, defaults to 0
+        :type runs: int, optional
+        :return: The flow id.
+        :rtype: str
+        """
+        flow_id = str(uuid.uuid4())
+        with self._lock:
+            self.flows[flow_id] = {'id': flow_id, 'name': name, 'state': 'enabled',
+                                   'createdAt': _now_ms(), 'updatedAt': _now_ms()}
+            for _ in range(runs):
+                run = self._new_run(flow_id)
+                run['_finish_at'] = 0
+        return flow_id
+
+    def add_schedule(self, name: str, sql: str = 'SELECT 1', cron: str = '0 0 * * *') -> str:
+        """ Adds an enabled scheduled query.
+
+        :param name: Name of the query.
+        :type name: str
+        :param sql: The sql, defaults to 'SELECT 1'
+        :type sql: str, optional
+        :param cron: The schedule, defaults to '0 0 * * *'
+        :type cron: str, optional
+        :return: The schedule id.
+        :rtype: str
+        """
+        return self._create_schedule(None, [], json.dumps({
+            'query': {'name': name, 'sql': sql, 'dbName': 'prod:all'},
+            'schedule': {'schedule': cron}}).encode('utf-8'), {})[1]['id']
+
+    def add_xdm_resource(self, definition: Dict, resource_type: str = None):
+        """ Adds a schema registry resource (schema, class, fieldgroup, datatype) by its $id.
+
+        :param definition: The definition, with a $id.
+        :type definition: Dict
+        :param resource_type: The type as used in urls, e.g. 'datatypes', defaults to
+        the type in the $id
+        :type resource_type: str, optional
+        """
+        from ..models.schemaregistry import XDM_RESOURCE_TYPES
+        if resource_type is None:
+            segments = urllib.parse.urlparse(definition['$id']).path.split('/')
+            resource_type = next((XDM_RESOURCE_TYPES[s] for s in segments if s in XDM_RESOURCE_TYPES), 'datatypes')
+        with self._lock:
+            self.xdm[definition['$id']] = (resource_type, copy.deepcopy(definition))
+
+    def _job_state(self, job: Dict) -> str:
+        """ Returns 'running', 'succeeded' or 'failed' for an emulated job.
+        """
+        if time.monotonic() < job['_finish_at']:
+            return 'running'
+        return 'failed' if job['_fails'] else 'succeeded'
+
+    def _schedule_finish(self, job: Dict):
+        job['_finish_at'] = time.monotonic() + self.job_duration
+        job['_fails'] = self.job_failure_rate > 0 and self._random.random() < self.job_failure_rate
+
+    @staticmethod
+    def _public(definition: Dict) -> Dict:
+        return {key: value for key, value in definition.items() if not key.startswith('_')}
+
+    def _page(self, items: List[Dict], query: List[Tuple[str, str]], key: str) -> Dict:
+        """ Returns one page of items with a next link that continues at the next offset.
+        """
+        params = dict(query)
+        start = int(params.get('start', 0))
+        limit = int(params.get('limit', self.page_size))
+        page = items[start:start + limit]
+        result = {key: page, '_page': {'count': len(page)}}
+        if start + limit < len(items):
+            result['_links'] = {'next': {'href': '?start={}&limit={}'.format(start + limit, limit)}}
+        return result
+
+    @staticmethod
+    def _json(body: bytes):
+        return json.loads(body or b'{}')
+
+    def _get(self, store: Dict, id: str, kind: str) -> Dict:
+        with self._lock:
+            if id not in store:
+                raise EmulatorError(404, '{} {} not found'.format(kind, id))
+            return store[id]
+
+    def _ims_exchange(self, match, query, body, headers):
+        form = dict(urllib.parse.parse_qsl(body.decode('utf-8')))
+        if not form.get('jwt_token') or not form.get('client_id'):
+            raise EmulatorError(400, 'jwt_token and client_id are required')
+        return 200, {'token_type': 'bearer', 'access_token': 'emulator-' + _new_id(), 'expires_in': 86399999}
+
+    @staticmethod
+    def _catalog_page(items: List[Tuple[str, Dict]], query: List[Tuple[str, str]]) -> Dict:
+        """ Filters, orders and pages (id, definition) pairs like catalog listings do: property
+        filters, orderBy=asc:field or desc:field (created by default), start, limit and properties.
+        """
+        params = dict(query)
+        filters = _property_filters(query)
+        items = [(item_id, item) for item_id, item in items if _matches(item, filters)]
+        direction, _, field = params.get('orderBy', 'asc:created').rpartition(':')
+        items.sort(key=lambda item: item[1].get(field) or 0, reverse=direction == 'desc')
+        start = int(params.get('start', 0))
+        items = items[start:start + min(int(params.get('limit', 50)), 100)]
+        properties = params['properties'].split(',') if params.get('properties') else None
+        return {item_id: copy.deepcopy({key: value for key, value in item.items()
+                                        if properties is None or key in properties})
+                for item_id, item in items}
+
+    def _catalog_multi(self, match, query, body, headers):
+        """ Answers the sub-requests of a batched catalog request, like {"id": "a", "resource":
+        "/dataSets/<id>", "method": "get"}, with a multistatus list of their codes and bodies.
+        """
+        responses = []
+        for sub_request in self._json(body):
+            collection, _, rest = sub_request['resource'].strip('/').partition('/')
+            path = '/data/foundation/catalog/{}/{}'.format(collection.lower(), rest).rstrip('/')
+            method = sub_request.get('method', 'get').upper()
+            try:
+                for route_method, pattern, handler in self._routes:
+                    route_match = pattern.match(path)
+                    if route_match and route_method == method:
+                        code, payload = handler(route_match, [], json.dumps(sub_request.get('body', {})).encode(),
+                                                headers)[:2]
+                        break
+                else:
+                    raise EmulatorError(404, 'No emulated endpoint for {} {}'.format(method, path))
+            except EmulatorError as e:
+                code, payload = e.status, {'title': str(e), 'status': e.status}
+            responses.append({'id': sub_request['id'], 'code': code, 'headers': {}, 'body': payload})
+        return 207, responses
+
+    def _list_datasets(self, match, query, body, headers):
+        with self._lock:
+            return 200, self._catalog_page(list(self.datasets.items()), query)
+
+    def _create_dataset(self, match, query, body, headers):
+        definition = self._json(body)
+        dataset_id = _new_id()[:24]
+        with self._lock:
+            self.datasets[dataset_id] = {**definition, 'created': _now_ms(), 'updated': _now_ms()}
+            return 201, {dataset_id: copy.deepcopy(self.datasets[dataset_id])}
+
+    def _get_dataset(self, match, query, body, headers):
+        return 200, {match['id']: copy.deepcopy(self._get(self.datasets, match['id'], 'dataset'))}
+
+    def _delete_dataset(self, match, query, body, headers):
+        self._get(self.datasets, match['id'], 'dataset')
+        with self._lock:
+            del self.datasets[match['id']]
+        return 200, ['@/dataSets/' + match['id']]
+
+    def _list_batches(self, match, query, body, headers):
+        params = dict(query)
+        with self._lock:
+            batches = [(batch_id, batch) for batch_id, batch in self.batches.items()
+                       if ('dataSet' not in params
+                           or any(obj['id'] == params['dataSet'] for obj in batch['relatedObjects']))
+                       and ('status' not in params or batch['status'] == params['status'])
+                       and ('createdAfter' not in params or batch['created'] > int(params['createdAfter']))]
+            return 200, self._catalog_page(batches, query)
+
+    def _get_batch(self, match, query, body, headers):
+        return 200, {match['id']: copy.deepcopy(self._get(self.batches, match['id'], 'batch'))}
+
+    def _list_batch_files(self, match, query, body, headers):
+        file_ids = self._get(self.files, match['id'], 'batch')
+        data = [{'dataSetFileId': file_id, 'dataSetViewId': match['id'], 'isValid': True,
+                 '_links': {'self': {'href': '/files/' + file_id}}} for file_id in file_ids]
+        return 200, {'data': data, '_page': {'count': len(data), 'limit': 100}}
+
+    def _get_file(self, match, query, body, headers):
+        contents = self._get(self.file_contents, match['id'], 'file')
+        params = dict(query)
+        if 'path' in params:
+            name = params['path'].split('/')[-1]
+            if name not in contents:
+                raise EmulatorError(404, 'file {} not found'.format(params['path']))
+            return 200, contents[name]
+        data = [{'name': name, 'length': str(len(content)),
+                 '_links': {'self': {'href': '/files/{}?path={}'.format(match['id'], name)}}}
+                for name, content in contents.items()]
+        return 200, {'data': data, '_page': {'count': len(data), 'limit': 100}}
+
+    def _new_run(self, flow_id: str) -> Dict:
+        run_id = str(uuid.uuid4())
+        run = {'id': run_id, 'flowId': flow_id, 'createdAt': _now_ms(), 'updatedAt': _now_ms(),
+               'etag': '"{}"'.format(_new_id()[:8])}
+        self._schedule_finish(run)
+        self.runs[run_id] = run
+        return run
+
+    def _update_run(self, run: Dict) -> str:
+        """ Bumps updatedAt of a run when it finished since it was last looked at, and returns its state.
+        """
+        state = self._job_state(run)
+        if state != 'running' and not run.get('_finished'):
+            run['_finished'] = True
+            run['updatedAt'] = _now_ms()
+        return state
+
+    def _run_view(self, run: Dict) -> Dict:
+        state = self._update_run(run)
+        status = {'running': 'inProgress', 'succeeded': 'success', 'failed': 'failed'}[state]
+        view = self._public(run)
+        view['metrics'] = {'statusSummary': {'status': status}}
+        return view
+
+    def _list_flows(self, match, query, body, headers):
+        filters = _property_filters(query)
+        with self._lock:
+            flows = [copy.deepcopy(flow) for flow in self.flows.values() if _matches(flow, filters)]
+        return 200, self._page(flows, query, 'items')
+
+    def _get_flow(self, match, query, body, headers):
+        return 200, {'items': [copy.deepcopy(self._get(self.flows, match['id'], 'flow'))]}
+
+    def _create_flow(self, match, query, body, headers):
+        definition = self._json(body)
+        flow_id = str(uuid.uuid4())
+        with self._lock:
+            self.flows[flow_id] = {**definition, 'id': flow_id, 'state': 'enabled', 'etag': _new_id(),
+                                   'createdAt': _now_ms(), 'updatedAt': _now_ms()}
+        return 201, {'id': flow_id, 'etag': self.flows[flow_id]['etag']}
+
+    def _delete_flow(self, match, query, body, headers):
+        self._get(self.flows, match['id'], 'flow')
+        with self._lock:
+            del self.flows[match['id']]
+        return 204, b''
+
+    def _list_runs(self, match, query, body, headers):
+        filters = _property_filters(query)
+        with self._lock:
+            for run in self.runs.values():
+                self._update_run(run)
+            page = self._page([run for run in self.runs.values() if _matches(run, filters)], query, 'items')
+            page['items'] = [self._run_view(run) for run in page['items']]
+        return 200, page
+
+    def _create_run(self, match, query, body, headers):
+        definition = self._json(body)
+        self._get(self.flows, definition['flowId'], 'flow')
+        with self._lock:
+            run = self._new_run(definition['flowId'])
+            return 201, {'id': run['id'], 'etag': run['etag']}
+
+    def _get_run(self, match, query, body, headers):
+        run = self._get(self.runs, match['id'], 'run')
+        with self._lock:
+            return 200, {'items': [self._run_view(run)]}
+
+    def _create_engine(self, match, query, body, headers):
+        content_type = next((value for key, value in headers.items() if key.lower() == 'content-type'), '')
+        message = email.parser.BytesParser().parsebytes(
+            b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body)
+        definition, artifacts = {}, {}
+        for part in message.walk() if message.is_multipart() else []:
+            field = part.get_param('name', header='content-disposition')
+            if field == 'engine':
+                definition = json.loads(part.get_payload(decode=True))
+            elif field:
+                artifacts[field] = len(part.get_payload(decode=True) or b'')
+        engine_id = match.groupdict().get('id') or str(uuid.uuid4())
+        with self._lock:
+            self.engines[engine_id] = {**definition, 'id': engine_id, 'artifactSizes': artifacts,
+                                       'created': _now_ms()}
+            return 200, copy.deepcopy(self.engines[engine_id])
+
+    def _update_engine(self, match, query, body, headers):
+        self._get(self.engines, match['id'], 'engine')
+        return self._create_engine(match, query, body, headers)
+
+    def _get_engine(self, match, query, body, headers):
+        return 200, copy.deepcopy(self._get(self.engines, match['id'], 'engine'))
+
+    def _create_in(self, store: Dict, body: bytes) -> Tuple[int, Dict]:
+        definition = {**self._json(body), 'id': str(uuid.uuid4()), 'created': _now_ms()}
+        with self._lock:
+            store[definition['id']] = definition
+        return 200, copy.deepcopy(definition)
+
+    def _create_mlinstance(self, match, query, body, headers):
+        return self._create_in(self.mlinstances, body)
+
+    def _get_mlinstance(self, match, query, body, headers):
+        return 200, copy.deepcopy(self._get(self.mlinstances, match['id'], 'mlinstance'))
+
+    def _create_experiment(self, match, query, body, headers):
+        return self._create_in(self.experiments, body)
+
+    def _get_experiment(self, match, query, body, headers):
+        return 200, copy.deepcopy(self._get(self.experiments, match['id'], 'experiment'))
+
+    def _create_experiment_run(self, match, query, body, headers):
+        self._get(self.experiments, match['id'], 'experiment')
+        run = {**self._json(body), 'id': str(uuid.uuid4()), 'experimentId': match['id'], 'created': _now_ms()}
+        with self._lock:
+            self._schedule_finish(run)
+            self.experiment_runs[run['id']] = run
+        return 200, self._public(run)
+
+    def _get_experiment_run_status(self, match, query, body, headers):
+        run = self._get(self.experiment_runs, match['run_id'], 'experiment run')
+        with self._lock:
+            state = self._job_state(run)
+            if state == 'succeeded' and not run.get('_model'):
+                model_id = str(uuid.uuid4())
+                run['_model'] = model_id
+                self.models[model_id] = {'id': model_id, 'experimentId': run['experimentId'],
+                                         'experimentRunId': run['id'], 'created': _now_ms()}
+        status = {'running': 'RUNNING', 'succeeded': 'DONE', 'failed': 'FAILED'}[state]
+        return 200, {'id': run['id'], 'status': status,
+                     'tasks': [{'name': 'train', 'state': status}]}
+
+    def _list_models(self, match, query, body, headers):
+        filters = _property_filters(query)
+        with self._lock:
+            models = [copy.deepcopy(model) for model in self.models.values() if _matches(model, filters)]
+        models.sort(key=lambda model: model['created'], reverse=True)
+        return 200, {'children': models, '_page': {'count': len(models)}}
+
+    def _create_query(self, match, query, body, headers):
+        definition = {**self._json(body), 'id': str(uuid.uuid4()), 'state': 'SUCCESS', 'created': _now_ms()}
+        with self._lock:
+            self.queries[definition['id']] = definition
+        return 202, copy.deepcopy(definition)
+
+    def _get_query(self, match, query, body, headers):
+        return 200, copy.deepcopy(self._get(self.queries, match['id'], 'query'))
+
+    def _list_schedules(self, match, query, body, headers):
+        with self._lock:
+            schedules = [copy.deepcopy(schedule) for schedule in self.schedules.values()]
+        return 200, self._page(schedules, query, 'schedules')
+
+    def _create_schedule(self, match, query, body, headers):
+        definition = self._json(body)
+        if 'query' not in definition or 'schedule' not in definition:
+            raise EmulatorError(400, 'A scheduled query needs a query and a schedule')
+        schedule_id = _new_id()
+        definition = {**definition, 'id': schedule_id, 'state': 'ENABLED', 'created': _now_ms()}
+        with self._lock:
+            self.schedules[schedule_id] = definition
+        return 202, copy.deepcopy(definition)
+
+    def _get_schedule(self, match, query, body, headers):
+        return 200, copy.deepcopy(self._get(self.schedules, match['id'], 'schedule'))
+
+    def _patch_schedule(self, match, query, body, headers):
+        schedule = copy.deepcopy(self._get(self.schedules, match['id'], 'schedule'))
+        for operation in self._json(body).get('body', []):
+            operation = dict(operation)
+            if operation.get('path') == '/state':
+                # AEP takes enable/disable and reports ENABLED/DISABLED
+                state = str(operation['value']).upper()
+                operation['value'] = state if state.endswith('D') else state + 'D'
+            if not operation.get('path', '').startswith('/'):
+                operation['path'] = '/' + operation.get('path', '')
+            apply_operation(schedule, operation)
+        with self._lock:
+            self.schedules[match['id']] = schedule
+        return 200, {'message': 'Request accepted', 'statusCode': 202}
+
+    def _delete_schedule(self, match, query, body, headers):
+        schedule = self._get(self.schedules, match['id'], 'schedule')
+        if schedule['state'] != 'DISABLED':
+            raise EmulatorError(400, 'Schedule {} must be disabled before it is deleted'.format(match['id']))
+        with self._lock:
+            del self.schedules[match['id']]
+        return 202, {'message': 'Schedule deleted'}
+
+    def _create_segmentjob(self, match, query, body, headers):
+        job = {**self._json(body), 'id': str(uuid.uuid4()), 'creationTime': _now_ms()}
+        with self._lock:
+            self._schedule_finish(job)
+            self.segmentjobs[job['id']] = job
+        return 200, dict(self._public(job), status='NEW')
+
+    def _get_segmentjob(self, match, query, body, headers):
+        job = self._get(self.segmentjobs, match['id'], 'segmentjob')
+        state = self._job_state(job)
+        dataset_id = (job.get('destination') or {}).get('datasetId')
+        if state == 'succeeded' and dataset_id and not job.get('_batch'):
+            if dataset_id not in self.datasets:
+                raise EmulatorError(404, 'dataset {} not found'.format(dataset_id))
+            job['_batch'] = self.add_batch(dataset_id, files=2, rows_per_file=1000)
+        view = self._public(job)
+        view['status'] = {'running': 'PROCESSING', 'succeeded': 'SUCCEEDED', 'failed': 'FAILED'}[state]
+        if job.get('_batch'):
+            view['destination'] = dict(view['destination'], batchId=job['_batch'])
+        return 200, view
+
+    def _create_xdm(self, match, query, body, headers):
+        definition = self._json(body)
+        resource_type = match['type']
+        xdm_id = 'https://ns.adobe.com/{}/{}/{}'.format(TENANT, resource_type, _new_id())
+        definition = {**definition, '$id': xdm_id, 'meta:altId': '_{}.{}.{}'.format(
+            TENANT, resource_type, xdm_id.rsplit('/', 1)[-1]), 'version': '1.0'}
+        with self._lock:
+            self.xdm[xdm_id] = (resource_type, definition)
+        return 201, copy.deepcopy(definition)
+
+    def _find_xdm(self, resource_type: str, id: str) -> Dict:
+        id = urllib.parse.unquote_plus(id)
+        with self._lock:
+            for xdm_id, (stored_type, definition) in self.xdm.items():
+                if stored_type == resource_type and id in (xdm_id, definition.get('meta:altId')):
+                    return definition
+        raise EmulatorError(404, '{} {} not found'.format(resource_type, id))
+
+    def _get_xdm(self, match, query, body, headers):
+        return 200, copy.deepcopy(self._find_xdm(match['type'], match['id']))
+
+    def _patch_xdm(self, match, query, body, headers):
+        definition = self._find_xdm(match['type'], match['id'])
+        patched = copy.deepcopy(definition)
+        for operation in self._json(body):
+            apply_operation(patched, operation)
+        major, minor = str(patched.get('version', '1.0')).split('.')[:2]
+        patched['version'] = '{}.{}'.format(major, int(minor) + 1)
+        with self._lock:
+            self.xdm[patched['$id']] = (match['type'], patched)
+        return 200, copy.deepcopy(patched)
+
+    def _create_descriptor(self, match, query, body, headers):
+        definition = {**self._json(body), '@id': _new_id()}
+        with self._lock:
+            self.descriptors[definition['@id']] = definition
+        return 201, copy.deepcopy(definition)
+
+    def _get_descriptor(self, match, query, body, headers):
+        return 200, copy.deepcopy(self._get(self.descriptors, match['id'], 'descriptor'))
@@ -21,6 +21,8 @@ def get_jwt_token(ims_host, org_id, tech_acct, api_key, priv_key):
     :param priv_key: private key counter part to the public key which was used for creating Adobe IO integration
     :return: encoded jwt token
     """
+    # the claims use the bare host, also when the config gives the ims host with a scheme
+    ims_host = ims_host.split('://', 1)[-1]
 
     # create payload
     payload = {
@@ -41,7 +43,7 @@ def get_jwt_token(ims_host, org_id, tech_acct, api_key, priv_key):
 
 
 def get_access_token(ims_host, ims_endpoint_jwt, org_id, tech_acct, api_key,
-                     client_secret, priv_key):
+                     client_secret, priv_key, session=None):
     """
     :param ims_host: ims host
     :param ims_endpoint_jwt: endpoint for exchange jwt
@@ -50,9 +52,11 @@ def get_access_token(ims_host, ims_endpoint_jwt, org_id, tech_acct, api_key,
     :param api_key: api key (obtained from Adobe IO integration)
     :param client_secret: client secret (obtained from Adobe IO integration)
     :param priv_key : private key
+    :param session: optional requests session to send the exchange through
     :return: access token for the apis
     """
-    url = "https://" + ims_host + ims_endpoint_jwt
+    # ims_host may include a scheme, e.g. http://127.0.0.1:8080 for a local emulator
+    url = (ims_host if '://' in ims_host else "https://" + ims_host) + ims_endpoint_jwt
 
     headers = {
         "Content-Type": "application/x-www-form-urlencoded",
@@ -67,7 +71,7 @@ def get_access_token(ims_host, ims_endpoint_jwt, org_id, tech_acct, api_key,
     body = urlencode(body_credentials)
 
     # send http post request
-    res_text = http_request("post", url, headers, body)
+    res_text = http_request("post", url, headers, body, session=session)
     access_token = json.loads(res_text)["access_token"]
     LOGGER.debug("access_token: %s", access_token)
     return access_token
@@ -80,8 +84,9 @@ def token_expiration_millis():
     dt = datetime.datetime.now()
     return int(dt.timestamp()*1000) + 24 * 60 * 60 * 1000
 
-def get_token(cfg):
+def get_token(cfg, session=None):
     """
+    :param session: optional requests session to send the token exchange through
     :return: ims token for authorization
     """
     ims_token = dictor(cfg, "Platform" + ".ims_token", checknone=True)
@@ -101,14 +106,15 @@ def get_token(cfg):
         priv_key=dictor(cfg, "Enterprise" + ".priv_key", checknone=True)
         priv_key_bytes = base64.b64decode(priv_key.encode('ascii'))
         ims_token = "Bearer " + get_access_token(ims_host, ims_endpoint_jwt, org_id, tech_acct, api_key,
-                                                 client_secret, priv_key_bytes)
+                                                 client_secret, priv_key_bytes, session=session)
     if not ims_token.startswith("Bearer "):
         ims_token = "Bearer " + ims_token
 
     return ims_token
 
-def get_headers(cfg):
+def get_headers(cfg, session=None):
     """
+    :param session: optional requests session to send the token exchange through
     :return: headers
     """
     api_key = dictor(cfg, "Enterprise" + ".api_key", checknone=True)
@@ -116,7 +122,7 @@ def get_headers(cfg):
     sandbox_name = dictor(cfg, "Titles" + '.sandbox_name', default="prod")
     platform_gateway = dictor(cfg, "Platform" + ".platform_gateway", checknone=True)
     headers = {}
-    ims_token = get_token(cfg)
+    ims_token = get_token(cfg, session)
     if ims_token is not None:
         if platform_gateway == 'https://platform.adobe.io': # AEP
             headers = {
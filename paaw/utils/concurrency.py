@@ -0,0 +1,69 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, List, Tuple
+
+
+class RateLimiter:
+    def __init__(self, rate: float, burst: int = 1):
+        """ Token bucket that limits the number of calls per second. Shared by
+        all worker threads, so the limit holds for the total request rate.
+
+        :param rate: The number of calls allowed per second. None or 0 disables the limit.
+        :type rate: float
+        :param burst: How many calls can be made at once before the rate applies, defaults to 1
+        :type burst: int, optional
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """ Blocks until a call is allowed under the rate limit.
+        """
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def run_concurrently(func: Callable, items: Iterable, max_workers: int = 8,
+                     rate_limiter: RateLimiter = None) -> List[Tuple[Any, Any, Exception]]:
+    """ Calls func for every item on a thread pool. Errors are collected instead
+    of raised, so one failing item does not stop the others.
+
+    :param func: Function that takes a single item.
+    :type func: Callable
+    :param items: The items to process.
+    :type items: Iterable
+    :param max_workers: Maximum number of concurrent calls, defaults to 8
+    :type max_workers: int, optional
+    :param rate_limiter: Limits the rate at which calls are started, defaults to None
+    :type rate_limiter: RateLimiter, optional
+    :return: Per item (in input order) a tuple of the item, the result and the raised exception.
+    Either the result or the exception is None.
+    :rtype: List[Tuple[Any, Any, Exception]]
+    """
+    def call(item):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            return item, func(item), None
+        except Exception as e:
+            return item, None, e
+
+    items = list(items)
+    if not items:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items)))) as executor:
+        return list(executor.map(call, items))
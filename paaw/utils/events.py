@@ -0,0 +1,278 @@
+import base64
+import hashlib
+import hmac
+import json
+import threading
+import urllib.parse
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Tuple
+import requests
+from ..exc import JobFailed
+from .general_utils import setup_logger
+from .transport import default_session
+from .waiter import JobWaiter, resolve_future
+
+LOGGER = setup_logger(__name__)
+
+ID_KEYS = ('flowRunId', 'runId', 'experimentRunId', 'jobId', 'segmentJobId', 'id')
+STATUS_KEYS = ('status', 'state', 'runStatus', 'jobStatus')
+
+
+def sign_payload(body: bytes, client_secret: str) -> str:
+    """ Computes the Adobe I/O events signature (x-adobe-signature) of a body:
+    the base64 encoded HMAC-SHA256 of the body with the client secret as key.
+
+    :param body: The raw request body.
+    :type body: bytes
+    :param client_secret: The client secret of the Adobe I/O integration.
+    :type client_secret: str
+    :return: The signature.
+    :rtype: str
+    """
+    digest = hmac.new(client_secret.encode('utf-8'), body, hashlib.sha256).digest()
+    return base64.b64encode(digest).decode('ascii')
+
+
+def hmac_verifier(client_secret: str) -> Callable:
+    """ Creates a verifier that checks the x-adobe-signature header.
+
+    :param client_secret: The client secret of the Adobe I/O integration.
+    :type client_secret: str
+    :return: Verifier that takes the headers and raw body and returns whether the signature is valid.
+    :rtype: Callable
+    """
+    def verify(headers: Dict, body: bytes) -> bool:
+        signature = _header(headers, 'x-adobe-signature')
+        return signature is not None and hmac.compare_digest(signature, sign_payload(body, client_secret))
+    return verify
+
+
+def rsa_verifier(public_keys_pem: Tuple[bytes]) -> Callable:
+    """ Creates a verifier for the digital signatures (x-adobe-digital-signature-1/2)
+    Adobe I/O sends with every event. The event is valid when any of the signatures
+    verifies with any of the public keys.
+
+    :param public_keys_pem: The Adobe I/O public keys in PEM format.
+    :type public_keys_pem: Tuple[bytes]
+    :return: Verifier that takes the headers and raw body and returns whether a signature is valid.
+    :rtype: Callable
+    """
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import padding
+    public_keys = [serialization.load_pem_public_key(pem) for pem in public_keys_pem]
+
+    def verify(headers: Dict, body: bytes) -> bool:
+        for header in ('x-adobe-digital-signature-1', 'x-adobe-digital-signature-2'):
+            signature = _header(headers, header)
+            if signature is None:
+                continue
+            for public_key in public_keys:
+                try:
+                    public_key.verify(base64.b64decode(signature), body, padding.PKCS1v15(), hashes.SHA256())
+                    return True
+                except (InvalidSignature, ValueError):
+                    continue
+        return False
+    return verify
+
+
+def default_event_parser(payload: Dict) -> Tuple[str, str]:
+    """ Finds the id of the run or job and its status in an event payload. Looks
+    through the event body (also nested under 'event' and 'data') for the first
+    known id and status key.
+
+    :param payload: The parsed event payload.
+    :type payload: Dict
+    :return: The job id and status, either can be None when not found.
+    :rtype: Tuple[str, str]
+    """
+    candidates = [payload]
+    for key in ('event', 'data', 'body'):
+        nested = [node[key] for node in candidates if isinstance(node.get(key), dict)]
+        candidates.extend(nested)
+    candidates.reverse()  # the most nested node describes the run itself
+    job_id = next((node[key] for key in ID_KEYS for node in candidates if node.get(key)), None)
+    status = next((node[key] for key in STATUS_KEYS for node in candidates if node.get(key)), None)
+    return job_id, status
+
+
+def _header(headers: Dict, name: str) -> str:
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+class EventReceiver:
+    def __init__(self, verifier: Callable = None, client_secret: str = None,
+                 event_parser: Callable = default_event_parser, waiter: JobWaiter = None):
+        """ Receives Adobe I/O event webhooks and resolves the futures of the jobs
+        (FlowRun, SegmentJob, ExperimentRun) that are waited on. Jobs for which no event
+        arrives before their deadline are polled by a JobWaiter instead.
+
+        The receiver can run its own small http server (start) or be plugged into an
+        existing web application by passing each webhook request to handle.
+
+        :param verifier: Takes the headers and raw body, returns whether the signature is valid,
+        defaults to an hmac_verifier for client_secret
+        :type verifier: Callable, optional
+        :param client_secret: Client secret used for the x-adobe-signature check, defaults to None
+        :type client_secret: str, optional
+        :param event_parser: Extracts the job id and status from an event payload,
+        defaults to default_event_parser
+        :type event_parser: Callable, optional
+        :param waiter: Waiter used for the polling fallback, defaults to a new JobWaiter
+        :type waiter: JobWaiter, optional
+        :raises ValueError: Raised when neither a verifier nor a client_secret is passed.
+        """
+        if verifier is None:
+            if client_secret is None:
+                raise ValueError('Pass a verifier or client_secret to verify the event signatures')
+            verifier = hmac_verifier(client_secret)
+        self.verifier = verifier
+        self.event_parser = event_parser
+        self.waiter = waiter if waiter is not None else JobWaiter()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def expect(self, job, deadline: float = 300, timeout: float = None, callback: Callable = None) -> Future:
+        """ Waits for a job through events. When no event arrives within deadline
+        seconds, the job is polled instead.
+
+        :param job: The job to wait on.
+        :param deadline: Seconds to wait for an event before polling starts, defaults to 300
+        :type deadline: float, optional
+        :param timeout: Seconds after which the job fails with JobTimeout, defaults to None
+        :type timeout: float, optional
+        :param callback: Called with the job and its future once the job is done, defaults to None
+        :type callback: Callable, optional
+        :return: Future that resolves to the event payload (or the last status response when
+        polled), or raises JobFailed or JobTimeout.
+        :rtype: Future
+        """
+        future = self.waiter.add(job, timeout=timeout, callback=callback, initial_delay=deadline)
+        with self._lock:
+            self._jobs[str(job.id)] = (job, future)
+        future.add_done_callback(lambda f: self._forget(str(job.id), f))
+        self.waiter.start()
+        return future
+
+    def _forget(self, job_id: str, future: Future):
+        with self._lock:
+            if job_id in self._jobs and self._jobs[job_id][1] is future:
+                del self._jobs[job_id]
+
+    def handle(self, headers: Dict, body: bytes, query: Dict = None) -> Tuple[int, bytes]:
+        """ Handles one webhook request. Answers the challenge Adobe I/O sends when
+        registering the webhook, verifies the signature and resolves the future of the
+        job the event is about.
+
+        :param headers: The request headers.
+        :type headers: Dict
+        :param body: The raw request body.
+        :type body: bytes
+        :param query: The query parameters of the request, defaults to None
+        :type query: Dict, optional
+        :return: The http status code and body to respond with.
+        :rtype: Tuple[int, bytes]
+        """
+        query = query or {}
+        if 'challenge' in query:
+            return 200, json.dumps({'challenge': query['challenge']}).encode('utf-8')
+        if not self.verifier(headers, body):
+            LOGGER.warning("Rejected event with an invalid signature")
+            return 401, b'invalid signature'
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return 400, b'invalid json'
+        job_id, status = self.event_parser(payload)
+        with self._lock:
+            job, future = self._jobs.get(str(job_id), (None, None))
+        if job is None:
+            LOGGER.debug("Ignored event for untracked job %s", job_id)
+            return 200, b''
+        if status in job.succeeded_states:
+            resolve_future(future, payload)
+        elif status in job.failed_states:
+            resolve_future(future, error=JobFailed('Job {} failed with status {}'.format(job_id, status)))
+        return 200, b''
+
+    def start(self, host: str = '127.0.0.1', port: int = 0) -> 'EventReceiver':
+        """ Starts an http server in a background thread that passes every request to handle.
+
+        :param host: Interface to listen on, defaults to '127.0.0.1'
+        :type host: str, optional
+        :param port: Port to listen on, 0 picks a free port, defaults to 0
+        :type port: int, optional
+        :return: This receiver
+        :rtype: EventReceiver
+        """
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _respond(self, body: bytes):
+                parsed = urllib.parse.urlparse(self.path)
+                query = dict(urllib.parse.parse_qsl(parsed.query))
+                code, response = receiver.handle(dict(self.headers.items()), body, query)
+                self.send_response(code)
+                self.send_header('Content-Length', str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def do_GET(self):
+                self._respond(b'')
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                self._respond(self.rfile.read(length))
+
+            def log_message(self, format, *args):
+                LOGGER.debug(format, *args)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, name='paaw-eventreceiver', daemon=True)
+        self._thread.start()
+        return self
+
+    @property
+    def url(self) -> str:
+        """ The url of the embedded server, to register as webhook.
+
+        :return: The url
+        :rtype: str
+        """
+        host, port = self._server.server_address[:2]
+        return 'http://{}:{}/'.format(host, port)
+
+    def stop(self):
+        """ Stops the embedded server and the polling fallback.
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        self.waiter.stop()
+
+
+def send_event(url: str, payload: Dict, client_secret: str) -> requests.Response:
+    """ Sends a signed fake event to a receiver, the way Adobe I/O would. Meant to
+    test event handling end-to-end without Adobe I/O.
+
+    :param url: The url of the receiver.
+    :type url: str
+    :param payload: The event payload.
+    :type payload: Dict
+    :param client_secret: The secret to sign the payload with.
+    :type client_secret: str
+    :return: The response of the receiver.
+    :rtype: requests.Response
+    """
+    body = json.dumps(payload).encode('utf-8')
+    headers = {'Content-Type': 'application/json',
+               'x-adobe-signature': sign_payload(body, client_secret)}
+    return default_session().post(url, data=body, headers=headers)
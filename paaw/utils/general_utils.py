@@ -5,9 +5,8 @@ import warnings
 from functools import wraps
 import os
 import copy
-import time
-from dictor import dictor
-import json
+from .instrumentation import body_size, call_with_hooks
+from .transport import default_session
 
 # TODO: add flags in CLI to set logging level
 def setup_logger(name, logging_level=logging.INFO):
@@ -35,16 +34,19 @@ def setup_logger(name, logging_level=logging.INFO):
     return logger
 
 
-def http_request(method, url, headers, data=None, **kwargs):
+def http_request(method, url, headers, data=None, session=None, **kwargs):
     """
     Request util
     :param method: GET or POST or PUT
     :param url: url
     :param headers: headers
     :param data: optional data (needed for POST)
+    :param session: optional requests session, defaults to the shared session of the default transport
     :return: response text
     """
-    response = requests.request(method, url, headers=headers, data=data, **kwargs)
+    requester = session if session is not None else default_session()
+    response = call_with_hooks(lambda: requester.request(method, url, headers=headers, data=data, **kwargs),
+                               method.upper(), url, request_bytes=body_size(data, headers))
     if response.status_code == 207:
         warnings.warn("HTTP status code 207 (multi-status), check response contents for individual status.")
     if response.status_code == 202:
@@ -75,23 +77,32 @@ def get_aep_config(path=None):
     return cfg
 
 def poll_for_status(status_path, wait, failure, success, poll_url,
-                   header, initial_wait, poll_wait, poll_tries, logger):
+                   header, initial_wait, poll_wait, poll_tries, logger, session=None, backoff=1.0,
+                   max_interval=120):
+    """
+    Polls a status url until the process finished, through the JobWaiter engine
+    :param status_path: dot path to the status in the response
+    :param wait: status while the process runs
+    :param failure: status when the process failed
+    :param success: status when the process succeeded
+    :param poll_url: url that returns the status
+    :param header: headers for the status request
+    :param initial_wait: seconds before the first poll
+    :param poll_wait: seconds between polls
+    :param poll_tries: maximum number of polls
+    :param logger: logger
+    :param session: optional requests session to reuse pooled connections
+    :param backoff: factor the wait grows with per poll, 1.0 keeps it fixed
+    :param max_interval: maximum seconds between polls when backoff is above 1.0
+    :return: the status response on success
+    """
+    from .waiter import JobWaiter, PollJob
     logger.info("Waiting {} seconds before inital poll".format(initial_wait))
-    time.sleep(initial_wait)
-    for n_try in range(poll_tries):
-        res_dict = json.loads(http_request("get", poll_url, header))
-        status = dictor(res_dict, status_path)
-        logger.info("status is {} for poll {}".format(status, n_try))
-        if status == success:
-            logger.info("Process has finished successfully")
-            return res_dict
-        elif status == wait:
-            logger.info("Waiting {} seconds".format(poll_wait))
-            time.sleep(poll_wait)
-        elif status == failure:
-            raise Exception("The process has failed (status {})".format(status))
-        else:
-            raise Exception("""Unknown status {}. Expecting status: "
-        {} for success,
-        {} for wait,
-        {} for failure""".format(status, success, wait, failure))
\ No newline at end of file
+    job = PollJob(poll_url, status_path, success, wait, failure, session=session, headers=header)
+    waiter = JobWaiter(initial_interval=poll_wait, max_interval=max(poll_wait, max_interval),
+                       backoff=backoff, jitter=0, max_poll_errors=1)
+    future = waiter.add(job, initial_delay=initial_wait, max_polls=poll_tries)
+    waiter.run()
+    res_dict = future.result()
+    logger.info("Process has finished successfully")
+    return res_dict
@@ -0,0 +1,358 @@
+import bisect
+import logging
+import threading
+import time
+import urllib.parse
+from typing import Callable, Dict, List
+
+# upper bounds in seconds of the latency histogram buckets, as used by Prometheus clients
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_GLOBAL_HOOKS = []
+
+
+class RequestInfo:
+    def __init__(self, method: str, url: str, path: str = None, attempt: int = 1, request_bytes: int = 0):
+        """ Describes one outgoing http request, passed to the hooks before and after it is sent.
+
+        :param method: The http method.
+        :type method: str
+        :param url: The complete url, without query parameters.
+        :type url: str
+        :param path: The dot path of the endpoint in known_endpoints, defaults to the url path
+        :type path: str, optional
+        :param attempt: 1 for the first try, higher for retries, defaults to 1
+        :type attempt: int, optional
+        :param request_bytes: Size of the request body, defaults to 0
+        :type request_bytes: int, optional
+        """
+        self.method = method
+        self.url = url
+        self.path = path or urllib.parse.urlparse(url).path
+        self.attempt = attempt
+        self.request_bytes = request_bytes
+        self.start = time.monotonic()
+        self.duration = None
+        self.status = None
+        self.response_bytes = 0
+        self.error = None
+        # scratch space for hooks, e.g. an open span
+        self.context = {}
+
+    def finish(self, response=None, error: Exception = None, stream: bool = False):
+        """ Records the outcome of the request.
+
+        :param response: The response, defaults to None
+        :type response: requests.Response, optional
+        :param error: The exception raised while sending, defaults to None
+        :type error: Exception, optional
+        :param stream: Whether the body is streamed; its size is then taken from
+        Content-Length instead of reading it, defaults to False
+        :type stream: bool, optional
+        """
+        self.duration = time.monotonic() - self.start
+        self.error = error
+        if response is not None:
+            self.status = response.status_code
+            if stream:
+                self.response_bytes = int(response.headers.get('Content-Length') or 0)
+            else:
+                self.response_bytes = len(response.content or b'')
+
+
+class Hook:
+    """ Base class of request hooks. Subclasses override before, after and/or event.
+    Exceptions raised by hooks are logged and do not affect the request.
+    """
+
+    def before(self, info: RequestInfo):
+        pass
+
+    def after(self, info: RequestInfo):
+        pass
+
+    def event(self, path: str, name: str):
+        """ Called for what happens around requests: hedge_sent, hedge_won, short_circuited,
+        circuit_opened and circuit_closed.
+        """
+        pass
+
+
+def add_hook(hook: Hook):
+    """ Adds a hook that sees every request of every AEP instance, and the requests
+    made through general_utils.http_request (authentication, status polling).
+
+    :param hook: The hook
+    :type hook: Hook
+    """
+    _GLOBAL_HOOKS.append(hook)
+
+
+def remove_hook(hook: Hook):
+    """ Removes a hook added with add_hook.
+
+    :param hook: The hook
+    :type hook: Hook
+    """
+    _GLOBAL_HOOKS.remove(hook)
+
+
+def body_size(data, headers: Dict = None) -> int:
+    """ Size of a request body, without consuming streamed bodies.
+
+    :param data: The body.
+    :param headers: The request headers, Content-Length is used for streamed bodies, defaults to None
+    :type headers: Dict, optional
+    :return: The size in bytes, 0 when unknown.
+    :rtype: int
+    """
+    if isinstance(data, (bytes, bytearray)):
+        return len(data)
+    if isinstance(data, str):
+        return len(data.encode('utf-8'))
+    for key, value in (headers or {}).items():
+        if key.lower() == 'content-length':
+            return int(value)
+    return getattr(data, 'len', 0) or 0
+
+
+def _call_hooks(hooks: List[Hook], stage: str, *args):
+    for hook in hooks:
+        try:
+            getattr(hook, stage)(*args)
+        except Exception:
+            logging.getLogger(__name__).exception("Request hook %s failed", hook)
+
+
+def emit_event(hooks: List[Hook], path: str, name: str):
+    """ Reports an event of an endpoint to the hooks and the global hooks.
+
+    :param hooks: Hooks besides the global hooks.
+    :type hooks: List[Hook]
+    :param path: The dot path of the endpoint.
+    :type path: str
+    :param name: The event, see Hook.event.
+    :type name: str
+    """
+    _call_hooks(list(hooks) + _GLOBAL_HOOKS, 'event', path, name)
+
+
+def call_with_hooks(send: Callable, method: str, url: str, hooks: List[Hook] = (), path: str = None,
+                    attempt: int = 1, request_bytes: int = 0, stream: bool = False):
+    """ Sends a request through send and runs the hooks around it. Without hooks,
+    send is called directly.
+
+    :param send: Sends the request and returns the response.
+    :type send: Callable
+    :param method: The http method.
+    :type method: str
+    :param url: The complete url.
+    :type url: str
+    :param hooks: Hooks besides the global hooks, defaults to ()
+    :type hooks: List[Hook], optional
+    :param path: The dot path of the endpoint, defaults to None
+    :type path: str, optional
+    :param attempt: 1 for the first try, higher for retries, defaults to 1
+    :type attempt: int, optional
+    :param request_bytes: Size of the request body, defaults to 0
+    :type request_bytes: int, optional
+    :param stream: Whether the response body is streamed, defaults to False
+    :type stream: bool, optional
+    :return: The response of send.
+    :rtype: requests.Response
+    """
+    hooks = list(hooks) + _GLOBAL_HOOKS
+    if not hooks:
+        return send()
+    info = RequestInfo(method, url, path, attempt, request_bytes)
+    _call_hooks(hooks, 'before', info)
+    try:
+        response = send()
+    except Exception as e:
+        info.finish(error=e)
+        _call_hooks(reversed(hooks), 'after', info)
+        raise
+    info.finish(response, stream=stream)
+    _call_hooks(reversed(hooks), 'after', info)
+    return response
+
+
+class LoggingHook(Hook):
+    def __init__(self, logger: logging.Logger = None, level: int = logging.DEBUG):
+        """ Logs every request with its status, duration and sizes.
+
+        :param logger: The logger, defaults to the logger of this module
+        :type logger: logging.Logger, optional
+        :param level: The level to log at, defaults to logging.DEBUG
+        :type level: int, optional
+        """
+        self.logger = logger or logging.getLogger(__name__)
+        self.level = level
+
+    def after(self, info: RequestInfo):
+        self.logger.log(self.level, "%s %s (%s) -> %s in %.3fs, %s bytes out, %s bytes in%s",
+                        info.method, info.url, info.path, info.status or info.error, info.duration,
+                        info.request_bytes, info.response_bytes,
+                        ' (retry {})'.format(info.attempt - 1) if info.attempt > 1 else '')
+
+
+class _PathMetrics:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.statuses = {}
+        self.retries = 0
+        self.errors = 0
+
+
+class MetricsCollector(Hook):
+    def __init__(self):
+        """ Collects per endpoint dot path the request count, a latency histogram,
+        bytes sent and received, status codes, retries and connection errors, and
+        the hedging and circuit breaker events.
+        """
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._events = {}
+
+    def event(self, path: str, name: str):
+        with self._lock:
+            self._events[(path, name)] = self._events.get((path, name), 0) + 1
+
+    def after(self, info: RequestInfo):
+        with self._lock:
+            metrics = self._metrics.setdefault((info.path, info.method), _PathMetrics())
+            metrics.count += 1
+            metrics.seconds += info.duration
+            metrics.buckets[bisect.bisect_left(LATENCY_BUCKETS, info.duration)] += 1
+            metrics.bytes_out += info.request_bytes
+            metrics.bytes_in += info.response_bytes
+            if info.status is not None:
+                metrics.statuses[info.status] = metrics.statuses.get(info.status, 0) + 1
+            else:
+                metrics.errors += 1
+            if info.attempt > 1:
+                metrics.retries += 1
+
+    def reset(self):
+        """ Clears all collected metrics.
+        """
+        with self._lock:
+            self._metrics = {}
+            self._events = {}
+
+    @staticmethod
+    def _quantile(metrics: _PathMetrics, q: float) -> float:
+        # the upper bound of the bucket that holds the quantile
+        rank = q * metrics.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS + (float('inf'),), metrics.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def summary(self) -> List[Dict]:
+        """ The metrics per dot path and method, the slowest endpoints (by total time) first.
+        The p50 and p95 are the upper bounds of the histogram bucket that holds them.
+
+        :return: Per dot path and method the count, total and mean seconds, p50 and p95,
+        bytes out and in, status codes, retries and errors.
+        :rtype: List[Dict]
+        """
+        with self._lock:
+            rows = [{'path': path, 'method': method, 'count': m.count, 'seconds': m.seconds,
+                     'mean_seconds': m.seconds / m.count, 'p50': self._quantile(m, 0.5),
+                     'p95': self._quantile(m, 0.95), 'bytes_out': m.bytes_out, 'bytes_in': m.bytes_in,
+                     'statuses': dict(m.statuses), 'retries': m.retries, 'errors': m.errors}
+                    for (path, method), m in self._metrics.items()]
+        return sorted(rows, key=lambda row: row['seconds'], reverse=True)
+
+    def events(self) -> Dict:
+        """ The number of hedging and circuit breaker events per dot path.
+
+        :return: Per dot path the count per event name.
+        :rtype: Dict
+        """
+        events = {}
+        with self._lock:
+            for (path, name), count in self._events.items():
+                events.setdefault(path, {})[name] = count
+        return events
+
+    def to_prometheus(self, prefix: str = 'paaw') -> str:
+        """ Exports the metrics in the Prometheus text exposition format.
+
+        :param prefix: Prefix of the metric names, defaults to 'paaw'
+        :type prefix: str, optional
+        :return: The metrics as text.
+        :rtype: str
+        """
+        lines = ['# HELP {}_request_duration_seconds Latency of AEP requests.'.format(prefix),
+                 '# TYPE {}_request_duration_seconds histogram'.format(prefix)]
+        counters = {'request_bytes_total': [], 'response_bytes_total': [], 'responses_total': [],
+                    'retries_total': [], 'request_errors_total': []}
+        with self._lock:
+            for (path, method), m in sorted(self._metrics.items()):
+                labels = 'path="{}",method="{}"'.format(path, method)
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), m.buckets):
+                    cumulative += count
+                    lines.append('{}_request_duration_seconds_bucket{{{},le="{}"}} {}'.format(
+                        prefix, labels, bound, cumulative))
+                lines.append('{}_request_duration_seconds_sum{{{}}} {}'.format(prefix, labels, m.seconds))
+                lines.append('{}_request_duration_seconds_count{{{}}} {}'.format(prefix, labels, m.count))
+                counters['request_bytes_total'].append('{{{}}} {}'.format(labels, m.bytes_out))
+                counters['response_bytes_total'].append('{{{}}} {}'.format(labels, m.bytes_in))
+                for status, count in sorted(m.statuses.items()):
+                    counters['responses_total'].append('{{{},status="{}"}} {}'.format(labels, status, count))
+                counters['retries_total'].append('{{{}}} {}'.format(labels, m.retries))
+                counters['request_errors_total'].append('{{{}}} {}'.format(labels, m.errors))
+            counters['transport_events_total'] = ['{{path="{}",event="{}"}} {}'.format(path, name, count)
+                                                  for (path, name), count in sorted(self._events.items())]
+        for name, samples in counters.items():
+            lines.append('# TYPE {}_{} counter'.format(prefix, name))
+            lines.extend('{}_{}{}'.format(prefix, name, sample) for sample in samples)
+        return '\n'.join(lines) + '\n'
+
+
+class OpenTelemetryHook(Hook):
+    def __init__(self, tracer=None):
+        """ Records every request as an OpenTelemetry client span. Needs the
+        opentelemetry-api package.
+
+        :param tracer: The tracer to create spans with, defaults to the tracer 'paaw'
+        of the global tracer provider
+        """
+        if tracer is None:
+            from opentelemetry import trace
+            tracer = trace.get_tracer('paaw')
+        from opentelemetry.trace import SpanKind
+        self.tracer = tracer
+        self.kind = SpanKind.CLIENT
+
+    def before(self, info: RequestInfo):
+        span = self.tracer.start_span('{} {}'.format(info.method, info.path), kind=self.kind)
+        span.set_attribute('http.method', info.method)
+        span.set_attribute('http.url', info.url)
+        span.set_attribute('paaw.path', info.path)
+        span.set_attribute('paaw.attempt', info.attempt)
+        info.context['span'] = span
+
+    def after(self, info: RequestInfo):
+        span = info.context.pop('span', None)
+        if span is None:
+            return
+        if info.status is not None:
+            span.set_attribute('http.status_code', info.status)
+        span.set_attribute('http.request_content_length', info.request_bytes)
+        span.set_attribute('http.response_content_length', info.response_bytes)
+        if info.error is not None:
+            span.record_exception(info.error)
+        if info.error is not None or (info.status or 0) >= 400:
+            from opentelemetry.trace import Status, StatusCode
+            span.set_status(Status(StatusCode.ERROR))
+        span.end()
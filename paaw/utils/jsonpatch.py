@@ -0,0 +1,96 @@
+import copy
+from typing import Dict, List, Tuple
+from ..exc import InvalidPatchOperation
+
+OPERATIONS = ('add', 'remove', 'replace', 'move', 'copy', 'test')
+
+
+def _split_pointer(pointer: str) -> List[str]:
+    if pointer == '':
+        return []
+    if not pointer.startswith('/'):
+        raise InvalidPatchOperation('Path {} should start with a /'.format(pointer))
+    return [step.replace('~1', '/').replace('~0', '~') for step in pointer[1:].split('/')]
+
+
+def _parent(document: object, pointer: str) -> Tuple[object, str]:
+    """ Walks to the container of the last step of a json pointer.
+    """
+    steps = _split_pointer(pointer)
+    if not steps:
+        raise InvalidPatchOperation('Can not patch the root of the document')
+    node = document
+    for step in steps[:-1]:
+        try:
+            node = node[int(step)] if isinstance(node, list) else node[step]
+        except (KeyError, IndexError, ValueError, TypeError):
+            raise InvalidPatchOperation('Path {} does not exist'.format(pointer))
+    if not isinstance(node, (dict, list)):
+        raise InvalidPatchOperation('Parent of {} is not an object or array'.format(pointer))
+    return node, steps[-1]
+
+
+def _get(document: object, pointer: str) -> object:
+    container, key = _parent(document, pointer)
+    try:
+        return container[int(key)] if isinstance(container, list) else container[key]
+    except (KeyError, IndexError, ValueError):
+        raise InvalidPatchOperation('Path {} does not exist'.format(pointer))
+
+
+def _remove(document: object, pointer: str) -> object:
+    container, key = _parent(document, pointer)
+    _get(document, pointer)
+    return container.pop(int(key)) if isinstance(container, list) else container.pop(key)
+
+
+def _add(document: object, pointer: str, value: object):
+    container, key = _parent(document, pointer)
+    if isinstance(container, list):
+        if key == '-':
+            container.append(value)
+            return
+        try:
+            index = int(key)
+        except ValueError:
+            raise InvalidPatchOperation('{} is not a valid array index'.format(pointer))
+        if not 0 <= index <= len(container):
+            raise InvalidPatchOperation('Index of {} is out of range'.format(pointer))
+        container.insert(index, value)
+    else:
+        container[key] = value
+
+
+def apply_operation(document: object, operation: Dict) -> object:
+    """ Applies one JSON-Patch operation (RFC 6902) to a document in place. Raises
+    when the operation does not fit the document, e.g. a replace of a path that
+    does not exist.
+
+    :param document: The document to patch.
+    :type document: object
+    :param operation: The operation with op, path and value or from.
+    :type operation: Dict
+    :raises InvalidPatchOperation: Raised when the operation is not valid for the document.
+    :return: The patched document.
+    :rtype: object
+    """
+    op = operation.get('op')
+    path = operation.get('path', '')
+    if op not in OPERATIONS:
+        raise InvalidPatchOperation('Unknown operation {}'.format(op))
+    if op in ('add', 'replace', 'test') and 'value' not in operation:
+        raise InvalidPatchOperation('Operation {} on {} needs a value'.format(op, path))
+    if op == 'add':
+        _add(document, path, copy.deepcopy(operation['value']))
+    elif op == 'remove':
+        _remove(document, path)
+    elif op == 'replace':
+        _remove(document, path)
+        _add(document, path, copy.deepcopy(operation['value']))
+    elif op == 'move':
+        _add(document, path, _remove(document, operation['from']))
+    elif op == 'copy':
+        _add(document, path, copy.deepcopy(_get(document, operation['from'])))
+    elif _get(document, path) != operation['value']:
+        raise InvalidPatchOperation('Test of {} failed'.format(path))
+    return document
@@ -0,0 +1,253 @@
+import collections
+import concurrent.futures
+import threading
+import time
+from typing import Callable, Dict, List
+import requests
+from ..exc import CircuitOpen
+from .instrumentation import Hook, emit_event
+
+# minimum number of observed latencies before the hedge delay follows them
+MIN_SAMPLES = 20
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> concurrent.futures.ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(max_workers=64, thread_name_prefix='paaw-hedge')
+        return _executor
+
+
+class HedgePolicy:
+    def __init__(self, quantile: float = 0.95, min_delay: float = 0.05, max_delay: float = 10.0,
+                 initial_delay: float = 2.0, window: int = 200):
+        """ When to send a duplicate of a slow GET: after the given quantile of the recent
+        latencies of the endpoint, bounded by min_delay and max_delay.
+
+        :param quantile: Quantile of the recent latencies to wait for, defaults to 0.95
+        :type quantile: float, optional
+        :param min_delay: Shortest delay in seconds, defaults to 0.05
+        :type min_delay: float, optional
+        :param max_delay: Longest delay in seconds, defaults to 10.0
+        :type max_delay: float, optional
+        :param initial_delay: Delay until enough latencies are observed, defaults to 2.0
+        :type initial_delay: float, optional
+        :param window: Number of recent latencies to keep, defaults to 200
+        :type window: int, optional
+        """
+        self.quantile = quantile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.initial_delay = initial_delay
+        self._latencies = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        """ Records the latency of a successful request.
+
+        :param seconds: The latency.
+        :type seconds: float
+        """
+        with self._lock:
+            self._latencies.append(seconds)
+
+    @property
+    def delay(self) -> float:
+        """ Seconds to wait for a response before sending the duplicate.
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if len(latencies) < MIN_SAMPLES:
+            delay = self.initial_delay
+        else:
+            delay = latencies[min(int(self.quantile * len(latencies)), len(latencies) - 1)]
+        return min(max(delay, self.min_delay), self.max_delay)
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """ Fails fast while an endpoint is down. After failure_threshold consecutive failures
+        (connection errors, timeouts and 5xx responses) the circuit opens and requests raise
+        CircuitOpen without being sent. After reset_timeout seconds one trial request is let
+        through; its success closes the circuit, its failure opens it again.
+
+        :param failure_threshold: Consecutive failures that open the circuit, defaults to 5
+        :type failure_threshold: int, optional
+        :param reset_timeout: Seconds the circuit stays open, defaults to 30.0
+        :type reset_timeout: float, optional
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """ Whether a request may be sent now. In the half open state only one trial is let through.
+
+        :return: True when the request may be sent.
+        :rtype: bool
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def release(self):
+        """ Ends a trial request without an outcome, so another trial can be let through.
+        """
+        with self._lock:
+            self._trial_running = False
+
+    def record(self, failed: bool) -> str:
+        """ Records the outcome of a sent request.
+
+        :param failed: Whether the request failed.
+        :type failed: bool
+        :return: 'opened' or 'closed' when the state changed because of it, otherwise None.
+        :rtype: str
+        """
+        with self._lock:
+            self._trial_running = False
+            if not failed:
+                self.failures = 0
+                if self.state != self.CLOSED:
+                    self.state = self.CLOSED
+                    return 'closed'
+                return None
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                return 'opened'
+            return None
+
+
+def _close_response(future: concurrent.futures.Future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def hedged_call(send: Callable[[bool], requests.Response], delay: float, path: str = None,
+                hooks: List[Hook] = ()) -> requests.Response:
+    """ Calls send, and calls it a second time when no response arrived within delay.
+    The first response wins; the other one is closed when it arrives. An exception
+    only counts when both calls fail.
+
+    :param send: Sends the request, called with True for the duplicate.
+    :type send: Callable[[bool], requests.Response]
+    :param delay: Seconds to wait before sending the duplicate.
+    :type delay: float
+    :param path: Dot path of the endpoint, for the hedge_sent and hedge_won events, defaults to None
+    :type path: str, optional
+    :param hooks: Hooks to report the events to, besides the global hooks, defaults to ()
+    :type hooks: List[Hook], optional
+    :return: The first response.
+    :rtype: requests.Response
+    """
+    executor = _get_executor()
+    primary = executor.submit(send, False)
+    done, _ = concurrent.futures.wait([primary], timeout=delay)
+    if done:
+        return primary.result()
+    emit_event(hooks, path, 'hedge_sent')
+    hedge = executor.submit(send, True)
+    pending = {primary, hedge}
+    error = None
+    while pending:
+        done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is not None:
+                error = future.exception()
+                continue
+            for other in (done | pending) - {future}:
+                other.add_done_callback(_close_response)
+            if future is hedge:
+                emit_event(hooks, path, 'hedge_won')
+            return future.result()
+    raise error
+
+
+class EndpointPolicy:
+    def __init__(self, hedge: Dict = None, circuit_breaker: Dict = None):
+        """ The hedging and circuit breaker of one endpoint, from the hedge and circuit_breaker
+        settings of its entry in known_endpoints.yaml (or AEP.configure_endpoint):
+
+            dataset:
+              endpoint_url: ...
+              hedge: {quantile: 0.95, max_delay: 5}
+              circuit_breaker: {failure_threshold: 5, reset_timeout: 30}
+
+        An empty mapping enables the feature with its defaults.
+
+        :param hedge: Arguments of HedgePolicy, defaults to None (no hedging)
+        :type hedge: Dict, optional
+        :param circuit_breaker: Arguments of CircuitBreaker, defaults to None (no circuit breaker)
+        :type circuit_breaker: Dict, optional
+        """
+        self.hedge = HedgePolicy(**hedge) if hedge is not None else None
+        self.circuit_breaker = CircuitBreaker(**circuit_breaker) if circuit_breaker is not None else None
+
+    def call(self, send: Callable[[bool], requests.Response], method: str, path: str, hooks: List[Hook] = (),
+             replayable: bool = True) -> requests.Response:
+        """ Sends a request under this policy. Only replayable GET requests are hedged.
+
+        :param send: Sends the request, called with True for a hedged duplicate.
+        :type send: Callable[[bool], requests.Response]
+        :param method: The http method.
+        :type method: str
+        :param path: The dot path of the endpoint.
+        :type path: str
+        :param hooks: Hooks to report events to, besides the global hooks, defaults to ()
+        :type hooks: List[Hook], optional
+        :param replayable: Whether the request body can be sent twice, defaults to True
+        :type replayable: bool, optional
+        :raises CircuitOpen: Raised without sending when the circuit of the endpoint is open.
+        :return: The response.
+        :rtype: requests.Response
+        """
+        breaker = self.circuit_breaker
+        if breaker is not None and not breaker.allow():
+            emit_event(hooks, path, 'short_circuited')
+            raise CircuitOpen('Circuit of {} is open after {} failures, retry after {}s'.format(
+                path, breaker.failures, breaker.reset_timeout))
+        start = time.monotonic()
+        try:
+            if self.hedge is not None and method == 'GET' and replayable:
+                response = hedged_call(send, self.hedge.delay, path, hooks)
+            else:
+                response = send(False)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            self._record(True, path, hooks)
+            raise
+        except BaseException:
+            # not an outcome of the endpoint, e.g. an interrupt
+            if breaker is not None:
+                breaker.release()
+            raise
+        self._record(response.status_code >= 500, path, hooks)
+        if self.hedge is not None and response.status_code < 400:
+            self.hedge.observe(time.monotonic() - start)
+        return response
+
+    def _record(self, failed: bool, path: str, hooks: List[Hook]):
+        if self.circuit_breaker is None:
+            return
+        change = self.circuit_breaker.record(failed)
+        if change is not None:
+            emit_event(hooks, path, 'circuit_' + change)
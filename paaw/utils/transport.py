@@ -0,0 +1,257 @@
+import gzip
+import threading
+from typing import Dict
+import requests
+from dictor import dictor
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+COMPRESSED_METHODS = ('POST', 'PUT', 'PATCH')
+
+_default_session = None
+_default_lock = threading.Lock()
+
+
+class TransportConfig:
+    def __init__(self, pool_connections: int = 10, pool_maxsize: int = 16, connect_timeout: float = 10,
+                 read_timeout: float = 300, keep_alive: bool = True, accept_encoding: str = 'gzip, deflate',
+                 compress_requests: bool = False, compress_min_bytes: int = 1024 * 1024, http2: bool = False):
+        """ Settings of the connections all paaw requests are sent over. Read from the
+        Transport block of aep_config.yaml, where every setting is optional:
+
+            Transport:
+              pool_maxsize: 32
+              read_timeout: 600
+              compress_requests: true
+              http2: true
+
+        :param pool_connections: Number of hosts to keep a connection pool for, defaults to 10
+        :type pool_connections: int, optional
+        :param pool_maxsize: Connections kept open per host, set it to at least the number
+        of threads making requests, defaults to 16
+        :type pool_maxsize: int, optional
+        :param connect_timeout: Seconds to wait for a connection, defaults to 10
+        :type connect_timeout: float, optional
+        :param read_timeout: Seconds to wait for the next bytes of a response, defaults to 300
+        :type read_timeout: float, optional
+        :param keep_alive: Reuse connections between requests, defaults to True
+        :type keep_alive: bool, optional
+        :param accept_encoding: The Accept-Encoding header, e.g. identity to receive uncompressed
+        responses, defaults to 'gzip, deflate'
+        :type accept_encoding: str, optional
+        :param compress_requests: Gzip POST, PUT and PATCH bodies of at least compress_min_bytes,
+        defaults to False
+        :type compress_requests: bool, optional
+        :param compress_min_bytes: Smallest body that is compressed, defaults to 1 MiB
+        :type compress_min_bytes: int, optional
+        :param http2: Send requests over HTTP/2 through httpx, which needs the httpx[http2]
+        package, defaults to False
+        :type http2: bool, optional
+        """
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.keep_alive = keep_alive
+        self.accept_encoding = accept_encoding
+        self.compress_requests = compress_requests
+        self.compress_min_bytes = compress_min_bytes
+        self.http2 = http2
+
+    @classmethod
+    def from_config(cls, cfg: Dict, **overrides) -> 'TransportConfig':
+        """ Reads the Transport block of a parsed aep_config.yaml.
+
+        :param cfg: The parsed config.
+        :type cfg: Dict
+        :param overrides: Settings that take precedence over the config, None values are ignored.
+        :return: The transport config.
+        :rtype: TransportConfig
+        """
+        settings = dict(dictor(cfg, "Transport") or {})
+        settings.update({key: value for key, value in overrides.items() if value is not None})
+        return cls(**settings)
+
+    @property
+    def timeout(self):
+        return (self.connect_timeout, self.read_timeout)
+
+
+def compress_body(request: requests.PreparedRequest, config: TransportConfig):
+    """ Gzips the body of a prepared request in place when the config asks for it.
+    Streamed bodies and bodies that are already encoded are sent as they are.
+
+    :param request: The request.
+    :type request: requests.PreparedRequest
+    :param config: The transport config.
+    :type config: TransportConfig
+    """
+    body = request.body
+    if not config.compress_requests or request.method not in COMPRESSED_METHODS \
+            or 'Content-Encoding' in request.headers:
+        return
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    if not isinstance(body, bytes) or len(body) < config.compress_min_bytes:
+        return
+    request.body = gzip.compress(body, compresslevel=5)
+    request.headers['Content-Encoding'] = 'gzip'
+    request.headers['Content-Length'] = str(len(request.body))
+
+
+class TransportAdapter(HTTPAdapter):
+    def __init__(self, config: TransportConfig):
+        """ HTTP/1.1 adapter with the pool sizes, default timeouts and request compression of the config.
+
+        :param config: The transport config.
+        :type config: TransportConfig
+        """
+        # HTTPAdapter uses self.config itself
+        self.transport = config
+        super().__init__(pool_connections=config.pool_connections, pool_maxsize=config.pool_maxsize)
+
+    def send(self, request: requests.PreparedRequest, timeout=None, **kwargs) -> requests.Response:
+        compress_body(request, self.transport)
+        return super().send(request, timeout=timeout if timeout is not None else self.transport.timeout, **kwargs)
+
+
+class _HttpxRaw:
+    """ File-like view on a streamed httpx response, as requests expects of Response.raw.
+    """
+
+    def __init__(self, response):
+        self._response = response
+        self._chunks = None
+        self._buffer = b''
+
+    def stream(self, amt: int = 65536, decode_content: bool = True):
+        yield from self._response.iter_bytes(amt)
+        self._response.close()
+
+    def read(self, amt: int = None, **kwargs) -> bytes:
+        if self._chunks is None:
+            self._chunks = self._response.iter_bytes()
+        while amt is None or len(self._buffer) < amt:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if amt is None:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+        return data
+
+    def close(self):
+        self._response.close()
+
+    def release_conn(self):
+        self._response.close()
+
+
+class Http2Adapter(BaseAdapter):
+    def __init__(self, config: TransportConfig):
+        """ Sends requests over HTTP/2 with httpx, which multiplexes concurrent requests
+        over one connection per host. Needs the httpx[http2] package.
+
+        :param config: The transport config.
+        :type config: TransportConfig
+        :raises ImportError: Raised when httpx is not installed.
+        """
+        super().__init__()
+        try:
+            import httpx
+        except ImportError as e:
+            raise ImportError('Transport.http2 needs the httpx[http2] package') from e
+        self._httpx = httpx
+        self.transport = config
+        limits = httpx.Limits(max_connections=config.pool_connections * config.pool_maxsize,
+                              max_keepalive_connections=config.pool_maxsize if config.keep_alive else 0)
+        self._client = httpx.Client(http2=True, limits=limits, follow_redirects=False,
+                                    timeout=httpx.Timeout(config.read_timeout, connect=config.connect_timeout))
+
+    def send(self, request: requests.PreparedRequest, stream: bool = False, timeout=None, verify=True, cert=None,
+             proxies=None) -> requests.Response:
+        httpx = self._httpx
+        compress_body(request, self.transport)
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        elif timeout is None:
+            timeout = self._client.timeout
+        body = request.body
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        elif body is not None and not isinstance(body, bytes) and hasattr(body, 'read'):
+            stream = body
+            body = iter(lambda: stream.read(65536), b'')
+        # httpx sets the transfer headers itself
+        headers = [(name, value) for name, value in request.headers.items()
+                   if name.lower() not in ('content-length', 'transfer-encoding', 'connection')]
+        httpx_request = self._client.build_request(request.method, request.url, headers=headers, content=body,
+                                                   timeout=timeout)
+        try:
+            httpx_response = self._client.send(httpx_request, stream=True)
+        except httpx.ConnectTimeout as e:
+            raise requests.exceptions.ConnectTimeout(e, request=request)
+        except httpx.ReadTimeout as e:
+            raise requests.exceptions.ReadTimeout(e, request=request)
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(e, request=request)
+        response = requests.Response()
+        response.status_code = httpx_response.status_code
+        response.reason = httpx_response.reason_phrase
+        response.headers = CaseInsensitiveDict(httpx_response.headers.items())
+        # httpx decodes the content, so it no longer has the transfer encoding
+        response.headers.pop('Content-Encoding', None)
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response.raw = _HttpxRaw(httpx_response)
+        if not stream:
+            try:
+                response._content = httpx_response.read()
+            except httpx.TransportError as e:
+                raise requests.exceptions.ConnectionError(e, request=request)
+            finally:
+                httpx_response.close()
+        return response
+
+    def close(self):
+        self._client.close()
+
+
+def create_session(config: TransportConfig = None, headers: Dict = None) -> requests.Session:
+    """ A session that sends its requests over the transport of the config.
+
+    :param config: The transport config, defaults to TransportConfig()
+    :type config: TransportConfig, optional
+    :param headers: Headers to send with every request, defaults to None
+    :type headers: Dict, optional
+    :return: The session.
+    :rtype: requests.Session
+    """
+    config = config or TransportConfig()
+    session = requests.Session()
+    adapter = Http2Adapter(config) if config.http2 else TransportAdapter(config)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['Accept-Encoding'] = config.accept_encoding
+    if not config.keep_alive:
+        session.headers['Connection'] = 'close'
+    session.headers.update(headers or {})
+    return session
+
+
+def default_session() -> requests.Session:
+    """ The shared session for requests made outside an AEP instance, like the IMS token
+    exchange and status polling, with the default transport config.
+
+    :return: The session.
+    :rtype: requests.Session
+    """
+    global _default_session
+    with _default_lock:
+        if _default_session is None:
+            _default_session = create_session()
+        return _default_session
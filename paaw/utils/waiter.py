@@ -0,0 +1,359 @@
+import asyncio
+import heapq
+import itertools
+import json
+import random
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from typing import Callable, Dict, Iterable, List
+from dictor import dictor
+from ..exc import JobFailed, JobTimeout
+from .general_utils import setup_logger, http_request
+
+LOGGER = setup_logger(__name__)
+
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+
+def job_state(job, result: Dict) -> str:
+    """ Maps the status response of a job to RUNNING, SUCCEEDED or FAILED.
+    A job describes its states through status_from, succeeded_states and
+    failed_states. States that are neither succeeded nor failed count as running.
+
+    :param job: The job that was polled.
+    :param result: The response of job.poll_status().
+    :type result: Dict
+    :return: One of RUNNING, SUCCEEDED or FAILED.
+    :rtype: str
+    """
+    status = job.status_from(result)
+    if status in job.succeeded_states:
+        return SUCCEEDED
+    if status in job.failed_states:
+        return FAILED
+    return RUNNING
+
+
+def resolve_future(future: Future, result=None, error: Exception = None) -> bool:
+    """ Resolves a future, unless it was already resolved elsewhere (for example by
+    an event that arrived while the job was being polled).
+
+    :param future: The future to resolve.
+    :type future: Future
+    :param result: The result to set, defaults to None
+    :param error: The exception to set instead of a result, defaults to None
+    :type error: Exception, optional
+    :return: Whether this call resolved the future.
+    :rtype: bool
+    """
+    try:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        return False
+    return True
+
+
+class PollJob:
+    def __init__(self, poll_url: str, status_path: str, success: str, wait: str, failure: str,
+                 session=None, headers: Dict = None):
+        """ A job that is polled through a plain status url, for jobs that are not
+        represented by an AEPObject. Statuses other than success, wait and failure
+        are treated as a failure.
+
+        :param poll_url: The url that returns the status.
+        :type poll_url: str
+        :param status_path: Dot path to the status in the response (dictor notation).
+        :type status_path: str
+        :param success: The status on success.
+        :type success: str
+        :param wait: The status while running.
+        :type wait: str
+        :param failure: The status on failure.
+        :type failure: str
+        :param session: Session to make the requests with, defaults to None
+        :type session: requests.Session, optional
+        :param headers: Headers for the status request, defaults to None
+        :type headers: Dict, optional
+        """
+        self.id = poll_url
+        self.poll_url = poll_url
+        self.status_path = status_path
+        self.succeeded_states = (success,)
+        self.failed_states = (failure,)
+        self.wait = wait
+        self.session = session
+        self.headers = headers or {}
+
+    def poll_status(self) -> Dict:
+        """ Retrieves the status through a get request on the poll url.
+
+        :return: The parsed status response.
+        :rtype: Dict
+        """
+        return json.loads(http_request("get", self.poll_url, self.headers, session=self.session))
+
+    def status_from(self, result: Dict) -> str:
+        """ Extracts the status from a status response.
+
+        :param result: The status response
+        :type result: Dict
+        :raises Exception: Raised for an unknown status.
+        :return: The status.
+        :rtype: str
+        """
+        status = dictor(result, self.status_path)
+        if status not in self.succeeded_states + self.failed_states + (self.wait,):
+            raise Exception("""Unknown status {}. Expecting status: "
+        {} for success,
+        {} for wait,
+        {} for failure""".format(status, self.succeeded_states[0], self.wait, self.failed_states[0]))
+        return status
+
+
+class _Entry:
+    def __init__(self, job, future: Future, deadline: float, interval: float, max_polls: int):
+        self.job = job
+        self.future = future
+        self.deadline = deadline
+        self.interval = interval
+        self.max_polls = max_polls
+        self.polls = 0
+        self.errors = 0
+        self.last_status = None
+
+
+class JobWaiter:
+    def __init__(self, initial_interval: float = 5, max_interval: float = 120,
+                 backoff: float = 1.5, jitter: float = 0.2, max_poll_errors: int = 5):
+        """ Waits on many jobs of mixed types (FlowRun, SegmentJob, ExperimentRun, PollJob)
+        in a single loop. Every job is polled on its own schedule: the interval grows
+        exponentially while the status stays the same, and resets when the status changes.
+        Jitter spreads the polls so they don't all hit AEP at once.
+
+        A job needs a poll_status method, a status_from method that extracts the status
+        from the poll result, and succeeded_states and failed_states.
+
+        :param initial_interval: Seconds until the first poll, defaults to 5
+        :type initial_interval: float, optional
+        :param max_interval: Maximum seconds between two polls of a job, defaults to 120
+        :type max_interval: float, optional
+        :param backoff: Factor the interval grows with per unchanged poll, defaults to 1.5
+        :type backoff: float, optional
+        :param jitter: Relative random spread on every interval, defaults to 0.2
+        :type jitter: float, optional
+        :param max_poll_errors: Consecutive failing polls after which the job fails, defaults to 5
+        :type max_poll_errors: int, optional
+        """
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.max_poll_errors = max_poll_errors
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def add(self, job, timeout: float = None, callback: Callable = None,
+            initial_delay: float = None, max_polls: int = None) -> Future:
+        """ Starts tracking a job.
+
+        :param job: The job to wait on.
+        :param timeout: Seconds after which the job fails with JobTimeout, defaults to None
+        :type timeout: float, optional
+        :param callback: Called with the job and its future once the job is done, defaults to None
+        :type callback: Callable, optional
+        :param initial_delay: Seconds until the first poll, defaults to initial_interval
+        :type initial_delay: float, optional
+        :param max_polls: Maximum number of polls before the job fails with JobTimeout, defaults to None
+        :type max_polls: int, optional
+        :return: Future that resolves to the last status response, or raises JobFailed or JobTimeout.
+        Cancelling the future stops the polling of this job.
+        :rtype: Future
+        """
+        now = time.monotonic()
+        future = Future()
+        deadline = now + timeout if timeout is not None else None
+        entry = _Entry(job, future, deadline, self.initial_interval, max_polls)
+        if callback is not None:
+            future.add_done_callback(lambda f: callback(job, f))
+        delay = self.initial_interval if initial_delay is None else initial_delay
+        self._push(entry, now + delay)
+        return future
+
+    def _push(self, entry: _Entry, due: float):
+        if entry.deadline is not None:
+            due = min(due, entry.deadline)
+        with self._cond:
+            heapq.heappush(self._heap, (due, next(self._counter), entry))
+            self._cond.notify()
+
+    def _next_due(self, entry: _Entry) -> float:
+        spread = 1 + random.uniform(-self.jitter, self.jitter)
+        return time.monotonic() + entry.interval * spread
+
+    def _poll(self, entry: _Entry):
+        """ Polls one job and either resolves its future or schedules the next poll.
+        """
+        if entry.future.done():
+            return
+        if entry.deadline is not None and time.monotonic() >= entry.deadline:
+            resolve_future(entry.future, error=JobTimeout('Job {} did not finish in time'.format(entry.job.id)))
+            return
+        try:
+            result = entry.job.poll_status()
+            state = job_state(entry.job, result)
+        except Exception as e:
+            entry.errors += 1
+            if entry.errors >= self.max_poll_errors:
+                resolve_future(entry.future, error=e)
+                return
+            LOGGER.debug("poll %s of job %s failed: %s", entry.errors, entry.job.id, e)
+            entry.interval = min(entry.interval * self.backoff, self.max_interval)
+            self._push(entry, self._next_due(entry))
+            return
+        entry.errors = 0
+        entry.polls += 1
+        if state == SUCCEEDED:
+            resolve_future(entry.future, result)
+            return
+        if state == FAILED:
+            resolve_future(entry.future, error=JobFailed('Job {} failed with status {}'.format(
+                entry.job.id, entry.job.status_from(result))))
+            return
+        if entry.max_polls is not None and entry.polls >= entry.max_polls:
+            resolve_future(entry.future, error=JobTimeout('Job {} did not finish in {} polls'.format(
+                entry.job.id, entry.polls)))
+            return
+        status = entry.job.status_from(result)
+        if status != entry.last_status:
+            entry.interval = self.initial_interval
+        else:
+            entry.interval = min(entry.interval * self.backoff, self.max_interval)
+        entry.last_status = status
+        self._push(entry, self._next_due(entry))
+
+    def _pop_due(self, stop_when_idle: bool) -> _Entry:
+        """ Blocks until a job is due for polling. Returns None when the loop should stop.
+        """
+        with self._cond:
+            while True:
+                if self._stopped:
+                    return None
+                if not self._heap:
+                    if stop_when_idle:
+                        return None
+                    self._cond.wait()
+                    continue
+                due = self._heap[0][0]
+                now = time.monotonic()
+                if due <= now:
+                    return heapq.heappop(self._heap)[2]
+                self._cond.wait(due - now)
+
+    def run(self):
+        """ Polls in the calling thread until all tracked jobs are done.
+        """
+        while True:
+            entry = self._pop_due(stop_when_idle=True)
+            if entry is None:
+                return
+            self._poll(entry)
+
+    def start(self) -> 'JobWaiter':
+        """ Runs the polling loop in one background thread, so jobs can be added
+        and their futures awaited from other threads.
+
+        :return: This waiter
+        :rtype: JobWaiter
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped = False
+
+            def loop():
+                while True:
+                    entry = self._pop_due(stop_when_idle=False)
+                    if entry is None:
+                        return
+                    self._poll(entry)
+            self._thread = threading.Thread(target=loop, name='paaw-jobwaiter', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """ Stops the background polling loop. Jobs that are still tracked stay unresolved.
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    async def run_async(self):
+        """ Polls from an asyncio event loop until all tracked jobs are done. The polls
+        themselves are blocking requests and run in the default executor, one at a time.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                if not self._heap:
+                    return
+                due = self._heap[0][0]
+            delay = due - time.monotonic()
+            if delay > 0:
+                # sleep in short steps, so jobs added in the meantime are picked up in time
+                await asyncio.sleep(min(delay, 1))
+                continue
+            with self._cond:
+                entry = heapq.heappop(self._heap)[2]
+            await loop.run_in_executor(None, self._poll, entry)
+
+
+def wait_for_jobs(jobs: Iterable, timeout: float = None, raise_on_failure: bool = True,
+                  **waiter_kwargs) -> List:
+    """ Waits for a number of jobs in a single polling loop.
+
+    :param jobs: The jobs to wait for.
+    :type jobs: Iterable
+    :param timeout: Timeout in seconds per job, defaults to None
+    :type timeout: float, optional
+    :param raise_on_failure: Whether to raise the first failure. Otherwise the exception
+    is returned in place of the status, defaults to True
+    :type raise_on_failure: bool, optional
+    :return: Per job the final status response (or exception).
+    :rtype: List
+    """
+    waiter = JobWaiter(**waiter_kwargs)
+    futures = [waiter.add(job, timeout=timeout) for job in jobs]
+    waiter.run()
+    results = []
+    for future in futures:
+        error = future.exception()
+        if error is not None and raise_on_failure:
+            raise error
+        results.append(error if error is not None else future.result())
+    return results
+
+
+async def wait_for_jobs_async(jobs: Iterable, timeout: float = None, **waiter_kwargs) -> List:
+    """ Asyncio version of wait_for_jobs. Failures are returned in place of the status.
+
+    :param jobs: The jobs to wait for.
+    :type jobs: Iterable
+    :param timeout: Timeout in seconds per job, defaults to None
+    :type timeout: float, optional
+    :return: Per job the final status response or exception.
+    :rtype: List
+    """
+    waiter = JobWaiter(**waiter_kwargs)
+    futures = [waiter.add(job, timeout=timeout) for job in jobs]
+    await waiter.run_async()
+    return [future.exception() or future.result() for future in futures]
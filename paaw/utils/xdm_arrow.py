@@ -0,0 +1,164 @@
+from typing import Dict, List
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# XDM types of fields that are stored as a number, keyed on meta:xdmType or type
+XDM_NUMBER_TYPES = {
+    'byte': pa.int8(),
+    'short': pa.int16(),
+    'int': pa.int32(),
+    'long': pa.int64(),
+    'integer': pa.int64(),
+    'number': pa.float64(),
+    'double': pa.float64(),
+}
+
+
+def _merge_properties(target: Dict, properties: Dict):
+    """ Adds properties to target. When both define the same object (for example the
+    tenant namespace that every fieldgroup adds fields to), their properties are merged.
+    """
+    for name, prop in properties.items():
+        if name in target and 'properties' in target[name] and 'properties' in prop:
+            merged = dict(target[name])
+            merged['properties'] = dict(target[name]['properties'])
+            _merge_properties(merged['properties'], prop['properties'])
+            merged['required'] = list(target[name].get('required', [])) + list(prop.get('required', []))
+            target[name] = merged
+        else:
+            target[name] = prop
+
+
+def collect_properties(node: Dict) -> Dict:
+    """ Collects the properties of a resolved XDM definition, including those of
+    the classes and fieldgroups in its allOf.
+
+    :param node: A resolved XDM definition (see SchemaRegistry.resolve).
+    :type node: Dict
+    :return: The properties keyed on field name.
+    :rtype: Dict
+    """
+    properties = {}
+    for part in node.get('allOf', []):
+        _merge_properties(properties, collect_properties(part))
+    _merge_properties(properties, node.get('properties', {}))
+    return properties
+
+
+def collect_required(node: Dict) -> List[str]:
+    """ Collects the required field names of a resolved XDM definition, including
+    those of the classes and fieldgroups in its allOf.
+
+    :param node: A resolved XDM definition.
+    :type node: Dict
+    :return: The required field names.
+    :rtype: List[str]
+    """
+    required = list(node.get('required', []))
+    for part in node.get('allOf', []):
+        required.extend(collect_required(part))
+    return required
+
+
+def xdm_to_arrow_type(prop: Dict) -> pa.DataType:
+    """ Compiles the XDM definition of a single field to an arrow type.
+
+    :param prop: The resolved XDM definition of the field.
+    :type prop: Dict
+    :return: The arrow type.
+    :rtype: pa.DataType
+    """
+    xdm_type = prop.get('meta:xdmType', prop.get('type'))
+    if isinstance(xdm_type, list):
+        xdm_type = next((t for t in xdm_type if t != 'null'), 'string')
+    if xdm_type == 'string':
+        if prop.get('format') == 'date':
+            return pa.date32()
+        if prop.get('format') == 'date-time':
+            return pa.timestamp('us')
+        return pa.string()
+    if xdm_type == 'date':
+        return pa.date32()
+    if xdm_type == 'date-time':
+        return pa.timestamp('us')
+    if xdm_type in XDM_NUMBER_TYPES:
+        return XDM_NUMBER_TYPES[xdm_type]
+    if xdm_type == 'boolean':
+        return pa.bool_()
+    if xdm_type == 'array':
+        return pa.list_(xdm_to_arrow_type(prop.get('items', {})))
+    if xdm_type == 'map' or (xdm_type == 'object' and 'additionalProperties' in prop and not prop.get('properties')):
+        return pa.map_(pa.string(), xdm_to_arrow_type(prop.get('additionalProperties', {})))
+    properties = collect_properties(prop)
+    if properties:
+        return pa.struct(_fields(properties, collect_required(prop)))
+    return pa.string()
+
+
+def _fields(properties: Dict, required: List[str]) -> List[pa.Field]:
+    fields = []
+    for name, prop in properties.items():
+        metadata = {'xdm:required': 'true'} if name in required else None
+        fields.append(pa.field(name, xdm_to_arrow_type(prop), nullable=True, metadata=metadata))
+    return fields
+
+
+def xdm_to_arrow_schema(resolved: Dict) -> pa.Schema:
+    """ Compiles a resolved XDM schema to an arrow schema. Objects become structs,
+    arrays lists and maps maps. All fields are nullable, because exported data does not
+    enforce required fields; required fields carry 'xdm:required' in their metadata.
+
+    :param resolved: The resolved schema definition (see SchemaRegistry.resolve).
+    :type resolved: Dict
+    :return: The arrow schema.
+    :rtype: pa.Schema
+    """
+    metadata = {'xdm:$id': resolved.get('$id', ''), 'xdm:version': str(resolved.get('version', ''))}
+    return pa.schema(_fields(collect_properties(resolved), collect_required(resolved)), metadata=metadata)
+
+
+def flatten_table(table: pa.Table) -> pa.Table:
+    """ Flattens all nested structs of a table to dotted column names, in arrow.
+
+    :param table: The table to flatten.
+    :type table: pa.Table
+    :return: The flattened table.
+    :rtype: pa.Table
+    """
+    while any(pa.types.is_struct(field.type) for field in table.schema):
+        table = table.flatten()
+    return table
+
+
+def conform_table(table: pa.Table, arrow_schema: pa.Schema) -> pa.Table:
+    """ Makes an outgoing table match an arrow schema: columns are put in schema order,
+    missing columns are added as nulls and types are cast safely.
+
+    :param table: The table to conform.
+    :type table: pa.Table
+    :param arrow_schema: The schema the data should have, from xdm_to_arrow_schema.
+    :type arrow_schema: pa.Schema
+    :raises ValueError: Raised for columns that are not in the schema, for required
+    columns that are missing and for columns that can not be cast to the schema type.
+    :return: The conformed table.
+    :rtype: pa.Table
+    """
+    unknown = [name for name in table.column_names if arrow_schema.get_field_index(name) < 0]
+    if unknown:
+        raise ValueError('Columns not in the schema: {}'.format(unknown))
+    columns = []
+    errors = []
+    for field in arrow_schema:
+        if field.name not in table.column_names:
+            if field.metadata and field.metadata.get(b'xdm:required') == b'true':
+                errors.append('{}: required column is missing'.format(field.name))
+                continue
+            columns.append(pa.nulls(table.num_rows, type=field.type))
+            continue
+        try:
+            columns.append(pc.cast(table.column(field.name), field.type, safe=True))
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+            errors.append('{}: {}'.format(field.name, e))
+    if errors:
+        raise ValueError('Table does not match the schema:\n' + '\n'.join(errors))
+    return pa.Table.from_arrays(columns, schema=arrow_schema)
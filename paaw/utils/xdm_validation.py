@@ -0,0 +1,237 @@
+from typing import Dict, List, Tuple, Union
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from .xdm_arrow import collect_properties, collect_required, xdm_to_arrow_type
+
+
+class ValidationResult:
+    def __init__(self, num_rows: int, masks: Dict[str, np.ndarray]):
+        """ The outcome of validating a table. Per rule there is a boolean mask
+        that is True for the rows that break the rule.
+
+        :param num_rows: Number of rows in the validated table.
+        :type num_rows: int
+        :param masks: Boolean error mask per rule, keyed on '<field path>:<rule>'.
+        :type masks: Dict[str, np.ndarray]
+        """
+        self.num_rows = num_rows
+        self.masks = masks
+        self.error_mask = np.zeros(num_rows, dtype=bool)
+        for mask in masks.values():
+            self.error_mask |= mask
+
+    @property
+    def is_valid(self) -> bool:
+        """ Whether all rows are valid.
+
+        :return: True when no rule is broken.
+        :rtype: bool
+        """
+        return not self.error_mask.any()
+
+    def summary(self) -> Dict:
+        """ Summary statistics of the validation.
+
+        :return: Number of rows, invalid rows and the number of errors per rule (only broken rules).
+        :rtype: Dict
+        """
+        errors = {rule: int(mask.sum()) for rule, mask in self.masks.items() if mask.any()}
+        return {'rows': self.num_rows,
+                'invalid_rows': int(self.error_mask.sum()),
+                'errors': errors}
+
+    def valid_rows(self, table: pa.Table) -> pa.Table:
+        """ Returns the rows of the validated table that passed all rules.
+
+        :param table: The table that was validated.
+        :type table: pa.Table
+        :return: The valid rows.
+        :rtype: pa.Table
+        """
+        return table.filter(pa.array(~self.error_mask))
+
+
+def _leaf_rules(properties: Dict, required: List[str], path: Tuple[str] = ()) -> List[Tuple]:
+    """ Compiles the rules for all fields that can be reached through objects
+    (fields inside arrays are only checked on type, as part of the array).
+    """
+    rules = []
+    for name, prop in properties.items():
+        field_path = path + (name,)
+        if name in required:
+            rules.append((field_path, 'required', None))
+        nested = collect_properties(prop)
+        xdm_type = prop.get('meta:xdmType', prop.get('type'))
+        if nested and xdm_type in (None, 'object'):
+            rules.extend(_leaf_rules(nested, collect_required(prop), field_path))
+            continue
+        rules.append((field_path, 'type', xdm_to_arrow_type(prop)))
+        enum = prop.get('enum') or list(prop.get('meta:enum', {}).keys())
+        if enum:
+            rules.append((field_path, 'enum', enum))
+        for key in ('pattern', 'minimum', 'maximum', 'minLength', 'maxLength'):
+            if key in prop:
+                rules.append((field_path, key, prop[key]))
+    return rules
+
+
+def _identity_rules(descriptors: List) -> List[Tuple]:
+    rules = []
+    for descriptor in descriptors or []:
+        definition = getattr(descriptor, 'definition', descriptor)
+        if definition.get('@type') != 'xdm:descriptorIdentity':
+            continue
+        field_path = tuple(step for step in definition['xdm:sourceProperty'].split('/') if step)
+        rules.append((field_path, 'identity', definition.get('xdm:namespace')))
+    return rules
+
+
+def _column(table: pa.Table, path: Tuple[str]):
+    """ Gets the column for a field path, from nested structs or from a dotted
+    (flattened) column. Also returns a mask of the rows in which the parent object exists.
+    """
+    dotted = '.'.join(path)
+    if dotted in table.column_names:
+        return table.column(dotted), None
+    if path[0] not in table.column_names:
+        return None, None
+    column = table.column(path[0])
+    parent_valid = None
+    for step in path[1:]:
+        if not pa.types.is_struct(column.type) or column.type.get_field_index(step) < 0:
+            return None, None
+        valid = pc.is_valid(column)
+        parent_valid = valid if parent_valid is None else pc.and_(parent_valid, valid)
+        column = pc.struct_field(column, [column.type.get_field_index(step)])
+    return column, parent_valid
+
+
+def _to_mask(mask) -> np.ndarray:
+    return np.asarray(pc.fill_null(mask, False).to_numpy(zero_copy_only=False), dtype=bool)
+
+
+# strings that match are not necessarily numbers, but strings that don't are never parsed as one
+_NUMBER_PATTERNS = (
+    (pa.types.is_integer, r'^[+-]?(0[xX])?[0-9a-fA-F]+$'),
+    (pa.types.is_floating, r'^[+-]?([0-9]*\.?[0-9]*([eE][+-]?[0-9]+)?|inf|infinity|nan)$'),
+)
+
+
+def _cast_errors(column, target: pa.DataType) -> np.ndarray:
+    """ Per row whether a non-null value can not be cast to the target type without losing
+    information. Strings are parsed, and strings that can not be numbers are found with a
+    regex first. Other values are lossless when an unsafe cast survives the round trip back
+    unchanged. When the cast of a slice fails, the slice is halved until the failing rows
+    are found, so only the slices around bad values are cast again.
+    """
+    mask = np.zeros(len(column), dtype=bool)
+    parsed = pa.types.is_string(column.type) or pa.types.is_large_string(column.type)
+    if parsed:
+        for is_target, pattern in _NUMBER_PATTERNS:
+            if is_target(target):
+                plausible = pc.fill_null(pc.match_substring_regex(column, pattern, ignore_case=True), True)
+                mask |= _to_mask(pc.invert(plausible))
+                column = pc.if_else(plausible, column, pa.scalar(None, column.type))
+    pending = [(0, len(column))]
+    while pending:
+        start, length = pending.pop()
+        part = column.slice(start, length)
+        try:
+            if parsed:
+                # a parse either fails or is exact, up to the notation, e.g. 0x10 or 1e3
+                pc.cast(part, target, safe=True)
+                continue
+            round_trip = pc.cast(pc.cast(part, target, safe=False), part.type, safe=False)
+        except pa.ArrowInvalid:
+            if length == 1:
+                mask[start] = part.null_count == 0
+            else:
+                half = length // 2
+                pending.extend([(start, half), (start + half, length - half)])
+            continue
+        lossy = pc.invert(pc.fill_null(pc.equal(round_trip, part), False))
+        mask[start:start + length] = _to_mask(pc.and_(pc.is_valid(part), lossy))
+    return mask
+
+
+class XDMValidator:
+    def __init__(self, resolved: Dict, descriptors: List = None):
+        """ Validates tables against an XDM schema in columnar form, before they are
+        ingested. The rules are compiled once from the schema: required fields, types,
+        enums, string patterns and lengths, minimum and maximum, and identity fields
+        from identity descriptors. Every rule is evaluated with vectorized arrow compute
+        functions over whole columns.
+
+        :param resolved: The resolved schema definition (see SchemaRegistry.resolve).
+        :type resolved: Dict
+        :param descriptors: Descriptor objects or definitions of the schema; identity
+        descriptors make their field required and non-empty, defaults to None
+        :type descriptors: List, optional
+        """
+        self.rules = _leaf_rules(collect_properties(resolved), collect_required(resolved))
+        self.rules.extend(_identity_rules(descriptors))
+
+    def _check(self, column, parent_valid, rule: str, param) -> np.ndarray:
+        if rule in ('required', 'identity'):
+            mask = pc.is_null(column)
+            if rule == 'identity' and pa.types.is_string(column.type):
+                mask = pc.or_(mask, pc.equal(pc.utf8_length(column), 0))
+            if parent_valid is not None and rule == 'required':
+                mask = pc.and_(mask, parent_valid)
+            return _to_mask(mask)
+        if rule == 'type':
+            if column.type.equals(param) or pa.types.is_null(column.type):
+                return None
+            try:
+                pc.cast(column, param, safe=True)
+                return None
+            except pa.ArrowNotImplementedError:
+                # no cast between the types at all
+                return _to_mask(pc.is_valid(column))
+            except pa.ArrowInvalid:
+                return _cast_errors(column, param)
+        if rule == 'enum':
+            unknown = pc.invert(pc.is_in(column, value_set=pa.array(param).cast(column.type)))
+            return _to_mask(pc.and_(unknown, pc.is_valid(column)))
+        if rule == 'pattern':
+            return _to_mask(pc.invert(pc.match_substring_regex(column, param)))
+        if rule == 'minimum':
+            return _to_mask(pc.less(column, param))
+        if rule == 'maximum':
+            return _to_mask(pc.greater(column, param))
+        if rule == 'minLength':
+            return _to_mask(pc.less(pc.utf8_length(column), param))
+        if rule == 'maxLength':
+            return _to_mask(pc.greater(pc.utf8_length(column), param))
+        raise ValueError('Unknown rule {}'.format(rule))
+
+    def validate(self, data: Union[pa.Table, pd.DataFrame]) -> ValidationResult:
+        """ Validates a table or dataframe. Nested fields are read from struct columns,
+        or from dotted column names in flattened data.
+
+        :param data: The data to validate.
+        :type data: Union[pa.Table, pd.DataFrame]
+        :return: The error masks per rule and summary statistics.
+        :rtype: ValidationResult
+        """
+        table = pa.Table.from_pandas(data, preserve_index=False) if isinstance(data, pd.DataFrame) else data
+        masks = {}
+        for path, rule, param in self.rules:
+            name = '{}:{}'.format('.'.join(path), rule)
+            column, parent_valid = _column(table, path)
+            if column is None:
+                # a missing nested column means its parent object is missing, which
+                # only breaks the rules of the parent
+                if rule == 'identity' or (rule == 'required' and len(path) == 1):
+                    masks[name] = np.ones(table.num_rows, dtype=bool)
+                continue
+            try:
+                mask = self._check(column, parent_valid, rule, param)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError):
+                # the column has a type the rule does not apply to, the type rule reports it
+                continue
+            if mask is not None:
+                masks[name] = mask
+        return ValidationResult(table.num_rows, masks)
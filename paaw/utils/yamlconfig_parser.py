@@ -5,7 +5,7 @@ from typing import List, Dict, Tuple
 
 def parse_config(path: str =None, data: str =None, 
                  env_tag: str ='!ENV', arg_tag: str ='!ARG', 
-                 arg_replacements: Dict ={}) -> Dict:
+                 arg_replacements: Dict ={}, keep_missing_args: bool =False) -> Dict:
     """Parses a yaml file by replacing keywords. Keyswords are indicated by ${}.
     The !ENV tag indicates the keyword should be retrieved from environment variables.
     The !ARG tag indicates the keyword should be retrieved from the passes arg_replacement dictionary.
@@ -20,13 +20,19 @@ def parse_config(path: str =None, data: str =None,
     :type arg_tag: str, optional
     :param arg_replacements: The key-value pairs to replace tagged variables with, defaults to {}
     :type arg_replacements: Dict, optional
+    :param keep_missing_args: Leave ${} placeholders without replacement in place instead of
+    raising, so the result can be used as a template for render_config, defaults to False
+    :type keep_missing_args: bool, optional
     :raises ValueError: Raised when one of the variables can not be found.
     :return: A parses yaml file as a dictionary.
     :rtype: Dict
     """
     # pattern for global vars: look for ${word}
     pattern = re.compile('.*?\${(\w+)}.*?')
-    loader = yaml.SafeLoader
+
+    # a loader class per call, so concurrent calls with other replacements do not interfere
+    class loader(yaml.SafeLoader):
+        pass
 
     # the tag will be used to mark where to start searching for the pattern
     # e.g. somekey: !ENV somestring${MYENVVAR}blah blah blah
@@ -58,6 +64,8 @@ def parse_config(path: str =None, data: str =None,
         if match:
             full_value = value
             for g in match:
+                if keep_missing_args and g not in arg_replacements:
+                    continue
                 full_value = full_value.replace(
                     f'${{{g}}}', arg_replacements[g]
                 )
@@ -73,4 +81,29 @@ def parse_config(path: str =None, data: str =None,
     elif data:
         return yaml.load(data, Loader=loader)
     else:
-        raise ValueError('Either a path or data should be defined as input')
\ No newline at end of file
+        raise ValueError('Either a path or data should be defined as input')
+
+
+def render_config(config: object, arg_replacements: Dict) -> object:
+    """Fills the ${} placeholders left in a config parsed with keep_missing_args.
+    A value that consists of a single placeholder gets the replacement as is, so
+    numbers and lists keep their type. Other placeholders are replaced as text.
+
+    :param config: The parsed config template.
+    :type config: object
+    :param arg_replacements: The key-value pairs to replace the placeholders with.
+    :type arg_replacements: Dict
+    :raises KeyError: Raised when a placeholder has no replacement.
+    :return: A copy of the config with all placeholders replaced.
+    :rtype: object
+    """
+    if isinstance(config, dict):
+        return {key: render_config(value, arg_replacements) for key, value in config.items()}
+    if isinstance(config, list):
+        return [render_config(value, arg_replacements) for value in config]
+    if isinstance(config, str):
+        whole = re.fullmatch(r'\$\{(\w+)\}', config)
+        if whole:
+            return arg_replacements[whole.group(1)]
+        return re.sub(r'\$\{(\w+)\}', lambda m: str(arg_replacements[m.group(1)]), config)
+    return config
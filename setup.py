@@ -21,6 +21,9 @@ setup(name='paaw',
           'pandas',
           'pyarrow'
       ],
+      extras_require={
+          'http2': ['httpx[http2]'],
+      },
       classifiers=[
         'Intended Audience :: Developers',
         'Programming Language :: Python :: >=2.7',